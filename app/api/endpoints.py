@@ -1,18 +1,21 @@
 # app/api/endpoints.py
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from datetime import date
 from typing import Optional
 import logging
 
+from app.core import profiling, shutdown
 from app.core.config import settings
-from app.db.bigquery_client import get_bq_writer
-from app.services import etl_service
+from app.db.warehouse import get_writer
+from app.services import etl_service, reconciliation, sheets_export, stock_sync
+from app.services.sync_lock import is_skipped
 
 router = APIRouter()
 
-# Inyección de dependencias para obtener el writer de BigQuery
+# Inyección de dependencias para obtener el writer del warehouse configurado
 def get_db():
-    writer = get_bq_writer()
+    writer = get_writer()
     yield writer
 
 @router.post("/etl/clean-and-reload", tags=["ETL"])
@@ -37,6 +40,8 @@ def clean_and_reload(db=Depends(get_db)):
         etl_service.sync_clients(db)
         etl_service.sync_products(db)
         etl_service.sync_documents(db)
+        if hasattr(db, "commit"):
+            db.commit()
         
         return {
             "status": "LIMPIEZA Y RECARGA COMPLETADA",
@@ -47,68 +52,158 @@ def clean_and_reload(db=Depends(get_db)):
         logging.error(f"Error durante limpieza y recarga: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+def _check_lock(entity: str, result):
+    """409 si la sincronización se omitió porque otra instancia tiene el lease de la entidad"""
+    if is_skipped(result):
+        raise HTTPException(status_code=409, detail=f"Sincronización de '{entity}' omitida: {result.entity} está "
+                                                    f"en curso en otra instancia ({result.holder}).")
+    return result
+
+def _run_sync(entity: str, start_date: Optional[str], db):
+    """Cuerpo de /etl/sync/{entity}, separado para poder ejecutarlo bajo el profiler"""
+    logging.info(f"Marcador: inicio run_sync para entidad '{entity}'")
+    
+    # Los resultados no se retienen: el espejo en Google Sheets se lee luego desde el warehouse
+    if entity == "all":
+        logging.info("Marcador: sync_clients")
+        _check_lock(entity, etl_service.sync_clients(db))
+        
+        logging.info("Marcador: sync_products")
+        _check_lock(entity, etl_service.sync_products(db))
+        
+        if hasattr(db, "commit"):
+            db.commit()
+        logging.info("Marcador: sync_documents")
+        _check_lock(entity, etl_service.sync_documents(db, start_date=start_date))
+        if hasattr(db, "commit"):
+            db.commit()
+        
+    elif entity == "clients":
+        logging.info("Marcador: sync_clients")
+        _check_lock(entity, etl_service.sync_clients(db))
+        if hasattr(db, "commit"):
+            db.commit()
+    elif entity == "products":
+        logging.info("Marcador: sync_products")
+        _check_lock(entity, etl_service.sync_products(db))
+        if hasattr(db, "commit"):
+            db.commit()
+    elif entity == "variants":
+        logging.info("Marcador: sync_products (modo variantes)")
+        _check_lock(entity, etl_service.sync_products(db, mode="variants"))
+        if hasattr(db, "commit"):
+            db.commit()
+    elif entity == "documents":
+        logging.info("Marcador: sync_documents")
+        _check_lock(entity, etl_service.sync_documents(db, start_date=start_date))
+        if hasattr(db, "commit"):
+            db.commit()
+    elif entity == "stock":
+        logging.info("Marcador: sync_stock")
+        _check_lock(entity, stock_sync.sync_stock(db))
+    else:
+        logging.error(f"Marcador: entidad '{entity}' no encontrada")
+        raise HTTPException(status_code=404, detail=f"Entidad '{entity}' no encontrada.")
+
+    # Sincronizar a Google Sheets (etapa de exportación independiente, desde el warehouse)
+    sheets_export.export_after_sync(db, entity)
+    logging.info(f"Marcador: fin run_sync para entidad '{entity}'")
+
 @router.post("/etl/sync/{entity}", tags=["ETL"])
-def run_sync(entity: str, start_date: Optional[str] = None, db=Depends(get_db)):
+def run_sync(entity: str, request: Request, start_date: Optional[str] = None, profile: bool = False, db=Depends(get_db)):
     """
     Ejecuta la sincronización para una entidad específica.
-    - Entidades válidas: 'clients', 'products', 'documents', 'all'.
+    - Entidades válidas: 'clients', 'products', 'variants', 'documents', 'stock', 'all'.
+    - 'stock' guarda la foto diaria de stock por variante y sucursal (no entra en 'all').
+    - 'variants' sincroniza una fila por cada variante activa (precios y costos desde índices masivos).
     - Para 'documents' y 'all', se puede usar el parámetro opcional 'start_date' (formato YYYY-MM-DD).
+    - 'profile=true' (o header X-ETL-Profile: 1) perfila la ejecución y devuelve el top de funciones por etapa.
+    - 'bigquery_costs' detalla los bytes estimados (dry-run) y facturados por tabla, y la estrategia de MERGE usada.
     """
     try:
-        logging.info(f"Marcador: inicio run_sync para entidad '{entity}'")
-        
-        # Diccionario para almacenar los datos sincronizados
-        synced_data = {}
-        
-        if entity == "all":
-            logging.info("Marcador: sync_clients")
-            clients = etl_service.sync_clients(db)
-            synced_data['cliente'] = clients or []
-            
-            logging.info("Marcador: sync_products")
-            products = etl_service.sync_products(db)
-            synced_data['producto'] = products or []
-            
-            if hasattr(db, "commit"):
-                db.commit()
-            logging.info("Marcador: sync_documents")
-            docs_data = etl_service.sync_documents(db, start_date=start_date)
-            if docs_data:
-                synced_data.update(docs_data)
-            
-            # Sincronizar a Google Sheets
-            etl_service.sync_all_to_sheets(synced_data)
-            
-        elif entity == "clients":
-            logging.info("Marcador: sync_clients")
-            clients = etl_service.sync_clients(db)
-            synced_data['cliente'] = clients or []
-            etl_service.sync_all_to_sheets(synced_data)
-            if hasattr(db, "commit"):
-                db.commit()
-        elif entity == "products":
-            logging.info("Marcador: sync_products")
-            products = etl_service.sync_products(db)
-            synced_data['producto'] = products or []
-            etl_service.sync_all_to_sheets(synced_data)
-            if hasattr(db, "commit"):
-                db.commit()
-        elif entity == "documents":
-            logging.info("Marcador: sync_documents")
-            docs_data = etl_service.sync_documents(db, start_date=start_date)
-            if docs_data:
-                synced_data.update(docs_data)
-            etl_service.sync_all_to_sheets(synced_data)
+        result = {"status": "sincronización completada", "entity": entity}
+        db.costs.reset()
+        if profiling.profiling_requested(request, profile):
+            _, result["profile"] = profiling.run_profiled(f"sync-{entity}", _run_sync, entity, start_date, db)
         else:
-            logging.error(f"Marcador: entidad '{entity}' no encontrada")
-            raise HTTPException(status_code=404, detail=f"Entidad '{entity}' no encontrada.")
-        logging.info(f"Marcador: fin run_sync para entidad '{entity}'")
-        return {"status": "sincronización completada", "entity": entity}
+            _run_sync(entity, start_date, db)
+        db.costs.log_summary()
+        result["bigquery_costs"] = db.costs.report()
+        return result
 
+    except HTTPException:
+        # 404 / 409 (lease de otra instancia): lo ya cargado (ej. clientes en 'all') se confirma
+        if hasattr(db, "commit"):
+            db.commit()
+        raise
+    except shutdown.ShutdownRequested as e:
+        # Lo ya cargado se confirma (no rollback) y queda un marcador de reanudación
+        logging.warning(f"Marcador: run_sync de '{entity}' interrumpido por apagado - {e}")
+        if hasattr(db, "commit"):
+            db.commit()
+        raise HTTPException(status_code=503, detail=f"Sincronización de '{entity}' interrumpida por apagado ({e}); se reanudará en la próxima ejecución.")
     except Exception as e:
         logging.error(f"Marcador: excepción en run_sync para entidad '{entity}' - {e}")
         # Si el objeto db tiene rollback, lo ejecutamos
         if hasattr(db, "rollback"):
             db.rollback()
         logging.exception(f"Error en la sincronización de '{entity}'")
-        raise HTTPException(status_code=500, detail=f"Error en la sincronización de '{entity}': {e}. Revise los logs del servidor para más detalles.")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error en la sincronización de '{entity}': {e}. Revise los logs del servidor para más detalles.")
+
+@router.post("/etl/reconcile/{entity}", tags=["ETL"])
+def run_reconcile(entity: str, days: Optional[int] = None, mode: Optional[str] = None, force: bool = False,
+                  db=Depends(get_db)):
+    """
+    Detecta documentos/clientes borrados o anulados en Bsale comparando solo los ids.
+    - Entidades válidas: 'documents' (últimos 'days' días, por defecto RECONCILE_DOCUMENT_DAYS) y 'clients'.
+    - 'mode': 'tombstone' (marca eliminado_en) o 'delete'; por defecto RECONCILE_MODE.
+    - Se aborta sin cambios si se eliminaría más de RECONCILE_MAX_REMOVAL_RATIO de la tabla, salvo 'force=true'.
+    - 409 si otra instancia tiene el lease de la entidad (sincronización o reconciliación en curso).
+    """
+    if entity not in reconciliation.RECONCILE_SPECS:
+        raise HTTPException(status_code=404, detail=f"Entidad '{entity}' no soportada para reconciliación.")
+    try:
+        db.costs.reset()
+        result = reconciliation.reconcile(db, entity, days=days, mode=mode, force=force)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        if hasattr(db, "rollback"):
+            db.rollback()
+        logging.exception(f"Error en la reconciliación de '{entity}'")
+        raise HTTPException(status_code=500, detail=f"Error en la reconciliación de '{entity}': {e}")
+    if is_skipped(result):
+        raise HTTPException(status_code=409, detail=f"Reconciliación de '{entity}' omitida: {result.entity} está "
+                                                    f"en curso en otra instancia ({result.holder}).")
+    db.costs.log_summary()
+    result["bigquery_costs"] = db.costs.report()
+    return result
+
+@router.post("/etl/export/sheets", tags=["ETL"])
+def export_sheets(tables: Optional[str] = None, db=Depends(get_db)):
+    """
+    Exporta las tablas del warehouse a Google Sheets, leyendo en páginas.
+    - 'tables': lista separada por comas (cliente, producto, documento_venta, detalle_documento). Por defecto todas.
+    """
+    try:
+        selected = [table.strip() for table in tables.split(",") if table.strip()] if tables else None
+        results = sheets_export.export_to_sheets(db, selected)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.exception("Error exportando a Google Sheets")
+        raise HTTPException(status_code=500, detail=f"Error exportando a Google Sheets: {e}")
+    if not results:
+        return {"status": "omitido", "message": "Google Sheets no configurado"}
+    return {"status": "exportación completada", "tables": results}
+
+@router.get("/etl/profiles/{profile_id}", tags=["ETL"], response_class=PlainTextResponse)
+def get_profile(profile_id: str):
+    """
+    Descarga un perfil guardado en formato stack colapsado (flamegraph.pl, speedscope, inferno).
+    """
+    path = profiling.profile_path(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail=f"Perfil '{profile_id}' no encontrado.")
+    with open(path) as handle:
+        return handle.read()
@@ -0,0 +1,58 @@
+# app/api/report_endpoints.py - REPORTES DE VENTAS DE SOLO LECTURA (CON CACHÉ)
+from fastapi import APIRouter, Depends, HTTPException
+from datetime import date, datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+import logging
+
+from app.core.config import settings
+from app.db.warehouse import get_writer
+from app.services import sales_reports
+
+router = APIRouter()
+
+def get_db():
+    writer = get_writer()
+    yield writer
+
+def _report(db, name: str, start: Optional[date], end: Optional[date], limit: int = 50):
+    end = end or datetime.now(ZoneInfo(db.report_timezone)).date()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="'start' debe ser anterior o igual a 'end'.")
+    if (end - start).days + 1 > settings.REPORT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"El rango supera REPORT_MAX_DAYS ({settings.REPORT_MAX_DAYS} días).")
+    if not 1 <= limit <= 1000:
+        raise HTTPException(status_code=400, detail="'limit' debe estar entre 1 y 1000.")
+    try:
+        return sales_reports.run_report(db, name, start, end, limit)
+    except Exception as e:
+        logging.exception(f"Error en el reporte '{name}'")
+        raise HTTPException(status_code=500, detail=f"Error en el reporte '{name}': {e}")
+
+@router.get("/reports/sales/daily", tags=["Reportes"])
+def sales_by_day(start: Optional[date] = None, end: Optional[date] = None, db=Depends(get_db)):
+    """
+    Ventas por día (neto, IVA, total y documentos). Por defecto los últimos 30 días.
+    Las respuestas se cachean en el proceso hasta REPORT_CACHE_TTL_SECONDS o hasta la próxima carga de documentos.
+    """
+    return _report(db, "daily", start, end)
+
+@router.get("/reports/sales/top-products", tags=["Reportes"])
+def top_products(start: Optional[date] = None, end: Optional[date] = None, limit: int = 20, db=Depends(get_db)):
+    """
+    Productos más vendidos por monto neto en el rango (con cantidad y costo estimado).
+    """
+    return _report(db, "top_products", start, end, limit)
+
+@router.get("/reports/sales/clients", tags=["Reportes"])
+def client_totals(start: Optional[date] = None, end: Optional[date] = None, limit: int = 50, db=Depends(get_db)):
+    """
+    Totales por cliente en el rango, ordenados por monto total.
+    """
+    return _report(db, "clients", start, end, limit)
+
+@router.get("/reports/cache", tags=["Reportes"])
+def report_cache_status():
+    """Entradas, aciertos e invalidaciones de la caché de reportes"""
+    return sales_reports.get_report_cache().stats()
@@ -6,21 +6,24 @@ import logging
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 
+from app.core import profiling, shutdown, tenancy
 from app.core.config import settings
-from app.db.bigquery_client import get_bq_writer
-from app.services import etl_service
+from app.db.warehouse import get_writer
+from app.services import etl_service, resume, tenant_scheduler, window_planner
+from app.services.sync_lock import is_skipped
 
 router = APIRouter()
 
 def get_db():
-    writer = get_bq_writer()
+    writer = get_writer()
     yield writer
 
 @router.post("/scheduler/etl/daily", tags=["Scheduler"])
-async def run_daily_etl(request: Request, db=Depends(get_db)):
+async def run_daily_etl(request: Request, profile: bool = False, db=Depends(get_db)):
     """
     Endpoint para Cloud Scheduler - ETL diario completo
     Se ejecuta todos los días a las 6:00 AM
+    'profile=true' (o header X-ETL-Profile: 1) perfila la ejecución.
     """
     start_time = datetime.now()
     logging.info(f"🚀 Iniciando ETL diario via Cloud Scheduler - {start_time}")
@@ -35,8 +38,19 @@ async def run_daily_etl(request: Request, db=Depends(get_db)):
     try:
         # Ejecutar ETL en thread pool para no bloquear
         loop = asyncio.get_event_loop()
+        profile_summary = None
+        db.costs.reset()
         with ThreadPoolExecutor(max_workers=1) as executor:
-            await loop.run_in_executor(executor, _run_complete_etl, db)
+            if profiling.profiling_requested(request, profile):
+                skipped, profile_summary = await loop.run_in_executor(
+                    executor, profiling.run_profiled, "daily", _run_complete_etl, db
+                )
+            else:
+                skipped = await loop.run_in_executor(executor, _run_complete_etl, db)
+        if skipped:
+            holders = {label: busy.holder for label, busy in skipped.items()}
+            raise HTTPException(status_code=409, detail=f"ETL diario incompleto: pasos omitidos por estar en curso "
+                                                        f"en otra instancia {holders}; se repetirán en el próximo intento")
         
         end_time = datetime.now()
         duration = end_time - start_time
@@ -49,10 +63,19 @@ async def run_daily_etl(request: Request, db=Depends(get_db)):
             "duration_seconds": duration.total_seconds(),
             "executed_by": "cloud_scheduler"
         }
+        if profile_summary:
+            result["profile"] = profile_summary
+        db.costs.log_summary()
+        result["bigquery_costs"] = db.costs.report()
         
         logging.info(f"✅ ETL diario completado: {duration}")
         return result
         
+    except HTTPException:
+        raise
+    except shutdown.ShutdownRequested as e:
+        logging.warning(f"🛑 ETL diario interrumpido: {e}")
+        raise HTTPException(status_code=503, detail=f"ETL diario interrumpido por apagado ({e}); se reanudará en la próxima ejecución")
     except Exception as e:
         logging.error(f"🔴 Error en ETL diario: {e}")
         
@@ -69,26 +92,44 @@ async def run_daily_etl(request: Request, db=Depends(get_db)):
         )
 
 @router.post("/scheduler/etl/incremental", tags=["Scheduler"])
-async def run_incremental_etl(request: Request, days: int = 1, db=Depends(get_db)):
+async def run_incremental_etl(request: Request, days: Optional[int] = None, profile: bool = False, db=Depends(get_db)):
     """
     Endpoint para ETL incremental - solo documentos recientes
     Útil para ejecuciones más frecuentes (cada 4 horas)
+    Sin 'days' (y con ADAPTIVE_WINDOW_ENABLED) la ventana y los hilos de descarga se eligen
+    según los cambios y atrasos de ejecuciones anteriores; 'days' fija la ventana.
+    'profile=true' (o header X-ETL-Profile: 1) perfila la ejecución.
     """
     start_time = datetime.now()
-    logging.info(f"🔄 Iniciando ETL incremental ({days} días) - {start_time}")
+    adaptive = settings.ADAPTIVE_WINDOW_ENABLED
+    if not adaptive and days is None:
+        days = 1
+    logging.info(f"🔄 Iniciando ETL incremental ({f'{days} días' if days else 'ventana adaptativa'}) - {start_time}")
     
     try:
-        # Solo sincronizar documentos de los últimos X días
-        start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        if adaptive:
+            sync_args = (window_planner.sync_documents_adaptive, db, days)
+        else:
+            # Solo sincronizar documentos de los últimos X días
+            start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+            sync_args = (etl_service.sync_documents, db, start_date)
         
         loop = asyncio.get_event_loop()
+        profile_summary = None
+        db.costs.reset()
         with ThreadPoolExecutor(max_workers=1) as executor:
-            await loop.run_in_executor(
-                executor, 
-                etl_service.sync_documents, 
-                db, 
-                start_date
-            )
+            if profiling.profiling_requested(request, profile):
+                sync_result, profile_summary = await loop.run_in_executor(
+                    executor, profiling.run_profiled, "incremental", *sync_args
+                )
+            else:
+                sync_result = await loop.run_in_executor(executor, *sync_args)
+        if is_skipped(sync_result):
+            raise HTTPException(status_code=409, detail=f"ETL incremental omitido: {sync_result.entity} está en curso "
+                                                        f"en otra instancia ({sync_result.holder})")
+        if adaptive:
+            days = sync_result["window"]["days"]
+            start_date = sync_result["window"]["start_date"]
         
         # Commit si es necesario
         if hasattr(db, "commit"):
@@ -106,10 +147,24 @@ async def run_incremental_etl(request: Request, days: int = 1, db=Depends(get_db
             "days_processed": days,
             "start_date": start_date
         }
+        if adaptive:
+            result["window"] = sync_result["window"]
+            result["window_stats"] = sync_result.get("stats")
+        if profile_summary:
+            result["profile"] = profile_summary
+        db.costs.log_summary()
+        result["bigquery_costs"] = db.costs.report()
         
         logging.info(f"✅ ETL incremental completado: {duration}")
         return result
         
+    except HTTPException:
+        raise
+    except shutdown.ShutdownRequested as e:
+        logging.warning(f"🛑 ETL incremental interrumpido: {e}")
+        if hasattr(db, "commit"):
+            db.commit()
+        raise HTTPException(status_code=503, detail=f"ETL incremental interrumpido por apagado ({e}); se reanudará en la próxima ejecución")
     except Exception as e:
         logging.error(f"🔴 Error en ETL incremental: {e}")
         
@@ -137,38 +192,47 @@ async def health_check():
         "bsale_configured": bool(settings.BSALE_API_TOKEN)
     }
 
+@router.get("/scheduler/locks", tags=["Scheduler"])
+async def lock_status():
+    """
+    Estado de los leases por entidad (ejecuciones en curso en esta y otras instancias)
+    """
+    from app.services.sync_lock import lock_manager
+    return lock_manager.status()
+
+@router.get("/scheduler/memory", tags=["Scheduler"])
+async def memory_status():
+    """
+    RSS actual, techo del presupuesto de memoria y picos por etapa de la última ejecución
+    """
+    from app.core.memory_budget import budget
+    return budget.status()
+
 @router.post("/scheduler/etl/test", tags=["Scheduler"])  
-async def test_etl(entity: str = "clients", limit: int = 10, db = Depends(get_db)):
+async def test_etl(entity: str = "clients", limit: int = 10, start_date: Optional[str] = None,
+                   estimate_bytes: bool = False, db = Depends(get_db)):
     """
-    Endpoint de prueba para validar ETL sin ejecutar todo
+    Vista previa / dry-run del ETL: descarga solo `limit` registros de la entidad
+    (clients, products, variants, documents), los valida y arma los MERGE sin
+    ejecutarlos. Devuelve tiempos, rechazos y jobs proyectados para una ejecución completa.
+    'start_date' (YYYY-MM-DD) acota documentos; 'estimate_bytes=true' hace dry-run del primer MERGE.
     """
+    from app.services import etl_preview
+
+    if entity not in etl_preview.PREVIEW_ENTITIES:
+        raise HTTPException(status_code=400, detail=f"Entity must be one of: {', '.join(etl_preview.PREVIEW_ENTITIES)}")
+    if not 1 <= limit <= 1000:
+        raise HTTPException(status_code=400, detail="'limit' debe estar entre 1 y 1000.")
     start_time = datetime.now()
-    logging.info(f"🧪 Iniciando prueba ETL - {entity}")
+    logging.info(f"🧪 Iniciando prueba ETL - {entity} ({limit} registros, sin escribir)")
     
     try:
-        if entity == "clients":
-            # Probar solo algunos clientes
-            from app.services.bsale_client import bsale_client
-            clients = bsale_client.get_clients()[:limit]
-            result = {
-                "entity": "clients",
-                "sample_count": len(clients),
-                "first_client": clients[0] if clients else None
-            }
-        elif entity == "products":
-            from app.services.bsale_client import bsale_client
-            products = bsale_client._get_all_pages("products.json", params={"limit": limit})
-            result = {
-                "entity": "products", 
-                "sample_count": len(products),
-                "first_product": products[0] if products else None
-            }
-        else:
-            raise HTTPException(status_code=400, detail="Entity must be 'clients' or 'products'")
-        
-        end_time = datetime.now()
-        duration = end_time - start_time
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            result = await loop.run_in_executor(
+                executor, lambda: etl_preview.preview_entity(db, entity, limit, start_date, estimate_bytes))
         
+        duration = datetime.now() - start_time
         result.update({
             "status": "success",
             "duration_seconds": duration.total_seconds(),
@@ -181,26 +245,68 @@ async def test_etl(entity: str = "clients", limit: int = 10, db = Depends(get_db
         logging.error(f"🔴 Error en prueba ETL: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/scheduler/etl/tenants", tags=["Scheduler"])
+async def run_tenants_etl():
+    """
+    ETL diario de todas las tiendas de BSALE_TENANTS (token y dataset propios por tienda),
+    con a lo sumo TENANT_MAX_CONCURRENCY pasos en paralelo y turnos por paso entre tiendas.
+    """
+    start_time = datetime.now()
+    try:
+        tenants = tenancy.configured_tenants()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not tenants:
+        raise HTTPException(status_code=400, detail="No hay tiendas configuradas en BSALE_TENANTS")
+
+    logging.info(f"🏪 Iniciando ETL diario de {len(tenants)} tiendas - {start_time}")
+    loop = asyncio.get_event_loop()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        results = await loop.run_in_executor(executor, tenant_scheduler.run_tenants_daily, tenants)
+
+    duration = datetime.now() - start_time
+    failed = sorted(name for name, result in results.items() if result["status"] != "success")
+    logging.info(f"✅ ETL multi-tienda completado en {duration} ({len(failed)} con error)")
+    return {
+        "status": "partial" if failed else "success",
+        "duration_seconds": duration.total_seconds(),
+        "failed_tenants": failed,
+        "tenants": results,
+    }
+
+@router.get("/scheduler/tenants", tags=["Scheduler"])
+async def list_tenants():
+    """Tiendas configuradas (sin tokens) y tope de concurrencia"""
+    try:
+        tenants = tenancy.configured_tenants()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "max_concurrency": settings.TENANT_MAX_CONCURRENCY,
+        "tenants": [tenant.describe() for tenant in tenants],
+    }
+
 def _run_complete_etl(db):
     """Función auxiliar para ejecutar ETL completo (sincrona)"""
     logging.info("📋 Ejecutando sincronización completa...")
     
-    # 1. Clientes
-    logging.info("👥 Sincronizando clientes...")
-    etl_service.sync_clients(db)
-    
-    # 2. Productos  
-    logging.info("📦 Sincronizando productos...")
-    etl_service.sync_products(db)
-    
-    # 3. Documentos (últimos 7 días para no sobrecargar)
-    start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-    logging.info(f"📄 Sincronizando documentos desde {start_date}...")
-    etl_service.sync_documents(db, start_date=start_date)
+    # Clientes, productos, documentos (ventana adaptativa o últimos 7 días) y foto diaria de stock;
+    # tras un apagado se saltan los pasos ya completados
+    try:
+        skipped = resume.run_steps(db, tenant_scheduler.daily_steps())
+    except shutdown.ShutdownRequested:
+        # Lo cargado antes del apagado queda confirmado
+        if hasattr(db, "commit"):
+            db.commit()
+        raise
     
     # Commit final
     if hasattr(db, "commit"):
         db.commit()
         logging.info("✅ Commit final ejecutado")
     
-    logging.info("🎉 ETL completo finalizado")
+    if skipped:
+        logging.warning(f"⏭️ ETL completo con pasos omitidos (en curso en otra instancia): {sorted(skipped)}")
+    else:
+        logging.info("🎉 ETL completo finalizado")
+    return skipped
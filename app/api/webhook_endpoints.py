@@ -0,0 +1,83 @@
+# app/api/webhook_endpoints.py - RECEPTOR DE WEBHOOKS DE BSALE
+from fastapi import APIRouter, HTTPException, Request
+from typing import Optional
+import hmac
+import logging
+
+from app.core import tenancy
+from app.core.config import settings
+from app.services.webhook_ingest import webhook_batcher
+
+router = APIRouter()
+
+
+def _check_token(token: Optional[str]):
+    # Bsale no firma las notificaciones: se usa un token compartido en la URL registrada
+    if not settings.WEBHOOK_TOKEN:
+        # Sin token configurado el receptor queda cerrado (cualquiera podría encolar cargas)
+        raise HTTPException(status_code=503, detail="Webhooks deshabilitados: WEBHOOK_TOKEN no configurado")
+    if not token or not hmac.compare_digest(token.encode("utf-8"), settings.WEBHOOK_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Token de webhook inválido")
+
+
+async def _enqueue_notifications(request: Request, token: Optional[str]):
+    _check_token(token)
+    try:
+        payload = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Payload JSON inválido")
+
+    notifications = payload if isinstance(payload, list) else [payload]
+    queued = 0
+    for notification in notifications:
+        if isinstance(notification, dict) and webhook_batcher.handle_notification(notification):
+            queued += 1
+    logging.info(f"📨 Webhook Bsale{f' ({tenancy.current().name})' if tenancy.current() else ''}: "
+                 f"{queued}/{len(notifications)} notificaciones encoladas")
+    return {"status": "encolado", "queued": queued, "pending": webhook_batcher.pending_count()}
+
+
+@router.post("/webhooks/bsale", tags=["Webhooks"])
+async def receive_bsale_webhook(request: Request, token: Optional[str] = None):
+    """
+    Recibe notificaciones de Bsale (document, client, product, variant, stock).
+    Solo encola el id; la carga ocurre en micro-lotes por tamaño o tiempo.
+    """
+    return await _enqueue_notifications(request, token)
+
+
+@router.post("/webhooks/bsale/tenants/{tenant}", tags=["Webhooks"])
+async def receive_tenant_bsale_webhook(tenant: str, request: Request, token: Optional[str] = None):
+    """
+    Receptor de una tienda de BSALE_TENANTS: los ids se cargan con el token y el dataset
+    de la tienda. El token puede ser propio de la tienda (WEBHOOK_TOKEN en sus "settings").
+    """
+    try:
+        found = tenancy.find_tenant(tenant)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"Tienda '{tenant}' no configurada en BSALE_TENANTS")
+    with tenancy.tenant_context(found):
+        return await _enqueue_notifications(request, token)
+
+
+@router.post("/webhooks/bsale/flush", tags=["Webhooks"])
+def flush_bsale_webhooks(token: Optional[str] = None):
+    """
+    Fuerza el vaciado de la cola de webhooks (útil sin CPU siempre asignada).
+    """
+    _check_token(token)
+    try:
+        return {"status": "ok", "results": webhook_batcher.flush()}
+    except Exception as e:
+        logging.error(f"🔴 Error vaciando cola de webhooks: {e}")
+        raise HTTPException(status_code=500, detail=f"Error vaciando cola de webhooks: {e}")
+
+
+@router.get("/webhooks/bsale/status", tags=["Webhooks"])
+def bsale_webhook_status():
+    """
+    Ids pendientes por entidad y resultado del último vaciado.
+    """
+    return webhook_batcher.status()
@@ -1,6 +1,9 @@
 # app/core/config.py
 from pydantic_settings import BaseSettings
-from typing import Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
 
 
 class Settings(BaseSettings):
@@ -11,9 +14,133 @@ class Settings(BaseSettings):
     # Google Sheets (opcional)
     GOOGLE_SHEETS_DOC_ID: Optional[str] = None
     GOOGLE_SHEETS_CREDENTIALS: Optional[str] = None
+    # Exportación a Sheets: cuota compartida por minuto, hojas en paralelo y filas por petición
+    SHEETS_REQUESTS_PER_MINUTE: int = 55
+    SHEETS_MAX_WORKERS: int = 4
+    SHEETS_CHUNK_ROWS: int = 5000
+    SHEETS_MAX_RETRIES: int = 5
+    # Exportar a Sheets (desde el warehouse) al final de /etl/sync/{entity}
+    SHEETS_EXPORT_AFTER_SYNC: bool = True
+    # Storage Write API (opcional): tablas separadas por coma que se cargan
+    # con streams PENDING en vez de insert_rows_json, ej. "detalle_documento,documento_venta"
+    BIGQUERY_STORAGE_WRITE_TABLES: Optional[str] = None
+    BIGQUERY_STORAGE_WRITE_BATCH_ROWS: int = 500
+    # Sincronización de productos: "first_variant" o "variants" (todas las variantes activas)
+    PRODUCT_SYNC_MODE: str = "first_variant"
+    # Arranque: pre-calentar clientes y tablas en el lifespan de FastAPI
+    STARTUP_WARMUP: bool = True
+    STARTUP_BUDGET_SECONDS: float = 5.0
+    # Warehouse: "bigquery" (producción) o "sqlite" (local, sin GCP)
+    WAREHOUSE_BACKEND: str = "bigquery"
+    LOCAL_WAREHOUSE_PATH: str = "etl_local.db"
+    # Tablas agregadas de ventas (ventas_diarias_*) y zona horaria de los reportes
+    SALES_AGGREGATES_ENABLED: bool = True
+    REPORT_TIMEZONE: str = "America/Santiago"
+    # Perfilado de CPU bajo demanda (?profile=true o header X-ETL-Profile)
+    PROFILE_SAMPLE_INTERVAL_MS: float = 5.0
+    PROFILE_TOP_N: int = 25
+    PROFILE_DIR: str = "/tmp/etl_profiles"
+    # Presupuesto de memoria: límite en MB (0 = el del contenedor), fracción usable,
+    # directorio de volcado a disco y filas por lote de carga
+    MEMORY_LIMIT_MB: int = 0
+    MEMORY_BUDGET_FRACTION: float = 0.8
+    MEMORY_SPILL_DIR: str = "/tmp/etl_spill"
+    MEMORY_LOAD_CHUNK_ROWS: int = 5000
+    MEMORY_TRACEMALLOC: bool = False
+    # Webhooks de Bsale: token compartido (sin él los receptores responden 503) y umbrales del micro-lote
+    WEBHOOK_TOKEN: Optional[str] = None
+    WEBHOOK_BATCH_MAX_IDS: int = 200
+    WEBHOOK_FLUSH_SECONDS: float = 60.0
+    # Stock: foto diaria en el ETL diario e hilos de descarga concurrente
+    STOCK_SYNC_ENABLED: bool = True
+    STOCK_EXTRACT_WORKERS: int = 4
+    # Decodificar respuestas de Bsale con modelos tipados (requiere msgspec; si no, orjson/json)
+    BSALE_TYPED_DECODING: bool = True
+    # Registro de entidades: hilos para validar/expandir registros que piden datos a Bsale (productos)
+    ETL_TRANSFORM_WORKERS: int = 4
+    # Costo BigQuery: bytes facturables por ejecución (0 = sin tope), dry-run de MERGE,
+    # abortar al exceder (en vez de solo advertir) y precio on-demand por TiB
+    BIGQUERY_RUN_BYTES_BUDGET: int = 0
+    BIGQUERY_COST_DRY_RUN: bool = True
+    BIGQUERY_BUDGET_STRICT: bool = False
+    BIGQUERY_USD_PER_TIB: float = 6.25
+    # Integridad referencial post-carga de documentos (anti-joins sobre las fechas tocadas):
+    # ids de muestra guardados y recuperación opcional de clientes/productos faltantes desde Bsale
+    INTEGRITY_CHECK_ENABLED: bool = True
+    INTEGRITY_MAX_IDS: int = 1000
+    INTEGRITY_REFETCH_MISSING: bool = False
+    INTEGRITY_REFETCH_MAX_IDS: int = 200
+    # Reconciliación de borrados/anulaciones: "tombstone" (marca eliminado_en) o "delete",
+    # ventana de documentos en días, proporción máxima a eliminar sin force e ids por sentencia
+    RECONCILE_MODE: str = "tombstone"
+    RECONCILE_DOCUMENT_DAYS: int = 90
+    RECONCILE_MAX_REMOVAL_RATIO: float = 0.05
+    RECONCILE_IDS_PER_STATEMENT: int = 10000
+    # Ventana incremental adaptativa de documentos (según el historial de cambios y atrasos):
+    # ejecuciones consideradas, límites de días, margen sobre el mayor atraso observado,
+    # sondeo periódico con la ventana máxima y páginas por hilo de descarga
+    ADAPTIVE_WINDOW_ENABLED: bool = True
+    ADAPTIVE_WINDOW_HISTORY_RUNS: int = 20
+    ADAPTIVE_WINDOW_DEFAULT_DAYS: int = 7
+    ADAPTIVE_WINDOW_MIN_DAYS: int = 1
+    ADAPTIVE_WINDOW_MAX_DAYS: int = 30
+    ADAPTIVE_WINDOW_MARGIN_DAYS: int = 1
+    ADAPTIVE_WINDOW_PROBE_EVERY: int = 7
+    ADAPTIVE_PAGES_PER_WORKER: int = 20
+    ADAPTIVE_MAX_PAGE_WORKERS: int = 4
+    # Historial de precio/costo por variante (producto_historial, SCD tipo 2) tras cargar productos;
+    # cargas de hasta PRICE_HISTORY_MAX_FILTER_IDS filas comparan solo las variantes cargadas
+    PRICE_HISTORY_ENABLED: bool = True
+    PRICE_HISTORY_MAX_FILTER_IDS: int = 1000
+    # Reportes de ventas (/reports/sales/*): TTL y tamaño de la caché en proceso, rango máximo en días
+    REPORT_CACHE_TTL_SECONDS: int = 300
+    REPORT_CACHE_MAX_ENTRIES: int = 256
+    REPORT_MAX_DAYS: int = 366
+    # Reanudación tras un apagado (SIGTERM): marcadores en etl_reanudacion y su vigencia
+    RESUME_ENABLED: bool = True
+    RESUME_MAX_AGE_HOURS: int = 12
+    # Multi-tienda: lista JSON de tiendas, ej.
+    # [{"name": "centro", "token": "...", "dataset": "bsale_centro", "requests_per_second": 5}]
+    # y tope global de sincronizaciones de tiendas en paralelo
+    BSALE_TENANTS: List[Dict[str, Any]] = []
+    TENANT_MAX_CONCURRENCY: int = 2
+    TENANT_REQUESTS_PER_SECOND: float = 5.0
+    # Lock por entidad: "local" (archivos), "bigquery" (tabla etl_lock) o "none"
+    SYNC_LOCK_BACKEND: str = "local"
+    SYNC_LOCK_TTL_SECONDS: int = 3600
+    SYNC_LOCK_DIR: str = "/tmp/etl_locks"
 
     class Config:
         env_file = ".env"
 
 
-settings = Settings()
\ No newline at end of file
+@lru_cache()
+def get_settings() -> Settings:
+    return Settings()
+
+
+# Valores que reemplazan a Settings en el contexto actual (ej. token y dataset de una tienda)
+_overrides: ContextVar[Optional[Dict[str, Any]]] = ContextVar("settings_overrides", default=None)
+
+
+@contextmanager
+def override_settings(values: Dict[str, Any]):
+    """Dentro del bloque, `settings.X` devuelve values["X"] si existe (por contexto, no global)"""
+    token = _overrides.set({**(_overrides.get() or {}), **values})
+    try:
+        yield
+    finally:
+        _overrides.reset(token)
+
+
+class _LazySettings:
+    """Proxy que construye Settings() en el primer acceso y no al importar el módulo"""
+
+    def __getattr__(self, name):
+        overrides = _overrides.get()
+        if overrides and name in overrides:
+            return overrides[name]
+        return getattr(get_settings(), name)
+
+
+settings = _LazySettings()
@@ -0,0 +1,229 @@
+# app/core/memory_budget.py - PRESUPUESTO DE MEMORIA PARA LOS LÍMITES DE CLOUD RUN
+"""
+Mantiene las ejecuciones grandes bajo el límite de memoria de la instancia:
+
+- Techo = límite del contenedor (MEMORY_LIMIT_MB o, si es 0, el del cgroup)
+  multiplicado por MEMORY_BUDGET_FRACTION.
+- `chunk_size(preferido, mínimo)` achica páginas y lotes linealmente a medida
+  que el RSS se acerca al techo.
+- `SpillBuffer` acumula filas en memoria y, bajo presión, las vuelca a un
+  archivo JSONL temporal en MEMORY_SPILL_DIR; luego se leen por lotes.
+- `track_stage("documentos")` registra RSS inicial/pico/final por etapa
+  (y el pico de tracemalloc si MEMORY_TRACEMALLOC=True), visible en
+  /scheduler/memory.
+"""
+from typing import Any, Dict, Iterator, List, Optional
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import logging
+import os
+import resource
+import tempfile
+import threading
+import tracemalloc
+
+from app.core.config import settings
+
+_CGROUP_LIMIT_FILES = (
+    "/sys/fs/cgroup/memory.max",                    # cgroup v2 (Cloud Run gen2)
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",  # cgroup v1
+)
+
+# Presión (RSS / techo) desde la que se achican lotes, y desde la que se vuelca a disco
+SHRINK_FROM = 0.7
+SPILL_FROM = 0.85
+
+
+def rss_bytes() -> int:
+    """RSS actual del proceso (Linux: /proc; otros: pico de getrusage)"""
+    try:
+        with open("/proc/self/statm") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _container_limit_bytes() -> Optional[int]:
+    if settings.MEMORY_LIMIT_MB:
+        return settings.MEMORY_LIMIT_MB * 1024 * 1024
+    for path in _CGROUP_LIMIT_FILES:
+        try:
+            with open(path) as handle:
+                raw = handle.read().strip()
+        except OSError:
+            continue
+        # "max" o un valor gigante significan sin límite
+        if raw.isdigit() and int(raw) < 1 << 50:
+            return int(raw)
+    return None
+
+
+class MemoryBudget:
+    """Techo de memoria y tamaños de lote adaptativos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self._limit = None
+        self._limit_loaded = False
+
+    @property
+    def ceiling_bytes(self) -> Optional[int]:
+        if not self._limit_loaded:
+            self._limit = _container_limit_bytes()
+            self._limit_loaded = True
+        if self._limit is None:
+            return None
+        return int(self._limit * settings.MEMORY_BUDGET_FRACTION)
+
+    def pressure(self) -> Optional[float]:
+        """RSS / techo, o None si no hay límite conocido"""
+        ceiling = self.ceiling_bytes
+        if not ceiling:
+            return None
+        return rss_bytes() / ceiling
+
+    def chunk_size(self, preferred: int, minimum: int) -> int:
+        """preferred bajo presión baja; se reduce linealmente hasta minimum al llegar al techo"""
+        pressure = self.pressure()
+        if pressure is None or pressure < SHRINK_FROM:
+            return preferred
+        if pressure >= 1:
+            return minimum
+        scale = (1 - pressure) / (1 - SHRINK_FROM)
+        return max(minimum, int(preferred * scale))
+
+    def should_spill(self) -> bool:
+        pressure = self.pressure()
+        return pressure is not None and pressure >= SPILL_FROM
+
+    @contextmanager
+    def track_stage(self, name: str):
+        """Registra RSS inicial, pico y final (y pico de tracemalloc si está habilitado) de la etapa"""
+        use_tracemalloc = settings.MEMORY_TRACEMALLOC
+        started_tracing = False
+        if use_tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+
+        rss_start = rss_bytes()
+        peak = {"rss": rss_start}
+        stop = threading.Event()
+
+        def sample():
+            while not stop.wait(0.5):
+                peak["rss"] = max(peak["rss"], rss_bytes())
+
+        sampler = threading.Thread(target=sample, name=f"memory-{name}", daemon=True)
+        sampler.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+            rss_end = rss_bytes()
+            report = {
+                "rss_start_mb": round(rss_start / 2**20, 1),
+                "rss_peak_mb": round(max(peak["rss"], rss_end) / 2**20, 1),
+                "rss_end_mb": round(rss_end / 2**20, 1),
+                "ceiling_mb": round(self.ceiling_bytes / 2**20, 1) if self.ceiling_bytes else None,
+                "finished_at": datetime.now().isoformat(),
+            }
+            if use_tracemalloc:
+                report["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+                if started_tracing:
+                    tracemalloc.stop()
+            with self._lock:
+                self.stages[name] = report
+            logging.info(f"🧠 Memoria {name}: pico RSS {report['rss_peak_mb']} MB (techo {report['ceiling_mb']} MB)")
+
+    def status(self) -> Dict[str, Any]:
+        ceiling = self.ceiling_bytes
+        with self._lock:
+            stages = dict(self.stages)
+        return {
+            "rss_mb": round(rss_bytes() / 2**20, 1),
+            "ceiling_mb": round(ceiling / 2**20, 1) if ceiling else None,
+            "pressure": round(self.pressure(), 3) if ceiling else None,
+            "stages": stages,
+        }
+
+
+budget = MemoryBudget()
+
+
+def track_stage(name: str):
+    """Decorador / context manager: budget.track_stage(name)"""
+    return budget.track_stage(name)
+
+
+class SpillBuffer:
+    """
+    Lista de filas (dicts JSON-serializables) que se vuelca a disco bajo presión de memoria.
+    Las filas se leen de vuelta en orden de llegada con iter_batches().
+    """
+
+    # Cada cuántas filas agregadas se consulta la presión (leer /proc no es gratis)
+    CHECK_EVERY = 500
+
+    def __init__(self, name: str, memory: MemoryBudget = None):
+        self.name = name
+        self.memory = memory or budget
+        self.rows: List[Dict] = []
+        self.spilled = 0
+        self._count = 0
+        self._file = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, row: Dict):
+        self.rows.append(row)
+        self._count += 1
+        if self._count % self.CHECK_EVERY == 0 and self.memory.should_spill():
+            self.spill()
+
+    def spill(self):
+        if not self.rows:
+            return
+        if self._file is None:
+            os.makedirs(settings.MEMORY_SPILL_DIR, exist_ok=True)
+            self._file = tempfile.TemporaryFile(mode="w+", dir=settings.MEMORY_SPILL_DIR,
+                                                prefix=f"{self.name}-", suffix=".jsonl")
+        for row in self.rows:
+            self._file.write(json.dumps(row, default=str))
+            self._file.write("\n")
+        self._file.flush()
+        self.spilled += len(self.rows)
+        logging.warning(f"💾 Presión de memoria: {len(self.rows)} filas de {self.name} volcadas a disco "
+                        f"({self.spilled} en total)")
+        self.rows = []
+
+    def iter_batches(self, preferred: int, minimum: int = 100) -> Iterator[List[Dict]]:
+        """Lotes en orden de llegada: primero lo volcado a disco, luego lo que quedó en memoria"""
+        batch: List[Dict] = []
+        size = self.memory.chunk_size(preferred, minimum)
+        sources = []
+        if self._file is not None:
+            self._file.seek(0)
+            sources.append(json.loads(line) for line in self._file)
+        sources.append(iter(self.rows))
+        for source in sources:
+            for row in source:
+                batch.append(row)
+                if len(batch) >= size:
+                    yield batch
+                    batch = []
+                    size = self.memory.chunk_size(preferred, minimum)
+        if batch:
+            yield batch
+
+    def close(self):
+        """Libera memoria y borra el archivo temporal"""
+        self.rows = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
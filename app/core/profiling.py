@@ -0,0 +1,190 @@
+# app/core/profiling.py - PERFILADO DE CPU BAJO DEMANDA PARA EJECUCIONES DEL ETL
+"""
+Profiler por muestreo sin dependencias: un hilo toma cada
+PROFILE_SAMPLE_INTERVAL_MS las pilas (sys._current_frames) del hilo que
+ejecuta el ETL, de los hilos lanzados durante la ejecución (pool de
+transformación, descargas paralelas, exportación a Sheets) y de los que
+tienen una etapa marcada, y las acumula por etapa. Un hilo auxiliar sin
+etapa propia cuenta en la etapa actual del hilo perfilado.
+
+Resultado de cada ejecución perfilada:
+- archivo `<profile_id>.collapsed` en PROFILE_DIR, formato "stack colapsado"
+  (una línea `etapa;func_externa;...;func_interna N`), compatible con
+  flamegraph.pl, speedscope e inferno;
+- tabla top-N por etapa con muestras propias (self) y acumuladas (total).
+
+Las etapas se marcan con `stage("clientes")`, como context manager o
+decorador. Fuera de una ejecución perfilada solo cuesta asignar un dict.
+"""
+from typing import Any, Callable, Dict, Optional
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+from app.core.config import settings
+
+# Etapa actual por hilo (thread id -> nombre); el hilo de muestreo la lee
+_stages: Dict[int, str] = {}
+
+DEFAULT_STAGE = "run"
+
+
+@contextmanager
+def stage(name: str):
+    """Marca la etapa del hilo actual mientras dura el bloque (o la función decorada)"""
+    thread_id = threading.get_ident()
+    previous = _stages.get(thread_id)
+    _stages[thread_id] = name
+    try:
+        yield
+    finally:
+        if previous is None:
+            _stages.pop(thread_id, None)
+        else:
+            _stages[thread_id] = previous
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Muestrea a intervalo fijo la pila de un hilo y la de sus hilos auxiliares"""
+
+    def __init__(self, thread_id: int = None, interval_ms: float = None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = (interval_ms or settings.PROFILE_SAMPLE_INTERVAL_MS) / 1000
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.duration = None
+        self._stop = threading.Event()
+        self._thread = None
+        # Hilos vivos al empezar (servidor, flusher de webhooks...): no se muestrean salvo que marquen etapa
+        self._preexisting = set()
+
+    def _sample(self):
+        own_stage = _stages.get(self.thread_id, DEFAULT_STAGE)
+        profiler_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == profiler_id:
+                continue
+            thread_stage = _stages.get(thread_id)
+            if thread_id != self.thread_id and thread_stage is None and thread_id in self._preexisting:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.reverse()
+            self.stacks[(thread_stage or own_stage, tuple(labels))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._preexisting = set(sys._current_frames())
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="etl-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def collapsed(self) -> str:
+        """Stacks en formato colapsado (entrada de flamegraph.pl / speedscope)"""
+        lines = [
+            ";".join((stage_name,) + labels) + f" {count}"
+            for (stage_name, labels), count in sorted(self.stacks.items())
+        ]
+        return "\n".join(lines) + "\n"
+
+    def top_functions(self, limit: int = None) -> Dict[str, Any]:
+        """Top-N por etapa: muestras propias (función en la cima) y totales (en cualquier nivel)"""
+        limit = limit or settings.PROFILE_TOP_N
+        by_stage: Dict[str, Dict[str, Counter]] = {}
+        stage_samples: Counter = Counter()
+        for (stage_name, labels), count in self.stacks.items():
+            counters = by_stage.setdefault(stage_name, {"self": Counter(), "total": Counter()})
+            stage_samples[stage_name] += count
+            if labels:
+                counters["self"][labels[-1]] += count
+            for label in set(labels):
+                counters["total"][label] += count
+
+        report = {}
+        for stage_name, counters in by_stage.items():
+            total = stage_samples[stage_name]
+            report[stage_name] = {
+                "samples": total,
+                "seconds": round(total * self.interval, 3),
+                "top": [
+                    {
+                        "function": label,
+                        "self_samples": self_count,
+                        "self_pct": round(100 * self_count / total, 1),
+                        "total_samples": counters["total"][label],
+                        "total_pct": round(100 * counters["total"][label] / total, 1),
+                    }
+                    for label, self_count in counters["self"].most_common(limit)
+                ],
+            }
+        return report
+
+
+def profile_path(profile_id: str) -> Optional[str]:
+    """Ruta del perfil guardado, o None si el id no es válido o no existe"""
+    if not profile_id or not all(ch.isalnum() or ch in "-_" for ch in profile_id):
+        return None
+    path = os.path.join(settings.PROFILE_DIR, f"{profile_id}.collapsed")
+    return path if os.path.exists(path) else None
+
+
+def run_profiled(label: str, func: Callable, *args, **kwargs):
+    """
+    Ejecuta func en el hilo actual bajo el profiler.
+    Devuelve (resultado, resumen); el resumen incluye profile_id y la tabla top-N por etapa.
+    Si func falla, el perfil se guarda igual y la excepción se propaga.
+    """
+    profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{label}-{uuid.uuid4().hex[:6]}"
+    profiler = SamplingProfiler()
+    summary: Dict[str, Any] = {"profile_id": profile_id}
+    profiler.start()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        profiler.stop()
+        summary.update({
+            "duration_seconds": round(profiler.duration, 3),
+            "samples": profiler.samples,
+            "interval_ms": settings.PROFILE_SAMPLE_INTERVAL_MS,
+            "stages": profiler.top_functions(),
+        })
+        try:
+            os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+            path = os.path.join(settings.PROFILE_DIR, f"{profile_id}.collapsed")
+            with open(path, "w") as handle:
+                handle.write(profiler.collapsed())
+            summary["collapsed_path"] = path
+            logging.info(f"🔬 Perfil {profile_id}: {profiler.samples} muestras en {profiler.duration:.1f}s -> {path}")
+        except OSError as e:
+            logging.error(f"🔴 No se pudo guardar el perfil {profile_id}: {e}")
+    return result, summary
+
+
+def profiling_requested(request, profile: bool = False) -> bool:
+    """Perfilado activado por query param (?profile=true) o header X-ETL-Profile: 1"""
+    header = request.headers.get("x-etl-profile", "") if request is not None else ""
+    return bool(profile) or header.strip().lower() in ("1", "true", "yes")
@@ -0,0 +1,61 @@
+# app/core/result_cache.py - CACHÉ EN PROCESO DE RESULTADOS DE CONSULTAS
+"""
+LRU con expiración por entrada. Cada entrada se guarda bajo un ámbito (el
+dataset, así las tiendas no comparten resultados) y declara las tablas de las
+que depende: `invalidate(ambito, tablas)` descarta solo las afectadas.
+"""
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+from collections import OrderedDict
+import threading
+import time
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[float, frozenset, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, scope: str, key: Hashable) -> Tuple[bool, Any]:
+        """(encontrado, valor); las entradas vencidas cuentan como ausentes"""
+        with self._lock:
+            entry = self._entries.get((scope, key))
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[(scope, key)]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end((scope, key))
+            self.hits += 1
+            return True, entry[2]
+
+    def put(self, scope: str, key: Hashable, value: Any, tables: Iterable[str], ttl_seconds: float):
+        if ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[(scope, key)] = (time.monotonic() + ttl_seconds, frozenset(tables), value)
+            self._entries.move_to_end((scope, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, scope: str, tables: Optional[Iterable[str]] = None) -> int:
+        """Descarta las entradas del ámbito que dependen de alguna de las tablas (todas si tables es None)"""
+        tables = frozenset(tables) if tables is not None else None
+        with self._lock:
+            stale = [
+                entry_key for entry_key, (_, depends_on, _) in self._entries.items()
+                if entry_key[0] == scope and (tables is None or depends_on & tables)
+            ]
+            for entry_key in stale:
+                del self._entries[entry_key]
+            if stale:
+                self.invalidations += 1
+            return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
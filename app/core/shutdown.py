@@ -0,0 +1,69 @@
+# app/core/shutdown.py - APAGADO ORDENADO (SIGTERM DE CLOUD RUN)
+"""
+Cloud Run envía SIGTERM al reducir instancias o redesplegar y mata el proceso
+unos segundos después (10 s por defecto). El manejador solo levanta una
+bandera y delega en el de uvicorn; el ETL la consulta entre páginas y pasos:
+
+- deja de pedir páginas a Bsale,
+- carga lo ya validado por el camino rápido (un solo MERGE por tabla),
+- guarda un marcador de reanudación (app/services/resume.py) y lanza
+  ShutdownRequested para que no empiecen pasos nuevos.
+"""
+import logging
+import signal
+import threading
+
+
+class ShutdownRequested(Exception):
+    """La instancia se está apagando: la ejecución se cortó tras guardar lo avanzado"""
+
+    def __init__(self, message: str, processed: int = 0):
+        super().__init__(message)
+        self.processed = processed  # registros ya cargados de la entidad interrumpida
+
+
+_event = threading.Event()
+_installed = False
+
+
+def requested() -> bool:
+    return _event.is_set()
+
+
+def request(reason: str = "SIGTERM"):
+    if not _event.is_set():
+        logging.warning(f"🛑 Apagado solicitado ({reason}): se detiene la descarga y se guarda lo avanzado")
+    _event.set()
+
+
+def check(what: str = ""):
+    """Lanza ShutdownRequested si hay un apagado en curso (entre pasos del ETL)"""
+    if _event.is_set():
+        raise ShutdownRequested(f"ejecución interrumpida por apagado{f' antes de {what}' if what else ''}")
+
+
+def install_signal_handlers():
+    """Encadena SIGTERM/SIGINT: primero la bandera, luego el manejador previo (uvicorn)"""
+    global _installed
+    if _installed:
+        return
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            previous = signal.getsignal(signum)
+        except ValueError:
+            return
+
+        def handler(received, frame, previous=previous):
+            request(signal.Signals(received).name)
+            if callable(previous):
+                previous(received, frame)
+            elif previous == signal.SIG_DFL and received == signal.SIGINT:
+                raise KeyboardInterrupt
+
+        try:
+            signal.signal(signum, handler)
+        except ValueError:
+            # Fuera del hilo principal (p. ej. TestClient): sin manejador
+            logging.info("ℹ️ Manejador de SIGTERM no instalado (no es el hilo principal)")
+            return
+    _installed = True
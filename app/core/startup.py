@@ -0,0 +1,81 @@
+# app/core/startup.py - ARRANQUE EN CALIENTE PARA CLOUD RUN
+"""
+Mide el tiempo de importación y de arranque del servicio y pre-calienta
+clientes (BigQuery) y verificación de tablas dentro del lifespan de FastAPI,
+para que la primera petición de Cloud Scheduler no pague ese costo.
+"""
+from typing import Dict, Any
+import logging
+import time
+
+# Instante en que el proceso empezó a importar la aplicación (lo fija app.main)
+_timings: Dict[str, Any] = {
+    "import_started": None,
+    "import_seconds": None,
+    "warmup_seconds": None,
+    "warmup_steps": {},
+    "warmup_error": None,
+}
+
+
+def mark_import_start():
+    _timings["import_started"] = time.perf_counter()
+
+
+def mark_import_end():
+    if _timings["import_started"] is not None:
+        _timings["import_seconds"] = round(time.perf_counter() - _timings["import_started"], 4)
+        logging.info(f"⏱️ Importación de la aplicación: {_timings['import_seconds']}s")
+
+
+def _timed_step(name: str, func):
+    started = time.perf_counter()
+    result = func()
+    _timings["warmup_steps"][name] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def warm_up():
+    """Pre-inicializa Settings, el cliente BigQuery y las tablas. Sincrónico."""
+    from app.core.config import settings
+
+    if not settings.STARTUP_WARMUP:
+        logging.info("⏭️ Pre-calentamiento deshabilitado (STARTUP_WARMUP=False)")
+        return
+
+    started = time.perf_counter()
+    try:
+        from app.db.warehouse import get_writer
+
+        _timed_step("settings", lambda: settings.BIGQUERY_DATASET)
+        writer = _timed_step("warehouse_client", get_writer)
+        _timed_step("ensure_tables", writer.ensure_all_tables)
+    except Exception as e:
+        # El servicio debe levantar igual; la primera petición reintentará
+        _timings["warmup_error"] = str(e)
+        logging.error(f"🔴 Error pre-calentando el servicio: {e}")
+    finally:
+        _timings["warmup_seconds"] = round(time.perf_counter() - started, 4)
+
+    report = startup_report()
+    if report["within_budget"]:
+        logging.info(f"🔥 Arranque en caliente listo en {report['total_seconds']}s (presupuesto {report['budget_seconds']}s)")
+    else:
+        logging.warning(f"⚠️ Arranque de {report['total_seconds']}s excede el presupuesto de {report['budget_seconds']}s: {report['warmup_steps']}")
+
+
+def startup_report() -> Dict[str, Any]:
+    """Tiempos de importación y pre-calentamiento frente al presupuesto de cold start"""
+    from app.core.config import settings
+
+    total = (_timings["import_seconds"] or 0) + (_timings["warmup_seconds"] or 0)
+    budget = settings.STARTUP_BUDGET_SECONDS
+    return {
+        "import_seconds": _timings["import_seconds"],
+        "warmup_seconds": _timings["warmup_seconds"],
+        "warmup_steps": dict(_timings["warmup_steps"]),
+        "warmup_error": _timings["warmup_error"],
+        "total_seconds": round(total, 4),
+        "budget_seconds": budget,
+        "within_budget": total <= budget,
+    }
@@ -0,0 +1,117 @@
+# app/core/tenancy.py - TIENDAS (CUENTAS BSALE) SERVIDAS POR UNA MISMA INSTANCIA
+"""
+Cada tienda de BSALE_TENANTS tiene su token de Bsale, su dataset de BigQuery,
+su límite de peticiones por segundo y, opcionalmente, otros settings propios:
+
+    [{"name": "centro", "token": "...", "dataset": "bsale_centro",
+      "requests_per_second": 5, "settings": {"GOOGLE_SHEETS_DOC_ID": "..."}}]
+
+`tenant_context(tenant)` activa la tienda en el contexto actual: `settings`
+devuelve sus valores, bsale_client respeta su límite de peticiones y los
+locks por entidad se separan por tienda. Es por contexto (ContextVar): los
+hilos auxiliares deben lanzarse con contextvars.copy_context().
+"""
+from typing import Any, Dict, List, Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import time
+
+from app.core.config import override_settings, settings
+
+
+class RateLimiter:
+    """Espaciado mínimo entre peticiones, compartido por todos los hilos de una tienda"""
+
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second if per_second and per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Tenant:
+    def __init__(self, name: str, token: str, dataset: str, project: str = None,
+                 requests_per_second: float = None, overrides: Dict[str, Any] = None):
+        self.name = name
+        self.token = token
+        self.dataset = dataset
+        self.project = project
+        self.requests_per_second = requests_per_second or settings.TENANT_REQUESTS_PER_SECOND
+        self.limiter = RateLimiter(self.requests_per_second)
+        self.overrides = dict(overrides or {})
+
+    def settings_overrides(self) -> Dict[str, Any]:
+        values = {"BSALE_API_TOKEN": self.token, "BIGQUERY_DATASET": self.dataset}
+        if self.project:
+            values["BIGQUERY_PROJECT"] = self.project
+        values.update(self.overrides)
+        return values
+
+    def describe(self) -> Dict[str, Any]:
+        """Datos públicos de la tienda (sin el token)"""
+        return {"name": self.name, "dataset": self.dataset, "project": self.project or settings.BIGQUERY_PROJECT,
+                "requests_per_second": self.requests_per_second, "settings": sorted(self.overrides)}
+
+
+_current: ContextVar[Optional[Tenant]] = ContextVar("etl_tenant", default=None)
+_tenants_lock = threading.Lock()
+_tenants: Dict[str, Tenant] = {}
+
+
+def configured_tenants() -> List[Tenant]:
+    """Tiendas de BSALE_TENANTS; los limitadores se conservan entre ejecuciones"""
+    tenants = []
+    with _tenants_lock:
+        for entry in settings.BSALE_TENANTS:
+            name = str(entry.get("name") or "").strip()
+            if not name or not entry.get("token") or not entry.get("dataset"):
+                raise ValueError(f"Tienda mal configurada en BSALE_TENANTS (name, token y dataset obligatorios): {name or entry}")
+            tenant = _tenants.get(name)
+            if tenant is None or (tenant.token, tenant.dataset) != (entry["token"], entry["dataset"]):
+                tenant = Tenant(name, entry["token"], entry["dataset"], entry.get("project"),
+                                entry.get("requests_per_second"), entry.get("settings"))
+                _tenants[name] = tenant
+            tenants.append(tenant)
+    return tenants
+
+
+def find_tenant(name: str) -> Optional[Tenant]:
+    """Tienda de BSALE_TENANTS por nombre, o None"""
+    return next((tenant for tenant in configured_tenants() if tenant.name == name), None)
+
+
+def current() -> Optional[Tenant]:
+    return _current.get()
+
+
+@contextmanager
+def tenant_context(tenant: Tenant):
+    token = _current.set(tenant)
+    try:
+        with override_settings(tenant.settings_overrides()):
+            yield tenant
+    finally:
+        _current.reset(token)
+
+
+def throttle():
+    """Espera el turno de la tienda activa antes de una petición a Bsale (no-op sin tienda)"""
+    tenant = _current.get()
+    if tenant is not None:
+        tenant.limiter.acquire()
+
+
+def scoped(name: str) -> str:
+    """Nombre de lock/recurso separado por tienda: 'clientes' -> 'clientes@centro'"""
+    tenant = _current.get()
+    return f"{name}@{tenant.name}" if tenant is not None else name
@@ -2,46 +2,336 @@
 
 This module provides a lightweight wrapper with a simple `insert_rows(table, rows)`
 method so it can be used as a drop-in replacement in the ETL code path.
+
+`google.cloud.bigquery` is imported lazily and the underlying client is shared
+across writers, so importing this module is cheap and the client (plus the
+table existence checks) can be pre-warmed once at startup.
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Sequence, TYPE_CHECKING
+from datetime import datetime, timedelta, timezone
+import json
 import os
-from google.cloud import bigquery
-from google.api_core.exceptions import GoogleAPIError
+import tempfile
+import threading
+import uuid
 from app.core.config import settings
+from app.db.warehouse import WarehouseWriter, schema_columns
+
+if TYPE_CHECKING:
+    from google.cloud import bigquery
+
+_client_lock = threading.Lock()
+_shared_clients: Dict[str, Any] = {}
+# Tables already verified/created in this process; ensure_table_exists skips them
+_ensured_tables = set()
+
+
+def get_bq_client(project: str = None):
+    """Return a process-wide BigQuery client for the project, creating it once."""
+    project = project or settings.BIGQUERY_PROJECT
+    with _client_lock:
+        if project not in _shared_clients:
+            from google.cloud import bigquery
+            # Client uses Application Default Credentials or GOOGLE_APPLICATION_CREDENTIALS
+            _shared_clients[project] = bigquery.Client(project=project)
+        return _shared_clients[project]
+
+
+def _sql_literal(value: Any, field_type: str) -> str:
+    """Render a Python value as a typed BigQuery literal (typed NULLs included)."""
+    bq_type = {"INTEGER": "INT64", "FLOAT": "FLOAT64", "BOOLEAN": "BOOL"}.get(field_type, field_type)
+    if value is None:
+        return f"CAST(NULL AS {bq_type})"
+    if field_type == "INTEGER":
+        return str(int(value))
+    if field_type == "FLOAT":
+        return repr(float(value))
+    if field_type == "BOOLEAN":
+        return "TRUE" if value else "FALSE"
+    if field_type == "TIMESTAMP":
+        if isinstance(value, (int, float)):
+            # Bsale entrega Unix timestamps en segundos
+            return f"TIMESTAMP_SECONDS({int(value)})"
+        return f"TIMESTAMP({json.dumps(str(value))})"
+    if field_type == "DATE":
+        return f"DATE({json.dumps(str(value)[:10])})"
+    # json.dumps escapes quotes, backslashes and control characters BigQuery-compatibly
+    return json.dumps(str(value), ensure_ascii=False)
+
+
+def _load_json_row(row: Dict[str, Any], timestamp_columns: Sequence[str]) -> Dict[str, Any]:
+    """Row for a JSON load job: Unix-second TIMESTAMPs rendered as ISO strings."""
+    if not timestamp_columns:
+        return row
+    row = dict(row)
+    for name in timestamp_columns:
+        if isinstance(row.get(name), (int, float)):
+            row[name] = datetime.fromtimestamp(row[name], tz=timezone.utc).isoformat()
+    return row
+
+
+def merge_statement(table_ref: str, source_sql: str, merge_key: str, names: Sequence[str],
+                    update_columns: Sequence[str]) -> str:
+    """MERGE of source_sql into table_ref by merge_key (text only, nothing is executed)."""
+    updates = ",\n            ".join(
+        f"{name} = source.{name}" for name in update_columns if name in names and name != merge_key
+    )
+    return f"""
+    MERGE `{table_ref}` AS target
+    USING (
+        {source_sql}
+    ) AS source
+    ON target.{merge_key} = source.{merge_key}
+    WHEN MATCHED THEN 
+        UPDATE SET 
+            {updates}
+    WHEN NOT MATCHED THEN
+        INSERT ({', '.join(names)})
+        VALUES ({', '.join('source.' + name for name in names)})
+    """
+
+
+def render_merge(table_ref: str, table_name: str, rows: List[Dict[str, Any]], merge_key: str,
+                 update_columns: Sequence[str]) -> str:
+    """MERGE over an UNNEST of STRUCT literals for one batch; needs no client (ETL preview)."""
+    columns = schema_columns(table_name, rows)
+    structs = []
+    for row in rows:
+        fields = ", ".join(
+            f"{_sql_literal(row.get(column.name), column.field_type)} AS {column.name}"
+            for column in columns
+        )
+        structs.append(f"STRUCT({fields})")
+    source_sql = f"""SELECT * FROM UNNEST([
+            {','.join(structs)}
+        ])"""
+    return merge_statement(table_ref, source_sql, merge_key, [column.name for column in columns], update_columns)
+
 
+class BigQueryWriter(WarehouseWriter):
+    backend = "bigquery"
 
-class BigQueryWriter:
     def __init__(self, project: str = None, dataset: str = None):
         self.project = project or settings.BIGQUERY_PROJECT
         self.dataset = dataset or settings.BIGQUERY_DATASET
         if not self.dataset:
             raise ValueError("BIGQUERY_DATASET must be set to use BigQueryWriter")
 
-        # Client uses Application Default Credentials or GOOGLE_APPLICATION_CREDENTIALS
-        self.client = bigquery.Client(project=self.project)
+        self.client = get_bq_client(self.project)
+
+        # Tables loaded through the Storage Write API instead of streaming inserts
+        self.storage_write_tables = {
+            t.strip() for t in (settings.BIGQUERY_STORAGE_WRITE_TABLES or "").split(",") if t.strip()
+        }
+        self._storage_loader = None
 
     def _table_ref(self, table_name: str) -> str:
         if self.project:
             return f"{self.project}.{self.dataset}.{table_name}"
         return f"{self.dataset}.{table_name}"
 
+    def _get_storage_loader(self):
+        if self._storage_loader is None:
+            from app.db.storage_write import StorageWriteLoader
+            self._storage_loader = StorageWriteLoader(
+                self.project, self.dataset, self.client,
+                batch_rows=settings.BIGQUERY_STORAGE_WRITE_BATCH_ROWS,
+            )
+        return self._storage_loader
+
+    def defers_inserts(self, table_name: str) -> bool:
+        """Storage Write tables: appended rows stay in a pending stream until commit()."""
+        return table_name in self.storage_write_tables
+
     def insert_rows(self, table_name: str, rows: List[Dict[str, Any]]):
         """Insert a list of JSON rows into the target BigQuery table.
 
-        Uses insert_rows_json which performs streaming inserts.
+        Uses insert_rows_json which performs streaming inserts, unless the table
+        is listed in BIGQUERY_STORAGE_WRITE_TABLES: then rows are appended to a
+        pending Storage Write stream and become visible on commit().
         Returns the API response (list of errors) or empty list on success.
         """
+        if table_name in self.storage_write_tables:
+            self._get_storage_loader().append_rows(table_name, rows)
+            return []
+
         table_id = self._table_ref(table_name)
         try:
             errors = self.client.insert_rows_json(table_id, rows)
             if errors:
                 # Raise an exception so caller can handle/rollback if needed
+                from google.api_core.exceptions import GoogleAPIError
                 raise GoogleAPIError(f"BigQuery insert errors: {errors}")
             return []
         except Exception:
             # Re-raise for the caller; preserve stack trace
             raise
 
+    def commit(self):
+        """Commit pending Storage Write streams (exactly once per run)."""
+        if self._storage_loader is not None:
+            return self._storage_loader.commit()
+        return {}
+
+    def rollback(self):
+        """Discard pending Storage Write streams without committing them."""
+        if self._storage_loader is not None:
+            self._storage_loader.abort()
+
+    def _merge_statement(self, table_name: str, source_sql: str, merge_key: str, names: Sequence[str],
+                         update_columns: Sequence[str]) -> str:
+        return merge_statement(self._table_ref(table_name), source_sql, merge_key, names, update_columns)
+
+    def build_merge(self, table_name: str, rows: List[Dict[str, Any]], merge_key: str,
+                    update_columns: Sequence[str]) -> str:
+        """Build a MERGE statement over an UNNEST of STRUCT literals for one batch."""
+        return render_merge(self._table_ref(table_name), table_name, rows, merge_key, update_columns)
+
+    def dry_run(self, sql: str) -> int:
+        """Bytes the statement would process, without running it (dry-run jobs are free)."""
+        from google.cloud import bigquery
+
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        return self.client.query(sql, job_config=job_config).total_bytes_processed or 0
+
+    def estimate_merge_bytes(self, table_name: str, rows: List[Dict[str, Any]], merge_key: str,
+                             update_columns: Sequence[str]) -> int:
+        """Dry-run of the MERGE upsert_rows would issue for this batch."""
+        return self.dry_run(self.build_merge(table_name, rows, merge_key, update_columns))
+
+    def upsert_staged(self, table_name: str, rows: List[Dict[str, Any]], merge_key: str,
+                      update_columns: Sequence[str]):
+        """Load the rows into a staging table (free load job) and MERGE it with one statement.
+
+        The target table is scanned once instead of once per batch. The staging
+        table expires after an hour in case the process dies before dropping it.
+        """
+        from google.cloud import bigquery
+
+        columns = schema_columns(table_name, rows)
+        staging_ref = self._table_ref(f"_staging_{table_name}_{uuid.uuid4().hex[:12]}")
+        staging = bigquery.Table(
+            staging_ref, schema=[bigquery.SchemaField(column.name, column.field_type) for column in columns]
+        )
+        staging.expires = datetime.now(timezone.utc) + timedelta(hours=1)
+        self.client.create_table(staging)
+        try:
+            timestamps = [column.name for column in columns if column.field_type == "TIMESTAMP"]
+            self._load_ndjson(staging_ref, (_load_json_row(row, timestamps) for row in rows))
+            return self.query(self._merge_statement(
+                table_name, f"SELECT * FROM `{staging_ref}`", merge_key, [column.name for column in columns],
+                update_columns,
+            ))
+        finally:
+            self.client.delete_table(staging_ref, not_found_ok=True)
+
+    @property
+    def report_timezone(self) -> str:
+        return settings.REPORT_TIMEZONE
+
+    def date_expression(self, column: str) -> str:
+        """Calendar date in the reporting timezone (Chile by default)."""
+        return f'DATE({column}, "{self.report_timezone}")'
+
+    def date_literal(self, value: str) -> str:
+        return f"DATE '{value}'"
+
+    def upsert_rows(self, table_name: str, rows: List[Dict[str, Any]], merge_key: str,
+                    update_columns: Sequence[str]):
+        """MERGE one batch into the table."""
+        return self.query(self.build_merge(table_name, rows, merge_key, update_columns))
+
+    def merge_select(self, table_name: str, select_sql: str, merge_keys: Sequence[str],
+                     columns: Sequence[str]):
+        """Single set-based MERGE statement with a SELECT as source."""
+        updates = ",\n            ".join(f"{name} = source.{name}" for name in columns if name not in merge_keys)
+        match = " AND ".join(f"target.{key} = source.{key}" for key in merge_keys)
+        return self.query(f"""
+    MERGE `{self._table_ref(table_name)}` AS target
+    USING ({select_sql}) AS source
+    ON {match}
+    WHEN MATCHED THEN
+        UPDATE SET
+            {updates}
+    WHEN NOT MATCHED THEN
+        INSERT ({', '.join(columns)})
+        VALUES ({', '.join('source.' + name for name in columns)})
+    """)
+
+    def replace_where(self, table_name: str, condition: str, select_sql: str, columns: Sequence[str]):
+        """One MERGE that never matches: inserts every source row and deletes the target rows in condition."""
+        return self.query(f"""
+    MERGE `{self._table_ref(table_name)}` AS target
+    USING ({select_sql}) AS source
+    ON FALSE
+    WHEN NOT MATCHED THEN
+        INSERT ({', '.join(columns)})
+        VALUES ({', '.join('source.' + name for name in columns)})
+    WHEN NOT MATCHED BY SOURCE AND {condition} THEN
+        DELETE
+    """)
+
+    def _load_ndjson(self, table_id: str, rows: Iterable[Dict[str, Any]], truncate: bool = False) -> int:
+        """Append rows to table_id with one load job (NDJSON staged in a temp file).
+
+        truncate=True replaces the table (or the partition of a `table$YYYYMMDD` id) instead.
+        """
+        from google.cloud import bigquery
+
+        count = 0
+        with tempfile.TemporaryFile(mode="w+b") as handle:
+            for row in rows:
+                handle.write(json.dumps(row, default=str).encode("utf-8"))
+                handle.write(b"\n")
+                count += 1
+            if not count:
+                return 0
+            handle.seek(0)
+            job_config = bigquery.LoadJobConfig(
+                source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE if truncate
+                else bigquery.WriteDisposition.WRITE_APPEND,
+            )
+            self.client.load_table_from_file(handle, table_id, job_config=job_config).result()
+        return count
+
+    def load_rows(self, table_name: str, rows: Iterable[Dict[str, Any]]) -> int:
+        """Append rows with one load job (NDJSON staged in a temp file, WRITE_APPEND).
+
+        Load jobs are free and skip the streaming buffer, so the rows are
+        immediately available to DML.
+        """
+        return self._load_ndjson(self._table_ref(table_name), rows)
+
+    def delete_keys(self, table_names: Sequence[str], key: str, ids: Sequence[int]):
+        """Multi-statement transaction; the ids travel as an ARRAY query parameter into a temp table."""
+        from google.cloud import bigquery
+
+        if not ids:
+            return
+        deletes = "\n".join(
+            f"    DELETE FROM `{self._table_ref(table_name)}` WHERE {key} IN (SELECT id FROM claves);"
+            for table_name in table_names
+        )
+        sql = f"""
+    CREATE TEMP TABLE claves AS SELECT id FROM UNNEST(@ids) AS id;
+    BEGIN TRANSACTION;
+{deletes}
+    COMMIT TRANSACTION;
+    """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ArrayQueryParameter("ids", "INT64", [int(i) for i in ids])]
+        )
+        query_job = self.client.query(sql, job_config=job_config)
+        query_job.result()
+        self.costs.record(sql, query_job.total_bytes_billed)
+
+    def replace_partition(self, table_name: str, partition_field: str, value: str,
+                          rows: Iterable[Dict[str, Any]]) -> int:
+        """One WRITE_TRUNCATE load job to the `table$YYYYMMDD` partition decorator (atomic, no DML)."""
+        partition = f"{self._table_ref(table_name)}${value.replace('-', '')}"
+        return self._load_ndjson(partition, rows, truncate=True)
+
     def query(self, sql: str):
         """Execute a SQL query on BigQuery.
         
@@ -50,87 +340,56 @@ class BigQueryWriter:
         try:
             query_job = self.client.query(sql)
             result = query_job.result()  # Wait for the job to complete
+            self.costs.record(sql, query_job.total_bytes_billed)
             return result
         except Exception:
             # Re-raise for the caller; preserve stack trace
             raise
 
-    def ensure_table_exists(self, table_name: str, schema: List[bigquery.SchemaField]):
+    def query_pages(self, sql: str, page_size: int):
+        """One query job; its result is read page by page (page_size rows per API call)."""
+        query_job = self.client.query(sql)
+        result = query_job.result(page_size=page_size)
+        self.costs.record(sql, query_job.total_bytes_billed)
+        for page in result.pages:
+            yield list(page)
+
+    def ensure_table_exists(self, table_name: str, schema: Sequence[Any], partition_field: str = None):
         """Create a table if it doesn't exist.
         
         Args:
             table_name: Name of the table to create
-            schema: List of SchemaField objects defining the table structure
+            schema: List of Column/SchemaField objects defining the table structure
+            partition_field: Optional DATE/TIMESTAMP column for daily partitioning
         """
         table_id = self._table_ref(table_name)
+        if table_id in _ensured_tables:
+            return
+        from google.cloud import bigquery
+        schema = [bigquery.SchemaField(field.name, field.field_type, mode=field.mode) for field in schema]
         try:
-            self.client.get_table(table_id)
-            # Table exists, do nothing
+            table = self.client.get_table(table_id)
         except Exception:
+            table = None
+
+        if table is not None:
+            # Table exists: add any new NULLABLE columns missing from it
+            existing = {field.name for field in table.schema}
+            missing = [field for field in schema if field.name not in existing and field.mode != "REQUIRED"]
+            if missing:
+                table.schema = list(table.schema) + missing
+                self.client.update_table(table, ["schema"])
+                print(f"✅ Tabla {table_name}: columnas agregadas {[f.name for f in missing]}")
+        else:
             # Table doesn't exist, create it
             table = bigquery.Table(table_id, schema=schema)
+            if partition_field:
+                table.time_partitioning = bigquery.TimePartitioning(
+                    type_=bigquery.TimePartitioningType.DAY, field=partition_field
+                )
             self.client.create_table(table)
             print(f"✅ Tabla {table_name} creada exitosamente")
-
-    def ensure_all_tables(self):
-        """Create all required tables for the ETL if they don't exist."""
-        from google.cloud.bigquery import SchemaField
-        
-        # Schema for cliente table - aligned with ETL output
-        cliente_schema = [
-            SchemaField("id_cliente", "INTEGER", mode="REQUIRED"),
-            SchemaField("nombre", "STRING"),
-            SchemaField("apellido", "STRING"),
-            SchemaField("rut", "STRING"),
-            SchemaField("email", "STRING"),
-            SchemaField("telefono", "STRING"),
-            SchemaField("direccion", "STRING"),
-            SchemaField("fecha_creacion", "TIMESTAMP"),
-        ]
-        
-        # Schema for producto table - aligned with ETL output
-        producto_schema = [
-            SchemaField("id_producto", "INTEGER", mode="REQUIRED"),
-            SchemaField("nombre", "STRING"),
-            SchemaField("descripcion", "STRING"),
-            SchemaField("codigo_sku", "STRING"),
-            SchemaField("codigo_barras", "STRING"),
-            SchemaField("controla_stock", "INTEGER"),
-            SchemaField("precio_neto", "FLOAT"),
-            SchemaField("costo_neto", "FLOAT"),
-            SchemaField("estado", "INTEGER"),
-            SchemaField("fecha_creacion", "TIMESTAMP"),
-        ]
-        
-        # Schema for documento_venta table - aligned with ETL output
-        documento_schema = [
-            SchemaField("id_documento", "INTEGER", mode="REQUIRED"),
-            SchemaField("id_cliente", "INTEGER"),
-            SchemaField("id_tipo_documento", "INTEGER"),
-            SchemaField("folio", "INTEGER"),
-            SchemaField("fecha_emision", "TIMESTAMP"),
-            SchemaField("monto_neto", "FLOAT"),
-            SchemaField("monto_iva", "FLOAT"),
-            SchemaField("monto_total", "FLOAT"),
-            SchemaField("fecha_creacion", "TIMESTAMP"),
-        ]
-        
-        # Schema for detalle_documento table - aligned with ETL output
-        detalle_schema = [
-            SchemaField("id_detalle", "INTEGER", mode="REQUIRED"),
-            SchemaField("id_documento", "INTEGER"),
-            SchemaField("id_producto", "INTEGER"),
-            SchemaField("cantidad", "FLOAT"),
-            SchemaField("precio_neto_unitario", "FLOAT"),
-            SchemaField("descuento_porcentual", "FLOAT"),
-            SchemaField("monto_total_linea", "FLOAT"),
-            SchemaField("fecha_creacion", "TIMESTAMP"),
-        ]
-        
-        self.ensure_table_exists("cliente", cliente_schema)
-        self.ensure_table_exists("producto", producto_schema)
-        self.ensure_table_exists("documento_venta", documento_schema)
-        self.ensure_table_exists("detalle_documento", detalle_schema)
+        _ensured_tables.add(table_id)
 
 
 def get_bq_writer() -> BigQueryWriter:
@@ -0,0 +1,210 @@
+"""Local SQLite warehouse backend.
+
+Implements the same `WarehouseWriter` contract as `BigQueryWriter` on a local
+SQLite file, so the full pipeline (and loader comparisons) can run offline.
+Upserts stage the batch in a temp table and run `UPDATE ... FROM` plus
+`INSERT ... WHERE NOT EXISTS` in one transaction, which mirrors BigQuery
+MERGE: matched rows update only the update columns, unmatched rows are
+inserted, duplicated source keys fail and the table has no unique constraint.
+"""
+from typing import Any, Dict, Iterable, List, Sequence
+from datetime import datetime, timezone
+import re
+import sqlite3
+import threading
+
+from app.core.config import settings
+from app.db.warehouse import WarehouseWriter, assert_unique_keys
+
+_SQLITE_TYPES = {
+    "INTEGER": "INTEGER",
+    "FLOAT": "REAL",
+    "BOOLEAN": "INTEGER",
+    "STRING": "TEXT",
+    "TIMESTAMP": "TEXT",
+    "DATE": "TEXT",
+}
+
+# `project.dataset.table` -> table, so BigQuery-flavoured statements run locally
+_QUALIFIED_TABLE = re.compile(r"`(?:[^`.]+\.)*([^`.]+)`")
+
+
+def _to_sqlite(value: Any, field_type: str) -> Any:
+    if value is None:
+        return None
+    if field_type == "TIMESTAMP" and isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc).isoformat()
+    if field_type == "BOOLEAN":
+        return 1 if value else 0
+    return value
+
+
+class SQLiteWriter(WarehouseWriter):
+    backend = "sqlite"
+
+    def __init__(self, path: str = None):
+        self.path = path or settings.LOCAL_WAREHOUSE_PATH
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._schemas: Dict[str, Dict[str, str]] = {}
+
+    def _column_types(self, table_name: str) -> Dict[str, str]:
+        if table_name not in self._schemas:
+            raise ValueError(f"Tabla {table_name} no inicializada en el warehouse local")
+        return self._schemas[table_name]
+
+    def ensure_table_exists(self, table_name: str, schema: Sequence[Any], partition_field: str = None):
+        with self._lock, self.connection:
+            existing = {row["name"] for row in self.connection.execute(f"PRAGMA table_info({table_name})")}
+            if not existing:
+                columns = ", ".join(
+                    f"{field.name} {_SQLITE_TYPES.get(field.field_type, 'TEXT')}"
+                    + (" NOT NULL" if field.mode == "REQUIRED" else "")
+                    for field in schema
+                )
+                self.connection.execute(f"CREATE TABLE {table_name} ({columns})")
+                if partition_field:
+                    # Sin particiones en SQLite: un índice cumple el mismo rol de poda
+                    self.connection.execute(
+                        f"CREATE INDEX ix_{table_name}_{partition_field} ON {table_name}({partition_field})"
+                    )
+            else:
+                for field in schema:
+                    if field.name not in existing and field.mode != "REQUIRED":
+                        self.connection.execute(
+                            f"ALTER TABLE {table_name} ADD COLUMN {field.name} {_SQLITE_TYPES.get(field.field_type, 'TEXT')}"
+                        )
+        self._schemas[table_name] = {field.name: field.field_type for field in schema}
+
+    def upsert_rows(self, table_name: str, rows: List[Dict[str, Any]], merge_key: str,
+                    update_columns: Sequence[str]):
+        if not rows:
+            return
+        assert_unique_keys(table_name, rows, merge_key)
+        types = self._column_types(table_name)
+        names = [name for name in types if any(name in row for row in rows)]
+        updates = [name for name in update_columns if name in names and name != merge_key]
+        columns = ", ".join(names)
+        values = [[_to_sqlite(row.get(name), types[name]) for name in names] for row in rows]
+        with self._lock, self.connection:
+            self.connection.execute(
+                f"CREATE INDEX IF NOT EXISTS ix_{table_name}_{merge_key} ON {table_name}({merge_key})"
+            )
+            self.connection.execute("DROP TABLE IF EXISTS temp.merge_source")
+            self.connection.execute(f"CREATE TEMP TABLE merge_source AS SELECT {columns} FROM {table_name} WHERE 0")
+            self.connection.executemany(
+                f"INSERT INTO temp.merge_source ({columns}) VALUES ({', '.join('?' for _ in names)})", values
+            )
+            if updates:
+                self.connection.execute(
+                    f"UPDATE {table_name} SET {', '.join(f'{name} = source.{name}' for name in updates)} "
+                    f"FROM temp.merge_source AS source WHERE {table_name}.{merge_key} = source.{merge_key}"
+                )
+            self.connection.execute(
+                f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM temp.merge_source AS source "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table_name} AS target WHERE target.{merge_key} = source.{merge_key})"
+            )
+            self.connection.execute("DROP TABLE temp.merge_source")
+
+    def merge_select(self, table_name: str, select_sql: str, merge_keys: Sequence[str],
+                     columns: Sequence[str]):
+        names = ", ".join(columns)
+        updates = [name for name in columns if name not in merge_keys]
+        match = " AND ".join(f"target.{key} IS source.{key}" for key in merge_keys)
+        select_sql = _QUALIFIED_TABLE.sub(r"\1", select_sql)
+        with self._lock, self.connection:
+            self.connection.execute("DROP TABLE IF EXISTS temp.merge_select")
+            self.connection.execute(f"CREATE TEMP TABLE merge_select AS {select_sql}")
+            if updates:
+                self.connection.execute(
+                    f"UPDATE {table_name} AS target SET {', '.join(f'{name} = source.{name}' for name in updates)} "
+                    f"FROM temp.merge_select AS source WHERE {match}"
+                )
+            self.connection.execute(
+                f"INSERT INTO {table_name} ({names}) SELECT {names} FROM temp.merge_select AS source "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table_name} AS target WHERE {match})"
+            )
+            self.connection.execute("DROP TABLE temp.merge_select")
+
+    def replace_where(self, table_name: str, condition: str, select_sql: str, columns: Sequence[str]):
+        """DELETE + INSERT in one transaction (SQLite has no MERGE)."""
+        names = ", ".join(columns)
+        select_sql = _QUALIFIED_TABLE.sub(r"\1", select_sql)
+        with self._lock, self.connection:
+            self.connection.execute(f"DELETE FROM {table_name} AS target WHERE {condition}")
+            self.connection.execute(f"INSERT INTO {table_name} ({names}) {select_sql}")
+
+    def delete_keys(self, table_names: Sequence[str], key: str, ids: Sequence[int]):
+        """Temp table of ids and one DELETE per table in a single transaction."""
+        if not ids:
+            return
+        with self._lock, self.connection:
+            self.connection.execute("DROP TABLE IF EXISTS temp.delete_keys")
+            self.connection.execute("CREATE TEMP TABLE delete_keys (id INTEGER PRIMARY KEY)")
+            self.connection.executemany("INSERT OR IGNORE INTO temp.delete_keys (id) VALUES (?)",
+                                        [(int(i),) for i in ids])
+            for table_name in table_names:
+                self.connection.execute(
+                    f"DELETE FROM {table_name} WHERE {key} IN (SELECT id FROM temp.delete_keys)"
+                )
+            self.connection.execute("DROP TABLE temp.delete_keys")
+
+    def replace_partition(self, table_name: str, partition_field: str, value: str,
+                          rows: Iterable[Dict[str, Any]]) -> int:
+        """DELETE of the day + INSERT in one transaction."""
+        rows = list(rows)
+        types = self._column_types(table_name)
+        names = [name for name in types if any(name in row for row in rows)]
+        sql = f"INSERT INTO {table_name} ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})"
+        with self._lock, self.connection:
+            self.connection.execute(f"DELETE FROM {table_name} WHERE {partition_field} = ?", (value,))
+            if rows:
+                self.connection.executemany(
+                    sql, [[_to_sqlite(row.get(name), types[name]) for name in names] for row in rows]
+                )
+        return len(rows)
+
+    def insert_rows(self, table_name: str, rows: List[Dict[str, Any]]):
+        if not rows:
+            return []
+        types = self._column_types(table_name)
+        names = [name for name in types if any(name in row for row in rows)]
+        sql = f"INSERT INTO {table_name} ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})"
+        with self._lock, self.connection:
+            self.connection.executemany(
+                sql, [[_to_sqlite(row.get(name), types[name]) for name in names] for row in rows]
+            )
+        return []
+
+    def query(self, sql: str):
+        """Run a statement; fully-qualified BigQuery table names are reduced to the table name."""
+        with self._lock, self.connection:
+            return self.connection.execute(_QUALIFIED_TABLE.sub(r"\1", sql)).fetchall()
+
+    def query_pages(self, sql: str, page_size: int):
+        """A single cursor on its own connection, so the read doesn't hold the writer lock between pages."""
+        connection = sqlite3.connect(self.path)
+        connection.row_factory = sqlite3.Row
+        try:
+            cursor = connection.execute(_QUALIFIED_TABLE.sub(r"\1", sql))
+            while True:
+                page = cursor.fetchmany(page_size)
+                if not page:
+                    return
+                yield page
+        finally:
+            connection.close()
+
+
+_writers: Dict[str, SQLiteWriter] = {}
+_writer_lock = threading.Lock()
+
+
+def get_sqlite_writer() -> SQLiteWriter:
+    """One SQLite connection per database file and process, shared like the BigQuery client."""
+    path = settings.LOCAL_WAREHOUSE_PATH
+    with _writer_lock:
+        if path not in _writers:
+            _writers[path] = SQLiteWriter(path)
+        return _writers[path]
@@ -0,0 +1,117 @@
+"""Per-run accounting of BigQuery bytes (estimated by dry-run and actually billed).
+
+Every writer owns one ledger (`writer.costs`), reset at the start of each
+request or scheduler run. The ETL asks the ledger before a batched MERGE
+whether the projection (one full scan of the target table per statement)
+fits in BIGQUERY_RUN_BYTES_BUDGET and switches to a staged load + single
+MERGE when it does not.
+"""
+from typing import Any, Dict, Optional
+import logging
+import re
+import threading
+
+# BigQuery factura como mínimo 10 MB por tabla referenciada en una consulta
+MIN_BILLED_BYTES = 10 * 2**20
+
+_TARGET_TABLE = re.compile(r"^\s*(?:MERGE|INSERT\s+INTO|DELETE\s+FROM|UPDATE|CREATE\s+TABLE)\s+`?([\w.-]+)`?",
+                           re.IGNORECASE)
+
+
+class QueryBudgetExceeded(Exception):
+    """The run would bill more bytes than BIGQUERY_RUN_BYTES_BUDGET (strict mode)."""
+
+
+def statement_table(sql: str) -> str:
+    """Target table of a DML statement, or 'consultas' for anything else."""
+    match = _TARGET_TABLE.match(sql)
+    if not match:
+        return "consultas"
+    return match.group(1).split(".")[-1]
+
+
+class QueryCostLedger:
+    """Estimated and billed bytes per table for one run."""
+
+    def __init__(self, budget_bytes: int = 0, usd_per_tib: float = 6.25):
+        self.budget_bytes = budget_bytes or 0
+        self.usd_per_tib = usd_per_tib
+        self._lock = threading.Lock()
+        self._statement_estimates: Dict[str, Optional[int]] = {}
+        self.tables: Dict[str, Dict[str, Any]] = {}
+        self.exceeded = False
+
+    def reset(self):
+        """Start a new run (the local backend shares one writer across requests)."""
+        with self._lock:
+            self._statement_estimates.clear()
+            self.tables.clear()
+            self.exceeded = False
+
+    def _table(self, table_name: str) -> Dict[str, Any]:
+        return self.tables.setdefault(table_name, {
+            "estimated_bytes": 0, "billed_bytes": 0, "statements": 0, "strategies": {},
+        })
+
+    @property
+    def billed_bytes(self) -> int:
+        with self._lock:
+            return sum(entry["billed_bytes"] for entry in self.tables.values())
+
+    @property
+    def estimated_bytes(self) -> int:
+        with self._lock:
+            return sum(entry["estimated_bytes"] for entry in self.tables.values())
+
+    def has_estimate(self, table_name: str) -> bool:
+        return table_name in self._statement_estimates
+
+    def statement_estimate(self, table_name: str) -> Optional[int]:
+        """Dry-run bytes of one representative MERGE into the table (None if unknown)."""
+        return self._statement_estimates.get(table_name)
+
+    def set_statement_estimate(self, table_name: str, total_bytes: Optional[int]):
+        if total_bytes is not None:
+            total_bytes = max(int(total_bytes), MIN_BILLED_BYTES)
+        self._statement_estimates[table_name] = total_bytes
+
+    def would_exceed(self, projected_bytes: int) -> bool:
+        return bool(self.budget_bytes) and self.billed_bytes + projected_bytes > self.budget_bytes
+
+    def plan(self, table_name: str, strategy: str, projected_bytes: int):
+        """Record the strategy chosen for one upsert and its projected bytes."""
+        with self._lock:
+            entry = self._table(table_name)
+            entry["estimated_bytes"] += projected_bytes
+            entry["strategies"][strategy] = entry["strategies"].get(strategy, 0) + 1
+
+    def record(self, sql: str, billed_bytes: Optional[int]):
+        """Record one executed statement and the bytes BigQuery billed for it."""
+        with self._lock:
+            entry = self._table(statement_table(sql))
+            entry["statements"] += 1
+            entry["billed_bytes"] += int(billed_bytes or 0)
+
+    def usd(self, total_bytes: int) -> float:
+        return round(total_bytes / 2**40 * self.usd_per_tib, 4)
+
+    def report(self) -> Dict[str, Any]:
+        billed = self.billed_bytes
+        estimated = self.estimated_bytes
+        with self._lock:
+            tables = {name: dict(entry, strategies=dict(entry["strategies"])) for name, entry in self.tables.items()}
+        return {
+            "budget_bytes": self.budget_bytes or None,
+            "estimated_bytes": estimated,
+            "billed_bytes": billed,
+            "estimated_usd": self.usd(estimated),
+            "billed_usd": self.usd(billed),
+            "budget_exceeded": self.exceeded,
+            "tables": tables,
+        }
+
+    def log_summary(self):
+        report = self.report()
+        if report["tables"]:
+            logging.info(f"💰 BigQuery: {report['billed_bytes'] / 2**30:.2f} GiB facturados "
+                         f"(estimado {report['estimated_bytes'] / 2**30:.2f} GiB, US$ {report['billed_usd']})")
@@ -1,4 +1,9 @@
+import contextvars
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import gspread
 from google.oauth2.service_account import Credentials
 from app.core.config import settings
@@ -9,54 +14,163 @@ SCOPE = [
     'https://www.googleapis.com/auth/drive',
 ]
 
+# Códigos HTTP que se reintentan con backoff (cuota y errores transitorios)
+RETRYABLE_STATUS = {429, 500, 502, 503}
+
+
+class RequestQuota:
+    """Cuota compartida de peticiones por minuto (ventana deslizante), segura entre hilos"""
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self._calls = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._calls = [t for t in self._calls if now - t < 60]
+                if len(self._calls) < self.per_minute:
+                    self._calls.append(now)
+                    return
+                wait = 60 - (now - self._calls[0])
+            time.sleep(max(wait, 0.05))
+
+
 class SheetsSync:
     def __init__(self, sheet_id: str = None, credentials_file: str = None):
         self.sheet_id = sheet_id or settings.GOOGLE_SHEETS_DOC_ID
         self.credentials_file = credentials_file or settings.GOOGLE_SHEETS_CREDENTIALS
-        
+
         if not self.sheet_id or not self.credentials_file:
             raise ValueError("Google Sheets configuración faltante: GOOGLE_SHEETS_DOC_ID y GOOGLE_SHEETS_CREDENTIALS son requeridos")
-        
+
         creds = Credentials.from_service_account_file(self.credentials_file, scopes=SCOPE)
         self.gc = gspread.authorize(creds)
-        self.sh = self.gc.open_by_key(self.sheet_id)
+        self.quota = RequestQuota(settings.SHEETS_REQUESTS_PER_MINUTE)
+        self.sh = self._call(self.gc.open_by_key, self.sheet_id)
+
+    def _call(self, func, *args, **kwargs):
+        """Ejecuta una petición a la API respetando la cuota y reintentando 429/5xx con backoff"""
+        for attempt in range(settings.SHEETS_MAX_RETRIES + 1):
+            self.quota.acquire()
+            try:
+                return func(*args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                status = getattr(e, "code", None) or getattr(getattr(e, "response", None), "status_code", None)
+                if status not in RETRYABLE_STATUS or attempt == settings.SHEETS_MAX_RETRIES:
+                    raise
+                delay = min(64, 2 ** attempt) + random.uniform(0, 1)
+                logging.warning(f"⏳ Google Sheets respondió {status}, reintento {attempt + 1} en {delay:.1f}s")
+                time.sleep(delay)
+
+    def _prepare_worksheets(self, sizes: dict):
+        """
+        sizes: {titulo: (filas, columnas)}
+        Deja cada hoja vacía y con el tamaño justo en UNA sola petición batch_update:
+        las existentes se redimensionan y limpian, las que faltan se crean.
+        """
+        existing = {ws.title: ws.id for ws in self._call(self.sh.worksheets)}
+        requests = []
+        for table_name, (row_count, col_count) in sizes.items():
+            grid = {"rowCount": max(row_count, 1), "columnCount": max(col_count, 1)}
+            if table_name in existing:
+                sheet_id = existing[table_name]
+                requests.append({"updateCells": {"range": {"sheetId": sheet_id}, "fields": "userEnteredValue"}})
+                requests.append({"updateSheetProperties": {
+                    "properties": {"sheetId": sheet_id, "gridProperties": grid},
+                    "fields": "gridProperties(rowCount,columnCount)",
+                }})
+            else:
+                logging.info(f"📄 Creando nueva hoja: {table_name}")
+                requests.append({"addSheet": {"properties": {"title": table_name, "gridProperties": grid}}})
+        if requests:
+            self._call(self.sh.batch_update, {"requests": requests})
+
+    def _write_chunk(self, title: str, start_row: int, values: list):
+        self._call(self.sh.values_batch_update, {
+            "valueInputOption": "RAW",
+            "data": [{"range": f"'{title}'!A{start_row}", "values": values}],
+        })
+
+    def _write_pages(self, title: str, headers: list, total_rows: int, pages) -> int:
+        """Escribe las páginas una a una (solo una página en memoria); el encabezado va con la primera"""
+        written = 0
+        pending = [headers]
+        for page in pages:
+            page = page[:total_rows - written]
+            if not page:
+                break
+            values = pending + [[_cell(row.get(h)) for h in headers] for row in page]
+            self._write_chunk(title, written + 2 - len(pending), values)
+            written += len(page)
+            pending = []
+        if pending:
+            self._write_chunk(title, 1, pending)
+        return written
+
+    def export_streams(self, sources: dict) -> dict:
+        """
+        sources: {titulo: (total_filas, encabezados, páginas)} donde páginas es un iterable de listas de dicts.
+        Prepara todas las hojas en una petición y escribe cada una en su propio hilo, compartiendo
+        la cuota por minuto. Devuelve {tabla: filas escritas | error}.
+        """
+        logging.info(f"📊 Iniciando sincronización a Google Sheets...")
+        if not sources:
+            return {}
+        try:
+            self._prepare_worksheets({
+                table: (total_rows + 1, len(headers)) for table, (total_rows, headers, _) in sources.items()
+            })
+        except Exception as e:
+            logging.error(f"🔴 Error preparando hojas en Google Sheets: {e}")
+            return {table: f"error: {e}" for table in sources}
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=settings.SHEETS_MAX_WORKERS) as executor:
+            futures = {
+                executor.submit(contextvars.copy_context().run, self._write_pages, table, headers, total_rows, pages): table
+                for table, (total_rows, headers, pages) in sources.items()
+            }
+            for future in as_completed(futures):
+                table = futures[future]
+                try:
+                    results[table] = future.result()
+                    logging.info(f"✅ Hoja '{table}' actualizada con {results[table]} registros")
+                except Exception as e:
+                    logging.error(f"🔴 Error sincronizando hoja '{table}' a Google Sheets: {e}")
+                    results[table] = f"error: {e}"
+        logging.info(f"✅ Sincronización a Google Sheets completada")
+        return results
 
     def upsert_table(self, table_name: str, rows: list):
         """
         Crea o reemplaza la hoja con el nombre table_name y carga los datos (incluye encabezados).
         """
-        if not rows:
-            logging.info(f"📋 No hay datos para sincronizar en Google Sheets: {table_name}")
-            return
-            
-        # Si existe, elimina la hoja
-        try:
-            worksheet = self.sh.worksheet(table_name)
-            self.sh.del_worksheet(worksheet)
-            logging.info(f"🗑️ Hoja '{table_name}' eliminada para recrearla")
-        except gspread.exceptions.WorksheetNotFound:
-            logging.info(f"📄 Creando nueva hoja: {table_name}")
-            
-        # Crea la hoja
-        worksheet = self.sh.add_worksheet(title=table_name, rows=len(rows)+10, cols=50)
-        
-        # Escribir encabezados y datos
-        headers = list(rows[0].keys())
-        values = [headers] + [[str(row.get(h, '')) for h in headers] for row in rows]
-        worksheet.update('A1', values)
-        logging.info(f"✅ Hoja '{table_name}' actualizada con {len(rows)} registros")
-
-    def sync_all(self, data_dict: dict):
+        return self.sync_all({table_name: rows})
+
+    def sync_all(self, data_dict: dict) -> dict:
         """
         data_dict: {'cliente': [...], 'producto': [...], ...}
+        Variante en memoria de export_streams: cada tabla se escribe en bloques de SHEETS_CHUNK_ROWS filas.
         """
-        logging.info(f"📊 Iniciando sincronización a Google Sheets...")
+        results = {}
+        sources = {}
+        chunk_rows = settings.SHEETS_CHUNK_ROWS
         for table, rows in data_dict.items():
-            try:
-                self.upsert_table(table, rows)
-            except Exception as e:
-                logging.error(f"🔴 Error sincronizando hoja '{table}' a Google Sheets: {e}")
-        logging.info(f"✅ Sincronización a Google Sheets completada")
+            if not rows:
+                logging.info(f"📋 No hay datos para sincronizar en Google Sheets: {table}")
+                results[table] = 0
+                continue
+            pages = (rows[start:start + chunk_rows] for start in range(0, len(rows), chunk_rows))
+            sources[table] = (len(rows), list(rows[0].keys()), pages)
+        results.update(self.export_streams(sources))
+        return results
+
+
+def _cell(value):
+    return "" if value is None else str(value)
 
 
 def get_sheets_sync():
@@ -0,0 +1,231 @@
+"""BigQuery Storage Write API loader.
+
+Rows are appended to one PENDING write stream per table and only become
+visible when `commit()` finalizes and batch-commits every stream, so each run
+lands its rows exactly once. Unlike `insert_rows_json`, committed rows never
+sit in the streaming buffer and can be MERGEd/DELETEd right away.
+
+Serialization uses a protobuf message built at runtime from the table schema.
+"""
+from typing import List, Dict, Any
+from datetime import datetime, date, timezone
+import logging
+
+from google.cloud import bigquery
+
+_EPOCH_DATE = date(1970, 1, 1)
+
+# Límite del API: 10 MB por AppendRowsRequest. Dejamos margen.
+MAX_REQUEST_BYTES = 8 * 1024 * 1024
+
+
+def _import_storage():
+    """Lazy import: google-cloud-bigquery-storage is only needed when enabled."""
+    try:
+        from google.cloud import bigquery_storage_v1
+        from google.cloud.bigquery_storage_v1 import types, writer
+    except ImportError as e:
+        raise ImportError(
+            "google-cloud-bigquery-storage es requerido para BIGQUERY_STORAGE_WRITE_TABLES"
+        ) from e
+    return bigquery_storage_v1, types, writer
+
+
+def _build_row_class(table_name: str, schema: List[bigquery.SchemaField]):
+    """Build a proto2 message class (and its DescriptorProto) for a table schema."""
+    from google.protobuf import descriptor_pb2, descriptor_pool
+
+    field_types = {
+        "INTEGER": descriptor_pb2.FieldDescriptorProto.TYPE_INT64,
+        "INT64": descriptor_pb2.FieldDescriptorProto.TYPE_INT64,
+        "FLOAT": descriptor_pb2.FieldDescriptorProto.TYPE_DOUBLE,
+        "FLOAT64": descriptor_pb2.FieldDescriptorProto.TYPE_DOUBLE,
+        "NUMERIC": descriptor_pb2.FieldDescriptorProto.TYPE_STRING,
+        "STRING": descriptor_pb2.FieldDescriptorProto.TYPE_STRING,
+        "BOOLEAN": descriptor_pb2.FieldDescriptorProto.TYPE_BOOL,
+        "BOOL": descriptor_pb2.FieldDescriptorProto.TYPE_BOOL,
+        # TIMESTAMP: microsegundos desde epoch; DATE: días desde epoch
+        "TIMESTAMP": descriptor_pb2.FieldDescriptorProto.TYPE_INT64,
+        "DATE": descriptor_pb2.FieldDescriptorProto.TYPE_INT32,
+    }
+
+    message_name = f"{table_name}_row"
+    file_proto = descriptor_pb2.FileDescriptorProto(
+        name=f"{message_name}.proto", package="etl_storage_write", syntax="proto2"
+    )
+    message_proto = file_proto.message_type.add(name=message_name)
+    for number, field in enumerate(schema, start=1):
+        if field.field_type not in field_types:
+            raise ValueError(f"Tipo {field.field_type} no soportado por Storage Write ({table_name}.{field.name})")
+        message_proto.field.add(
+            name=field.name,
+            number=number,
+            type=field_types[field.field_type],
+            label=descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL,
+        )
+
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    descriptor = pool.FindMessageTypeByName(f"etl_storage_write.{message_name}")
+    try:
+        from google.protobuf.message_factory import GetMessageClass
+        row_class = GetMessageClass(descriptor)
+    except ImportError:  # protobuf < 4.21
+        from google.protobuf import message_factory
+        row_class = message_factory.MessageFactory(pool).GetPrototype(descriptor)
+
+    return row_class, message_proto
+
+
+def _to_proto_value(value: Any, field_type: str):
+    """Convert an ETL row value into the wire representation of its column."""
+    if field_type == "TIMESTAMP":
+        if isinstance(value, datetime):
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=timezone.utc)
+            return int(value.timestamp() * 1_000_000)
+        if isinstance(value, str):
+            return int(datetime.fromisoformat(value).timestamp() * 1_000_000)
+        # Bsale entrega Unix timestamps en segundos
+        return int(float(value) * 1_000_000)
+    if field_type == "DATE":
+        if isinstance(value, str):
+            value = date.fromisoformat(value[:10])
+        if isinstance(value, datetime):
+            value = value.date()
+        return (value - _EPOCH_DATE).days
+    if field_type in ("INTEGER", "INT64"):
+        return int(value)
+    if field_type in ("FLOAT", "FLOAT64"):
+        return float(value)
+    if field_type in ("BOOLEAN", "BOOL"):
+        return bool(value)
+    return str(value)
+
+
+class _PendingStream:
+    """One PENDING write stream for a single table, with offset-tracked appends."""
+
+    def __init__(self, write_client, types, writer, parent: str, table_name: str,
+                 schema: List[bigquery.SchemaField], batch_rows: int):
+        self.parent = parent
+        self.table_name = table_name
+        self.schema = schema
+        self.batch_rows = batch_rows
+        self.row_class, descriptor_proto = _build_row_class(table_name, schema)
+        self._types = types
+        self._write_client = write_client
+
+        self.write_stream = write_client.create_write_stream(
+            parent=parent,
+            write_stream=types.WriteStream(type_=types.WriteStream.Type.PENDING),
+        )
+
+        proto_schema = types.ProtoSchema(proto_descriptor=descriptor_proto)
+        request_template = types.AppendRowsRequest(
+            write_stream=self.write_stream.name,
+            proto_rows=types.AppendRowsRequest.ProtoData(writer_schema=proto_schema),
+        )
+        self.append_stream = writer.AppendRowsStream(write_client, request_template)
+        self.offset = 0
+        self.futures = []
+
+    def _serialize(self, row: Dict[str, Any]) -> bytes:
+        message = self.row_class()
+        for field in self.schema:
+            value = row.get(field.name)
+            if value is None:
+                continue
+            setattr(message, field.name, _to_proto_value(value, field.field_type))
+        return message.SerializeToString()
+
+    def _send(self, serialized: List[bytes]):
+        proto_rows = self._types.ProtoRows(serialized_rows=serialized)
+        request = self._types.AppendRowsRequest(
+            # El offset explícito hace que un reintento del mismo lote sea rechazado
+            # por el servidor (ALREADY_EXISTS) en vez de duplicar filas.
+            offset=self.offset,
+            proto_rows=self._types.AppendRowsRequest.ProtoData(rows=proto_rows),
+        )
+        self.futures.append(self.append_stream.send(request))
+        self.offset += len(serialized)
+
+    def append(self, rows: List[Dict[str, Any]]):
+        batch, batch_bytes = [], 0
+        for row in rows:
+            payload = self._serialize(row)
+            if batch and (len(batch) >= self.batch_rows or batch_bytes + len(payload) > MAX_REQUEST_BYTES):
+                self._send(batch)
+                batch, batch_bytes = [], 0
+            batch.append(payload)
+            batch_bytes += len(payload)
+        if batch:
+            self._send(batch)
+
+    def finalize(self) -> str:
+        """Wait for every append, close the connection and finalize the stream."""
+        for future in self.futures:
+            future.result()
+        self.append_stream.close()
+        self._write_client.finalize_write_stream(name=self.write_stream.name)
+        return self.write_stream.name
+
+    def abort(self):
+        try:
+            self.append_stream.close()
+        except Exception:
+            pass
+
+
+class StorageWriteLoader:
+    """Accumulates appends per table and commits them atomically once per run."""
+
+    def __init__(self, project: str, dataset: str, client: bigquery.Client, batch_rows: int = 500):
+        bigquery_storage_v1, types, writer = _import_storage()
+        self.project = project
+        self.dataset = dataset
+        self.client = client
+        self.batch_rows = batch_rows
+        self._types = types
+        self._writer = writer
+        self.write_client = bigquery_storage_v1.BigQueryWriteClient()
+        self._streams: Dict[str, _PendingStream] = {}
+
+    def _stream_for(self, table_name: str) -> _PendingStream:
+        if table_name not in self._streams:
+            table = self.client.get_table(f"{self.project}.{self.dataset}.{table_name}")
+            parent = self.write_client.table_path(self.project, self.dataset, table_name)
+            self._streams[table_name] = _PendingStream(
+                self.write_client, self._types, self._writer, parent, table_name,
+                list(table.schema), self.batch_rows,
+            )
+        return self._streams[table_name]
+
+    def append_rows(self, table_name: str, rows: List[Dict[str, Any]]):
+        """Append rows to the table's pending stream. Not visible until commit()."""
+        if not rows:
+            return
+        self._stream_for(table_name).append(rows)
+
+    def commit(self) -> Dict[str, int]:
+        """Finalize and batch-commit every pending stream. Returns rows committed per table."""
+        committed = {}
+        streams, self._streams = self._streams, {}
+        for table_name, stream in streams.items():
+            stream_name = stream.finalize()
+            response = self.write_client.batch_commit_write_streams(
+                self._types.BatchCommitWriteStreamsRequest(parent=stream.parent, write_streams=[stream_name])
+            )
+            if response.stream_errors:
+                raise RuntimeError(f"Storage Write commit falló para {table_name}: {list(response.stream_errors)}")
+            committed[table_name] = stream.offset
+            logging.info(f"✅ Storage Write: {stream.offset} filas confirmadas en {table_name}")
+        return committed
+
+    def abort(self):
+        """Drop pending streams; uncommitted PENDING data is discarded by BigQuery."""
+        streams, self._streams = self._streams, {}
+        for stream in streams.values():
+            stream.abort()
+        if streams:
+            logging.warning(f"⚠️ Storage Write: descartados streams pendientes de {', '.join(streams)}")
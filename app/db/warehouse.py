@@ -0,0 +1,238 @@
+"""Warehouse writer interface shared by the BigQuery and local backends.
+
+The ETL only talks to a `WarehouseWriter`: ensure the schema, upsert a batch
+by merge key with MERGE semantics, insert raw rows and run queries. Table
+schemas live here as backend-neutral `Column`s (same attribute names as
+`bigquery.SchemaField`) so every backend creates identical tables.
+"""
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence
+
+from app.db.query_cost import QueryCostLedger
+
+
+class Column(NamedTuple):
+    name: str
+    field_type: str
+    mode: str = "NULLABLE"
+
+
+TABLE_SCHEMAS: Dict[str, List[Column]] = {
+    # Schema for cliente table - aligned with ETL output
+    "cliente": [
+        Column("id_cliente", "INTEGER", "REQUIRED"),
+        Column("nombre", "STRING"),
+        Column("apellido", "STRING"),
+        Column("rut", "STRING"),
+        Column("email", "STRING"),
+        Column("telefono", "STRING"),
+        Column("direccion", "STRING"),
+        Column("fecha_creacion", "TIMESTAMP"),
+        Column("eliminado_en", "TIMESTAMP"),  # tombstone: borrado o inactivo en Bsale (reconciliación)
+    ],
+    # Schema for producto table - aligned with ETL output
+    "producto": [
+        Column("id_producto", "INTEGER", "REQUIRED"),
+        Column("id_producto_padre", "INTEGER"),
+        Column("nombre", "STRING"),
+        Column("descripcion", "STRING"),
+        Column("codigo_sku", "STRING"),
+        Column("codigo_barras", "STRING"),
+        Column("controla_stock", "INTEGER"),
+        Column("precio_neto", "FLOAT"),
+        Column("costo_neto", "FLOAT"),
+        Column("estado", "INTEGER"),
+        Column("fecha_creacion", "TIMESTAMP"),
+    ],
+    # Schema for documento_venta table - aligned with ETL output
+    "documento_venta": [
+        Column("id_documento", "INTEGER", "REQUIRED"),
+        Column("id_cliente", "INTEGER"),
+        Column("id_tipo_documento", "INTEGER"),
+        Column("folio", "INTEGER"),
+        Column("fecha_emision", "TIMESTAMP"),
+        Column("monto_neto", "FLOAT"),
+        Column("monto_iva", "FLOAT"),
+        Column("monto_total", "FLOAT"),
+        Column("fecha_creacion", "TIMESTAMP"),
+        Column("eliminado_en", "TIMESTAMP"),  # tombstone: borrado o anulado en Bsale (reconciliación)
+    ],
+    # Schema for detalle_documento table - aligned with ETL output
+    "detalle_documento": [
+        Column("id_detalle", "INTEGER", "REQUIRED"),
+        Column("id_documento", "INTEGER"),
+        Column("id_producto", "INTEGER"),
+        Column("cantidad", "FLOAT"),
+        Column("precio_neto_unitario", "FLOAT"),
+        Column("descuento_porcentual", "FLOAT"),
+        Column("monto_total_linea", "FLOAT"),
+        Column("fecha_creacion", "TIMESTAMP"),
+    ],
+}
+
+
+class WarehouseWriter(ABC):
+    """Operations the ETL needs from a warehouse backend."""
+
+    #: Short backend name, reported in logs and run results
+    backend = "abstract"
+
+    @abstractmethod
+    def ensure_table_exists(self, table_name: str, schema: Sequence[Any], partition_field: str = None):
+        """Create the table if missing and add new NULLABLE columns if it exists.
+
+        partition_field: DATE/TIMESTAMP column to partition by (daily), where supported.
+        """
+
+    def ensure_all_tables(self):
+        """Create all required tables for the ETL if they don't exist."""
+        for table_name, schema in TABLE_SCHEMAS.items():
+            self.ensure_table_exists(table_name, schema)
+
+    @abstractmethod
+    def upsert_rows(self, table_name: str, rows: List[Dict[str, Any]], merge_key: str,
+                    update_columns: Sequence[str]):
+        """MERGE one batch by merge_key: update update_columns when matched, insert otherwise.
+
+        Like BigQuery MERGE, a batch with duplicated merge keys must fail.
+        """
+
+    @abstractmethod
+    def insert_rows(self, table_name: str, rows: List[Dict[str, Any]]):
+        """Append rows without deduplication."""
+
+    def defers_inserts(self, table_name: str) -> bool:
+        """True if insert_rows into the table only becomes visible at commit()."""
+        return False
+
+    def load_rows(self, table_name: str, rows: Iterable[Dict[str, Any]]) -> int:
+        """Append rows in one bulk load (a single load job where supported). Returns the row count.
+
+        Rows may be a generator; TIMESTAMP/DATE values should be ISO strings.
+        """
+        rows = list(rows)
+        self.insert_rows(table_name, rows)
+        return len(rows)
+
+    @abstractmethod
+    def delete_keys(self, table_names: Sequence[str], key: str, ids: Sequence[int]):
+        """Delete the rows whose key is in ids from every table, in order, in one transaction.
+
+        ids are staged once (not inlined per statement); if any delete fails none is applied.
+        """
+
+    @abstractmethod
+    def replace_partition(self, table_name: str, partition_field: str, value: str,
+                          rows: Iterable[Dict[str, Any]]) -> int:
+        """Atomically replace the rows whose partition_field (DATE) equals value with rows.
+
+        Readers see either the old or the new partition, never an empty one. Returns the row count.
+        """
+
+    def upsert_staged(self, table_name: str, rows: List[Dict[str, Any]], merge_key: str,
+                      update_columns: Sequence[str]):
+        """Upsert all rows with a single MERGE statement, whatever their number.
+
+        BigQuery stages the rows in a temporary table first; backends without
+        per-statement cost just run upsert_rows once.
+        """
+        return self.upsert_rows(table_name, rows, merge_key, update_columns)
+
+    def estimate_merge_bytes(self, table_name: str, rows: List[Dict[str, Any]], merge_key: str,
+                             update_columns: Sequence[str]) -> Optional[int]:
+        """Bytes one upsert_rows batch would process (dry-run), or None if the backend doesn't bill by bytes."""
+        return None
+
+    @property
+    def costs(self) -> QueryCostLedger:
+        """Bytes estimated and billed through this writer (one writer per run)."""
+        if getattr(self, "_costs", None) is None:
+            from app.core.config import settings
+            self._costs = QueryCostLedger(settings.BIGQUERY_RUN_BYTES_BUDGET, settings.BIGQUERY_USD_PER_TIB)
+        return self._costs
+
+    @abstractmethod
+    def merge_select(self, table_name: str, select_sql: str, merge_keys: Sequence[str],
+                     columns: Sequence[str]):
+        """Set-based MERGE of a SELECT into the table on merge_keys.
+
+        Matched rows get every non-key column in columns updated; unmatched rows are inserted.
+        """
+
+    @abstractmethod
+    def replace_where(self, table_name: str, condition: str, select_sql: str, columns: Sequence[str]):
+        """Atomically replace the rows matching condition with the rows of a SELECT.
+
+        condition refers to the table as `target` (ej. "target.fecha IN (...)");
+        if the statement fails no row is deleted.
+        """
+
+    @abstractmethod
+    def query(self, sql: str):
+        """Run a statement and return an iterable of mapping-like rows."""
+
+    def query_pages(self, sql: str, page_size: int) -> Iterator[List[Any]]:
+        """Run a SELECT once and yield its rows in pages of up to page_size.
+
+        One statement for the whole read (one BigQuery job, not one per page).
+        """
+        page = []
+        for row in self.query(sql):
+            page.append(row)
+            if len(page) >= page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    @property
+    def report_timezone(self) -> str:
+        """Timezone used by date_expression."""
+        return "UTC"
+
+    def date_expression(self, column: str) -> str:
+        """SQL expression truncating a TIMESTAMP column to a calendar date."""
+        return f"DATE({column})"
+
+    def date_literal(self, value: str) -> str:
+        """SQL literal for an ISO date (YYYY-MM-DD)."""
+        return f"'{value}'"
+
+    def commit(self):
+        """Make pending writes visible. No-op for backends that write immediately."""
+        return {}
+
+    def rollback(self):
+        """Discard pending writes that were not committed."""
+
+
+def schema_columns(table_name: str, rows: List[Dict[str, Any]]) -> List[Column]:
+    """Columns of the table schema that are present in the rows, in schema order."""
+    present = set()
+    for row in rows:
+        present.update(row.keys())
+    return [column for column in TABLE_SCHEMAS[table_name] if column.name in present]
+
+
+def assert_unique_keys(table_name: str, rows: List[Dict[str, Any]], merge_key: str):
+    """Raise like BigQuery MERGE does when several source rows share a key."""
+    seen = set()
+    for row in rows:
+        key = row.get(merge_key)
+        if key in seen:
+            raise ValueError(
+                f"UPDATE/MERGE must match at most one source row for each target row "
+                f"({table_name}.{merge_key}={key})"
+            )
+        seen.add(key)
+
+
+def get_writer() -> WarehouseWriter:
+    """Writer for the configured WAREHOUSE_BACKEND ('bigquery' or 'sqlite')."""
+    from app.core.config import settings
+
+    if settings.WAREHOUSE_BACKEND == "sqlite":
+        from app.db.local_warehouse import get_sqlite_writer
+        return get_sqlite_writer()
+    from app.db.bigquery_client import get_bq_writer
+    return get_bq_writer()
@@ -1,19 +1,41 @@
 # main.py
+from app.core import shutdown, startup
+startup.mark_import_start()
+
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
 from datetime import datetime
+import asyncio
 import os
 from app.api import endpoints
 from app.api import scheduler_endpoints
+from app.api import webhook_endpoints
+from app.api import report_endpoints
+
+startup.mark_import_end()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # SIGTERM de Cloud Run: cortar el ETL en curso guardando lo avanzado (después de los de uvicorn)
+    shutdown.install_signal_handlers()
+    # Pre-calentar clientes y tablas antes de aceptar tráfico
+    await asyncio.to_thread(startup.warm_up)
+    yield
+
 
 app = FastAPI(
     title="Imperio Patitas ETL - Cloud Run",
     description="ETL robusto para extraer, transformar y cargar datos desde Bsale a BigQuery con integridad de datos.",
-    version="2.0.0-cloud-run"
+    version="2.0.0-cloud-run",
+    lifespan=lifespan
 )
 
 # Incluimos las rutas definidas en el módulo de endpoints
 app.include_router(endpoints.router, prefix="/api/v1")
 app.include_router(scheduler_endpoints.router, prefix="/api/v1")
+app.include_router(webhook_endpoints.router, prefix="/api/v1")
+app.include_router(report_endpoints.router, prefix="/api/v1")
 
 @app.get("/")
 def root():
@@ -33,6 +55,13 @@ def health_check():
     """
     return {"status": "ok"}
 
+@app.get("/health/startup", tags=["Monitoring"])
+def startup_health():
+    """
+    Tiempos de importación y pre-calentamiento frente al presupuesto de cold start.
+    """
+    return startup.startup_report()
+
 # Configuración para Cloud Run
 if __name__ == "__main__":
     import uvicorn
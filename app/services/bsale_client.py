@@ -1,11 +1,69 @@
 # app/services/bsale_client.py
+import contextvars
+import itertools
+import json
+import re
 import requests
+import threading
 import time
-from typing import List, Dict, Any
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Iterator, List, Dict, Any, Optional
 
+from app.core import memory_budget, tenancy
 from app.core.config import settings
 
+try:
+    from app.services import bsale_models
+except ImportError:
+    # msgspec no instalado: respuestas decodificadas como JSON genérico
+    bsale_models = None
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+class RequestCounter:
+    """Peticiones a Bsale por endpoint ('variants/{id}/costs.json' agrupa todas las variantes)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_endpoint: Counter = Counter()
+
+    def add(self, endpoint: str):
+        with self._lock:
+            self.by_endpoint[re.sub(r"/\d+", "/{id}", endpoint)] += 1
+
+    @property
+    def total(self) -> int:
+        with self._lock:
+            return sum(self.by_endpoint.values())
+
+
+_request_counter: contextvars.ContextVar = contextvars.ContextVar("bsale_request_counter", default=None)
+
+
+@contextmanager
+def count_requests():
+    """Cuenta las peticiones hechas en este contexto (y en hilos que copian el contexto)"""
+    counter = RequestCounter()
+    token = _request_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _request_counter.reset(token)
+
+
 class BsaleClient:
+    # Registros re-leídos de la página anterior en paginación estable
+    STABLE_PAGE_OVERLAP = 10
+    # Tamaño de página normal y mínimo (bajo presión de memoria)
+    PAGE_LIMIT = 100
+    MIN_PAGE_LIMIT = 25
+
     def fetch(self, endpoint: str, params: Dict = None) -> Dict[str, Any]:
         """
         Realiza una petición GET canónica a la API de Bsale.
@@ -15,9 +73,9 @@ class BsaleClient:
         """
         url = f"{self.base_url}/{endpoint}"
         try:
-            response = requests.get(url, headers=self.headers, params=params, timeout=60)
+            response = self._get(url, params)
             response.raise_for_status()
-            return response.json()
+            return self._decode(endpoint, response.content)
         except requests.exceptions.HTTPError as http_err:
             print(f"[BsaleClient.fetch] Error HTTP al consultar {url} con params {params}: {http_err}")
             print(f"Respuesta: {response.text}")
@@ -25,51 +83,202 @@ class BsaleClient:
         except Exception as err:
             print(f"[BsaleClient.fetch] Error inesperado al consultar {url}: {err}")
             return None
+
+    def fetch_resource(self, endpoint: str, params: Dict = None) -> Optional[Dict[str, Any]]:
+        """
+        Recurso individual ('<resource>/<id>.json'), para cargas por id.
+        A diferencia de fetch, solo devuelve None si el recurso no existe (404);
+        429/5xx y errores de red se propagan para que el id se reintente.
+        """
+        response = self._get(f"{self.base_url}/{endpoint}", params)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return self._decode(endpoint, response.content)
     def __init__(self):
         self.base_url = "https://api.bsale.io/v1"
-        self.headers = {
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        # Se lee en cada petición para no forzar Settings() al importar el módulo
+        return {
             'access_token': settings.BSALE_API_TOKEN,
             'Content-Type': 'application/json'
         }
 
-    def _get_all_pages(self, endpoint: str, params: Dict = None) -> List[Dict[str, Any]]:
-        all_items = []
+    def _get(self, url: str, params: Dict = None) -> requests.Response:
+        """GET con el límite de tasa de la tienda activa; lo cuenta si hay un count_requests activo"""
+        tenancy.throttle()
+        counter = _request_counter.get()
+        if counter is not None:
+            counter.add(url[len(self.base_url) + 1:] if url.startswith(self.base_url) else url)
+        return requests.get(url, headers=self.headers, params=params, timeout=60)
+
+    def _decode(self, endpoint: str, content: bytes) -> Any:
+        """
+        Decodifica una respuesta: con el modelo tipado del endpoint (msgspec, solo
+        los campos que usa el ETL) si existe y BSALE_TYPED_DECODING está activo;
+        si no, o si el payload no calza con el modelo, con orjson/json.
+        """
+        if bsale_models is not None and settings.BSALE_TYPED_DECODING:
+            try:
+                decoded = bsale_models.decode(endpoint, content)
+            except bsale_models.DecodeError as err:
+                print(f"[BsaleClient] {endpoint}: payload fuera del modelo tipado ({err}), se decodifica genérico")
+                decoded = None
+            if decoded is not None:
+                return decoded
+        return _json_loads(content)
+
+    def iter_pages(self, endpoint: str, params: Dict = None, stable: bool = False,
+                   adaptive: bool = False, start_offset: int = 0) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Recorre un endpoint paginado por offset entregando una página a la vez.
+        stable=True: pensado para listados que cambian durante la descarga (documentos).
+        Cada página se pide solapada STABLE_PAGE_OVERLAP registros con la anterior
+        (cubre filas que retroceden por borrados) y los items se deduplican por
+        'id' (cubre filas que avanzan por inserciones), así cada id aparece una vez.
+        adaptive=True: el tamaño de página baja bajo presión de memoria (memory_budget).
+        start_offset: continuar una descarga interrumpida desde ese registro.
+        Los errores HTTP se propagan.
+        """
         url = f"{self.base_url}/{endpoint}"
-        offset = 0
-        limit = 100
+        offset = start_offset
+        limit = self.PAGE_LIMIT
+        overlap = self.STABLE_PAGE_OVERLAP if stable else 0
+        seen_ids = set()
+        duplicates = 0
 
         while True:
+            if adaptive:
+                limit = memory_budget.budget.chunk_size(self.PAGE_LIMIT, self.MIN_PAGE_LIMIT)
+            current_params = params.copy() if params else {}
+            current_params.update({'limit': limit, 'offset': max(0, offset - overlap)})
+
+            response = self._get(url, current_params)
             try:
-                current_params = params.copy() if params else {}
-                current_params.update({'limit': limit, 'offset': offset})
-    
-                response = requests.get(url, headers=self.headers, params=current_params, timeout=60)
                 response.raise_for_status()
-                data = response.json()
+            except requests.exceptions.HTTPError:
+                print(f"Respuesta: {response.text}")
+                raise
+            items = self._decode(endpoint, response.content).get('items', [])
+            del response
+            if not items:
+                break
 
-                items = data.get('items', [])
-                if not items:
+            if stable:
+                page = []
+                for item in items:
+                    item_id = item.get('id')
+                    if item_id in seen_ids:
+                        duplicates += 1
+                        continue
+                    seen_ids.add(item_id)
+                    page.append(item)
+                offset = max(0, offset - overlap) + len(items)
+                if page:
+                    yield page
+                if len(items) < limit:
                     break
-
-                all_items.extend(items)
+            else:
                 offset += len(items)
-                time.sleep(0.2)
-            except requests.exceptions.HTTPError as http_err:
-                print(f"Error HTTP al consultar {url} con params {current_params}: {http_err}")
-                print(f"Respuesta: {response.text}")
-                return [] # Devuelve lista vacía en caso de error
-            except Exception as err:
-                print(f"Ocurrió un error inesperado al consultar {url}: {err}")
-                return [] # Devuelve lista vacía en caso de error
-        
+                yield items
+            time.sleep(0.2)
+
+        if duplicates:
+            print(f"[BsaleClient] {endpoint}: {duplicates} items repetidos entre páginas descartados")
+
+    def _request_page(self, endpoint: str, params: Dict, offset: int, limit: int) -> Dict[str, Any]:
+        current_params = dict(params or {})
+        current_params.update({'limit': limit, 'offset': offset})
+        response = self._get(f"{self.base_url}/{endpoint}", current_params)
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            print(f"Respuesta: {response.text}")
+            raise
+        return self._decode(endpoint, response.content)
+
+    def iter_pages_parallel(self, endpoint: str, params: Dict = None, workers: int = 4,
+                            stable: bool = False) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Descarga paginada concurrente para listados grandes (stock, ventanas de documentos).
+        La primera página trae 'count'; el resto de offsets se piden con `workers`
+        hilos y las páginas se entregan según terminan (sin orden), con a lo sumo
+        2 × workers páginas en vuelo. Los errores HTTP se propagan.
+        stable=True: como en iter_pages, cada página se solapa STABLE_PAGE_OVERLAP
+        registros con la anterior y los items se deduplican por 'id'.
+        """
+        limit = self.PAGE_LIMIT
+        step = limit - (self.STABLE_PAGE_OVERLAP if stable else 0)
+        seen_ids = set()
+
+        def fresh(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            if not stable:
+                return items
+            page = [item for item in items if item.get('id') not in seen_ids]
+            seen_ids.update(item.get('id') for item in page)
+            return page
+
+        first = self._request_page(endpoint, params, 0, limit)
+        items = fresh(first.get('items', []))
+        if items:
+            yield items
+        total = int(first.get('count') or 0)
+        offsets = iter(range(step, total, step))
+
+        # Los hilos corren en una copia del contexto: mismo token y límite de la tienda activa
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = set()
+            for offset in itertools.islice(offsets, 2 * workers):
+                in_flight.add(executor.submit(context.copy().run, self._request_page, endpoint, params, offset, limit))
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page = fresh(future.result().get('items', []))
+                    if page:
+                        yield page
+                    offset = next(offsets, None)
+                    if offset is not None:
+                        in_flight.add(executor.submit(context.copy().run, self._request_page, endpoint, params, offset, limit))
+
+    def _get_all_pages(self, endpoint: str, params: Dict = None, stable: bool = False) -> List[Dict[str, Any]]:
+        """
+        Descarga todas las páginas de un endpoint paginado por offset (ver iter_pages).
+        Devuelve lista vacía si alguna petición falla.
+        """
+        all_items = []
+        try:
+            for page in self.iter_pages(endpoint, params=params, stable=stable):
+                all_items.extend(page)
+        except requests.exceptions.HTTPError as http_err:
+            print(f"Error HTTP al consultar {self.base_url}/{endpoint} con params {params}: {http_err}")
+            return [] # Devuelve lista vacía en caso de error
+        except Exception as err:
+            print(f"Ocurrió un error inesperado al consultar {self.base_url}/{endpoint}: {err}")
+            return [] # Devuelve lista vacía en caso de error
         return all_items
 
-    def get_documents(self, start_date: str = None) -> List[Dict[str, Any]]:
+    def _document_params(self, start_date: str = None) -> Dict[str, Any]:
         params = {'expand': 'details'}
         if start_date:
-            # Lógica de fecha (si la necesitas)
-            pass
-        return self._get_all_pages("documents.json", params=params)
+            # Rango [start_date, ahora] fijado al inicio: límite del snapshot de esta ejecución
+            start_ts = int(datetime.strptime(start_date, '%Y-%m-%d').timestamp())
+            params['emissiondaterange'] = f"[{start_ts},{int(time.time())}]"
+        return params
+
+    def get_documents(self, start_date: str = None) -> List[Dict[str, Any]]:
+        return self._get_all_pages("documents.json", params=self._document_params(start_date), stable=True)
+
+    def iter_documents(self, start_date: str = None) -> Iterator[List[Dict[str, Any]]]:
+        """Páginas de documentos (con detalles), de tamaño adaptado a la presión de memoria"""
+        return self.iter_pages("documents.json", params=self._document_params(start_date),
+                               stable=True, adaptive=True)
+
+    def iter_stocks(self, workers: int = 4) -> Iterator[List[Dict[str, Any]]]:
+        """Páginas del stock por variante y sucursal (descarga concurrente)"""
+        return self.iter_pages_parallel("stocks.json", workers=workers)
 
     def get_clients(self) -> List[Dict[str, Any]]:
         return self._get_all_pages("clients.json")
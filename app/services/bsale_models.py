@@ -0,0 +1,144 @@
+# app/services/bsale_models.py - MODELOS TIPADOS DE LOS PAYLOADS DE BSALE
+"""
+Decodificación rápida de las respuestas de Bsale con msgspec.
+
+Cada modelo declara solo los campos que el ETL usa; el resto del JSON
+(hrefs, urls de PDF, impuestos, pagos, etc.) se salta durante el parseo sin
+crear objetos Python. El resultado se entrega como dicts (sin los campos
+ausentes o nulos), así los validadores y la cuarentena no cambian.
+
+Requiere `msgspec` (opcional): bsale_client cae a orjson/json si no está.
+"""
+from typing import Any, Dict, Generic, List, Optional, TypeVar
+from functools import lru_cache
+import re
+
+import msgspec
+
+DecodeError = msgspec.DecodeError
+
+T = TypeVar("T")
+
+
+class BsaleModel(msgspec.Struct, omit_defaults=True):
+    """Base: campos desconocidos se ignoran; nulos y ausentes no se materializan"""
+
+
+class Ref(BsaleModel):
+    id: Optional[int] = None
+
+
+class Page(BsaleModel, Generic[T]):
+    items: List[T] = []
+    count: Optional[int] = None
+
+
+class Client(BsaleModel):
+    id: Optional[int] = None
+    firstName: Optional[str] = None
+    lastName: Optional[str] = None
+    code: Optional[str] = None
+    email: Optional[str] = None
+    phone: Optional[str] = None
+    address: Optional[str] = None
+    creationDate: Optional[int] = None
+    state: Optional[int] = None
+
+
+class CostHistory(BsaleModel):
+    cost: Optional[float] = None
+
+
+class Cost(BsaleModel):
+    averageCost: Optional[float] = None
+    history: Optional[List[CostHistory]] = None
+    # expand=[variants.costs] puede venir como colección
+    items: Optional[List["Cost"]] = None
+
+
+class Variant(BsaleModel):
+    id: Optional[int] = None
+    state: Optional[int] = None
+    code: Optional[str] = None
+    barCode: Optional[str] = None
+    track: Any = None
+    product: Optional[Ref] = None
+    costs: Optional[Cost] = None
+
+
+class Product(BsaleModel):
+    id: Optional[int] = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+    state: Optional[int] = None
+    variants: Optional[Page[Variant]] = None
+
+
+class DocumentDetail(BsaleModel):
+    id: Optional[int] = None
+    variant: Optional[Ref] = None
+    quantity: Optional[float] = None
+    netUnitValue: Optional[float] = None
+    netTotal: Optional[float] = None
+    discount: Optional[float] = None
+
+
+class Document(BsaleModel):
+    id: Optional[int] = None
+    emissionDate: Optional[int] = None
+    number: Optional[int] = None
+    state: Optional[int] = None
+    netAmount: Optional[float] = None
+    taxAmount: Optional[float] = None
+    totalAmount: Optional[float] = None
+    client: Optional[Ref] = None
+    documentType: Optional[Ref] = None
+    details: Optional[Page[DocumentDetail]] = None
+
+
+class PriceListDetail(BsaleModel):
+    variant: Optional[Ref] = None
+    variantValue: Optional[float] = None
+
+
+class Stock(BsaleModel):
+    id: Optional[int] = None
+    variant: Optional[Ref] = None
+    office: Optional[Ref] = None
+    quantity: Optional[float] = None
+    quantityReserved: Optional[float] = None
+    quantityAvailable: Optional[float] = None
+
+
+# Endpoint (con ids reemplazados por {id}) -> tipo de la respuesta
+ENDPOINT_MODELS: Dict[str, Any] = {
+    "clients.json": Page[Client],
+    "clients/{id}.json": Client,
+    "products.json": Page[Product],
+    "products/{id}.json": Product,
+    "variants/{id}.json": Variant,
+    "variants/{id}/costs.json": Cost,
+    "documents.json": Page[Document],
+    "documents/{id}.json": Document,
+    "price_lists/{id}/details.json": Page[PriceListDetail],
+    "stocks.json": Page[Stock],
+}
+
+_NUMERIC_SEGMENT = re.compile(r"/\d+(?=/|\.json$)")
+
+
+@lru_cache(maxsize=None)
+def _decoder(endpoint_pattern: str) -> Optional[msgspec.json.Decoder]:
+    model = ENDPOINT_MODELS.get(endpoint_pattern)
+    return msgspec.json.Decoder(model) if model is not None else None
+
+
+def decode(endpoint: str, content: bytes) -> Optional[Any]:
+    """Decodifica con el modelo del endpoint; None si el endpoint no tiene modelo.
+
+    Lanza DecodeError si el JSON no calza con los tipos del modelo.
+    """
+    decoder = _decoder(_NUMERIC_SEGMENT.sub("/{id}", endpoint))
+    if decoder is None:
+        return None
+    return msgspec.to_builtins(decoder.decode(content))
@@ -0,0 +1,196 @@
+# app/services/etl_preview.py - VISTA PREVIA / DRY-RUN DEL ETL POR ENTIDAD
+"""
+Valida cambios del pipeline en segundos, sin escribir en el warehouse:
+
+- Muestra: pide páginas a Bsale solo hasta juntar N registros (la primera
+  página trae `count`, el total que traería una ejecución completa).
+- Validación: los mismos validadores/expansiones del registro de entidades
+  (etl_service.ENTITY_REGISTRY); los rechazos se cuentan pero no van a la
+  cuarentena.
+- SQL: genera los MERGE por lotes que ejecutaría la carga (literales STRUCT
+  de BigQuery) sin ejecutarlos; opcionalmente un dry-run estima los bytes.
+- Proyección: filas por registro de la muestra × `count` -> filas, lotes y
+  jobs de BigQuery (MERGE por lote o load + MERGE con tabla temporal).
+"""
+from typing import Any, Dict, List, Tuple
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import math
+import time
+
+from app.core.config import settings
+from app.db.bigquery_client import render_merge
+from app.services import etl_service, quarantine
+from app.services.bsale_client import bsale_client, count_requests
+
+# entidad del endpoint -> (entidad del registro, opciones de prepare)
+PREVIEW_ENTITIES: Dict[str, Tuple[str, Dict[str, Any]]] = {
+    "clients": ("clientes", {}),
+    "products": ("productos", {}),
+    "variants": ("productos", {"mode": "variants"}),
+    "documents": ("documentos", {}),
+}
+
+# Caracteres del primer MERGE de cada tabla incluidos en la respuesta
+SQL_PREVIEW_CHARS = 4000
+
+
+def _elapsed(started: float) -> float:
+    return round(time.perf_counter() - started, 3)
+
+
+def _sample_pages(endpoint: str, params: Dict, limit: int) -> Tuple[List[List[Dict]], int]:
+    """Páginas hasta juntar `limit` registros: (páginas, count total en Bsale)"""
+    pages, fetched, offset, total = [], 0, 0, None
+    while fetched < limit:
+        page_size = min(bsale_client.PAGE_LIMIT, limit - fetched)
+        response = bsale_client._request_page(endpoint, params, offset, page_size)
+        if total is None:
+            total = int(response.get("count") or 0)
+        items = (response.get("items") or [])[:limit - fetched]
+        if not items:
+            break
+        pages.append(items)
+        fetched += len(items)
+        offset += len(items)
+        if len(items) < page_size or (total and offset >= total):
+            break
+    return pages, max(total or 0, fetched)
+
+
+def _merge_jobs(rows: int) -> Dict[str, int]:
+    """Jobs de BigQuery para cargar `rows` filas (una tabla), por estrategia"""
+    chunk = max(1, settings.MEMORY_LOAD_CHUNK_ROWS)
+    full_chunks, rest = divmod(rows, chunk)
+    batched = full_chunks * math.ceil(chunk / etl_service.MERGE_BATCH_SIZE) + \
+        math.ceil(rest / etl_service.MERGE_BATCH_SIZE)
+    # Tabla temporal: un load job + un MERGE por tramo de MEMORY_LOAD_CHUNK_ROWS
+    staged = 2 * math.ceil(rows / chunk)
+    return {"batched": batched, "staged": staged}
+
+
+def _table_plan(db, table: str, merge_key: str, rows: List[Dict], sampled: int, total: int,
+                estimate_bytes: bool) -> Dict[str, Any]:
+    # Claves repetidas en las filas crudas: la carga las deduplica antes del MERGE (si no, fallaría)
+    repeated = sorted(key for key, count in Counter(row.get(merge_key) for row in rows).items() if count > 1)
+    unique = etl_service._dedupe_by_key(rows, merge_key)
+    update_columns = etl_service.MERGE_UPDATE_COLUMNS[table]
+    table_ref = f"{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.{table}"
+
+    started = time.perf_counter()
+    statements = [
+        render_merge(table_ref, table, unique[i:i + etl_service.MERGE_BATCH_SIZE], merge_key, update_columns)
+        for i in range(0, len(unique), etl_service.MERGE_BATCH_SIZE)
+    ]
+    sql_seconds = _elapsed(started)
+
+    projected_rows = math.ceil(len(unique) / sampled * total) if sampled else 0
+    jobs = _merge_jobs(projected_rows)
+    plan = {
+        "rows": len(rows),
+        "duplicates_dropped": len(rows) - len(unique),
+        "duplicate_keys": len(repeated),
+        "duplicate_key_sample": repeated[:20],
+        "merge_statements": len(statements),
+        "sql_chars": sum(len(sql) for sql in statements),
+        "sql_seconds": sql_seconds,
+        "first_merge_sql": statements[0][:SQL_PREVIEW_CHARS] if statements else None,
+        "projected_rows": projected_rows,
+        "projected_jobs": jobs,
+        "projected_strategy": "batched",
+    }
+
+    if estimate_bytes and statements:
+        try:
+            per_statement = db.estimate_merge_bytes(table, unique[:etl_service.MERGE_BATCH_SIZE], merge_key,
+                                                    update_columns)
+        except Exception as e:
+            logging.warning(f"⚠️ Dry-run de MERGE en {table} falló: {e}")
+            plan["estimate_error"] = str(e)
+            per_statement = None
+        if per_statement is not None:
+            batched_bytes = per_statement * jobs["batched"]
+            budget = settings.BIGQUERY_RUN_BYTES_BUDGET
+            # Misma regla que _merge_strategy: si los lotes exceden el presupuesto, tabla temporal
+            strategy = "staged" if budget and jobs["batched"] > 1 and batched_bytes > budget else "batched"
+            plan.update({
+                "bytes_per_merge": per_statement,
+                "projected_bytes": per_statement * math.ceil(projected_rows / settings.MEMORY_LOAD_CHUNK_ROWS)
+                if strategy == "staged" else batched_bytes,
+                "projected_strategy": strategy,
+            })
+    return plan
+
+
+def preview_entity(db, entity: str, limit: int = 10, start_date: str = None,
+                   estimate_bytes: bool = False) -> Dict[str, Any]:
+    """Descarga hasta `limit` registros, los valida y arma los MERGE sin ejecutar nada en el warehouse.
+
+    estimate_bytes=True hace un dry-run del primer MERGE por tabla (solo BigQuery, sin costo).
+    """
+    if entity not in PREVIEW_ENTITIES:
+        raise ValueError(f"Entidad no soportada: {entity} (usar {', '.join(PREVIEW_ENTITIES)})")
+    name, options = PREVIEW_ENTITIES[entity]
+    spec = etl_service.ENTITY_REGISTRY[name]
+    params = {**(spec.params or {}),
+              **(bsale_client._document_params(start_date) if name == "documentos" else {})}
+    timings: Dict[str, float] = {}
+
+    tables = [(spec.table, spec.merge_key)] + [(child.table, child.merge_key) for child in spec.children]
+    rows: Dict[str, List[Dict]] = {table: [] for table, _ in tables}
+    # Cuenta todas las peticiones a Bsale: páginas de la muestra y las de la validación
+    # (ej. precio y costo por variante), también desde los hilos de transformación
+    with count_requests() as requests_made:
+        started = time.perf_counter()
+        pages, total = _sample_pages(f"{spec.resource}.json", params, limit)
+        timings["fetch_seconds"] = _elapsed(started)
+        sampled = sum(len(page) for page in pages)
+
+        # Sin carga masiva: los productos no descargan el índice de precios completo
+        started = time.perf_counter()
+        context = spec.prepare(False, options) if spec.prepare else dict(options)
+        executor = ThreadPoolExecutor(max_workers=settings.ETL_TRANSFORM_WORKERS) \
+            if spec.concurrent and settings.ETL_TRANSFORM_WORKERS > 1 else None
+        try:
+            with quarantine.collect(f"vista_previa_{name}") as rejections:
+                for page in pages:
+                    for result in etl_service._transform_page(spec, page, context, executor):
+                        for table, table_rows in result.items():
+                            rows[table].extend(table_rows)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        timings["transform_seconds"] = _elapsed(started)
+
+    plans = {table: _table_plan(db, table, merge_key, rows[table], sampled, total, estimate_bytes)
+             for table, merge_key in tables}
+    timings["sql_seconds"] = round(sum(plan["sql_seconds"] for plan in plans.values()), 3)
+
+    # Páginas de una ejecución completa (las estables se solapan STABLE_PAGE_OVERLAP registros)
+    step = bsale_client.PAGE_LIMIT - (bsale_client.STABLE_PAGE_OVERLAP if spec.stable else 0)
+    full_pages = math.ceil(total / step) if total else 0
+    per_record = (timings["fetch_seconds"] + timings["transform_seconds"]) / sampled if sampled else 0
+    counts = {table: len(table_rows) for table, table_rows in rows.items()}
+    logging.info(f"🧪 Vista previa {entity}: {sampled}/{total} registros, filas {counts}, "
+                 f"{len(rejections.rows)} rechazos/advertencias en {sum(timings.values()):.2f}s")
+    return {
+        "entity": entity,
+        "registry_entity": name,
+        "dry_run": True,
+        "sample_records": sampled,
+        "source_total": total,
+        "api_requests": requests_made.total,
+        "api_requests_by_endpoint": dict(requests_made.by_endpoint),
+        "timings": timings,
+        "rejections": rejections.summary(),
+        "first_record": pages[0][0] if pages else None,
+        "tables": plans,
+        "projection": {
+            "api_pages": full_pages,
+            "merge_jobs_batched": sum(plan["projected_jobs"]["batched"] for plan in plans.values()),
+            "merge_jobs_staged": sum(plan["projected_jobs"]["staged"] for plan in plans.values()),
+            # Extrapolación lineal del tiempo por registro de la muestra (descarga + validación)
+            "estimated_seconds": round(per_record * total, 1),
+        },
+    }
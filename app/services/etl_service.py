@@ -1,7 +1,16 @@
 # app/services/etl_service.py - VERSIÓN CON INTEGRIDAD DE DATOS
 from app.services.bsale_client import bsale_client
-from typing import Any, List, Dict
+from app.services.sync_lock import with_entity_lock
+from app.services import quarantine, resume, sales_reports
+from app.core import memory_budget, profiling, shutdown
+from app.db.query_cost import QueryBudgetExceeded
+from typing import Any, Callable, Iterable, List, Dict, NamedTuple, Optional, Sequence
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import contextvars
+import requests
+import threading
+import time
 # Solo BigQuery - removido MySQL/SQLAlchemy
 from app.core.config import settings
 import logging
@@ -9,8 +18,26 @@ import re
 
 
 class DataValidationError(Exception):
-    """Error de validación de datos"""
-    pass
+    """Error de validación de datos. reasons: códigos de motivo para la cuarentena"""
+
+    def __init__(self, message: str, reasons: List[str] = None):
+        super().__init__(message)
+        self.reasons = reasons or []
+
+
+def _raise_if_errors(prefix: str, errors: List[tuple]):
+    """errors: lista de (codigo_motivo, mensaje)"""
+    if errors:
+        raise DataValidationError(
+            f"{prefix}: {'; '.join(message for _, message in errors)}",
+            reasons=[code for code, _ in errors],
+        )
+
+
+def _tombstone(record: Dict) -> Optional[int]:
+    """eliminado_en de un registro cargado: NULL si está activo en Bsale (revierte la marca de
+    la reconciliación) o ahora si está inactivo/anulado (lo mismo que marcaría la reconciliación)"""
+    return int(time.time()) if record.get("state") else None
 
 
 class ETLDataValidator:
@@ -23,26 +50,26 @@ class ETLDataValidator:
         
         # ID requerido
         if not client_data.get("id"):
-            errors.append("Cliente sin ID")
+            errors.append(("SIN_ID", "Cliente sin ID"))
         
         # Nombre requerido y no vacío
         first_name = client_data.get("firstName", "").strip()
         if not first_name or first_name.lower() in ["sin nombre", "null", "none", ""]:
-            errors.append(f"Cliente {client_data.get('id')}: nombre inválido '{first_name}'")
+            errors.append(("NOMBRE_INVALIDO", f"Cliente {client_data.get('id')}: nombre inválido '{first_name}'"))
         
                 # RUT es opcional, solo validar formato si existe
         rut = client_data.get("code", "").strip()
         if rut and rut.lower() not in ["null", "none", ""] and not ETLDataValidator._is_valid_rut(rut):
-            errors.append(f"Cliente {client_data.get('id')}: RUT inválido '{rut}'")
+            errors.append(("RUT_INVALIDO", f"Cliente {client_data.get('id')}: RUT inválido '{rut}'"))
         
         # Email OPCIONAL - solo validar formato si está presente  
         email = client_data.get("email", "").strip()
         if email and email.lower() not in ["", "null", "none"] and not ETLDataValidator._is_valid_email(email):
             # Solo warning, no error crítico
-            logging.warning(f"Cliente {client_data.get('id')}: email con formato no estándar '{email}' - se mantiene")
+            quarantine.warn("cliente", client_data.get('id'), "EMAIL_NO_ESTANDAR",
+                            f"email con formato no estándar '{email}' - se mantiene")
         
-        if errors:
-            raise DataValidationError(f"Cliente inválido: {'; '.join(errors)}")
+        _raise_if_errors("Cliente inválido", errors)
         
         return {
             "id_cliente": client_data.get("id"),
@@ -53,49 +80,57 @@ class ETLDataValidator:
             "telefono": (client_data.get("phone") or "").strip() or None,
             "direccion": (client_data.get("address") or "").strip() or None,
             "fecha_creacion": client_data.get("creationDate"),  # Keep as Unix timestamp
+            "eliminado_en": _tombstone(client_data),
         }
     
     @staticmethod
-    def validate_product(product_data: Dict, variant_data: Dict, price_data: float, cost_data: float) -> Dict:
-        """Valida datos de producto con reglas ESTRICTAS"""
+    def validate_product(product_data: Dict, variant_data: Dict, price_data: float, cost_data: float,
+                         allow_inactive: bool = False) -> Dict:
+        """Valida datos de producto con reglas ESTRICTAS.
+
+        allow_inactive=True acepta variantes inactivas (estado 0): las que se piden
+        explícitamente por id, ej. las referenciadas por detalles de documentos.
+        """
         errors = []
         
         # ID de variante requerido
         variant_id = variant_data.get("id")
         if not variant_id:
-            errors.append("Variante sin ID")
+            errors.append(("SIN_ID", "Variante sin ID"))
         
         # Nombre de producto requerido
         product_name = (product_data.get("name") or "").strip()
         if not product_name or product_name.lower() in ["sin nombre", "null", "none", ""]:
-            errors.append(f"Producto {product_data.get('id')}: nombre inválido '{product_name}'")
+            errors.append(("NOMBRE_INVALIDO", f"Producto {product_data.get('id')}: nombre inválido '{product_name}'"))
         
         # SKU requerido
         sku = (variant_data.get("code") or "").strip()
         if not sku or sku.lower() in ["null", "none", ""]:
-            errors.append(f"Variante {variant_id}: SKU faltante o inválido '{sku}'")
+            errors.append(("SKU_INVALIDO", f"Variante {variant_id}: SKU faltante o inválido '{sku}'"))
         
         # PRECIO OBLIGATORIO Y MAYOR A 0
         if price_data is None or price_data <= 0:
-            errors.append(f"Variante {variant_id} (SKU: {sku}): PRECIO INVÁLIDO {price_data} - debe ser > 0")
+            errors.append(("PRECIO_INVALIDO", f"Variante {variant_id} (SKU: {sku}): PRECIO INVÁLIDO {price_data} - debe ser > 0"))
         
         # COSTO OBLIGATORIO Y MAYOR O IGUAL A 0
         if cost_data is None or cost_data < 0:
-            errors.append(f"Variante {variant_id} (SKU: {sku}): COSTO INVÁLIDO {cost_data} - debe ser >= 0")
+            errors.append(("COSTO_INVALIDO", f"Variante {variant_id} (SKU: {sku}): COSTO INVÁLIDO {cost_data} - debe ser >= 0"))
         
         # Precio debe ser mayor al costo (margen positivo)
         if price_data and cost_data and price_data <= cost_data:
-            logging.warning(f"Variante {variant_id}: Precio {price_data} <= Costo {cost_data} (margen negativo)")
+            quarantine.warn("producto", variant_id, "MARGEN_NEGATIVO",
+                            f"Precio {price_data} <= Costo {cost_data} (margen negativo)")
         
         # Estado de variante debe ser activo
-        if variant_data.get("state") != 0:
-            errors.append(f"Variante {variant_id}: estado inactivo {variant_data.get('state')}")
+        active = variant_data.get("state") == 0
+        if not active and not allow_inactive:
+            errors.append(("VARIANTE_INACTIVA", f"Variante {variant_id}: estado inactivo {variant_data.get('state')}"))
         
-        if errors:
-            raise DataValidationError(f"Producto inválido: {'; '.join(errors)}")
+        _raise_if_errors("Producto inválido", errors)
         
         return {
             "id_producto": variant_id,
+            "id_producto_padre": product_data.get("id"),
             "nombre": product_name,
             "descripcion": (product_data.get("description") or "").strip() or None,
             "codigo_sku": sku,
@@ -103,7 +138,7 @@ class ETLDataValidator:
             "controla_stock": 1 if variant_data.get("track") else 0,
             "precio_neto": float(price_data),
             "costo_neto": float(cost_data),
-            "estado": 1,
+            "estado": 1 if active else 0,
         }
     
     @staticmethod
@@ -114,12 +149,12 @@ class ETLDataValidator:
         # ID requerido
         doc_id = document_data.get("id")
         if not doc_id:
-            errors.append("Documento sin ID")
+            errors.append(("SIN_ID", "Documento sin ID"))
         
         # Fecha de emisión requerida
         emission_date = document_data.get("emissionDate")
         if not emission_date:
-            errors.append(f"Documento {doc_id}: fecha de emisión faltante")
+            errors.append(("SIN_FECHA_EMISION", f"Documento {doc_id}: fecha de emisión faltante"))
         
         # Montos deben ser válidos
         net_amount = document_data.get("netAmount", 0)
@@ -127,21 +162,21 @@ class ETLDataValidator:
         total_amount = document_data.get("totalAmount", 0)
         
         if net_amount < 0:
-            errors.append(f"Documento {doc_id}: monto neto negativo {net_amount}")
+            errors.append(("MONTO_NEGATIVO", f"Documento {doc_id}: monto neto negativo {net_amount}"))
         
         if tax_amount < 0:
-            errors.append(f"Documento {doc_id}: monto IVA negativo {tax_amount}")
+            errors.append(("MONTO_NEGATIVO", f"Documento {doc_id}: monto IVA negativo {tax_amount}"))
         
         if total_amount <= 0:
-            errors.append(f"Documento {doc_id}: monto total inválido {total_amount}")
+            errors.append(("MONTO_TOTAL_INVALIDO", f"Documento {doc_id}: monto total inválido {total_amount}"))
         
         # Verificar coherencia de montos
         expected_total = net_amount + tax_amount
         if abs(total_amount - expected_total) > 0.01:  # Tolerancia de 1 centavo
-            logging.warning(f"Documento {doc_id}: inconsistencia en montos - Total: {total_amount}, Esperado: {expected_total}")
+            quarantine.warn("documento_venta", doc_id, "MONTOS_INCONSISTENTES",
+                            f"inconsistencia en montos - Total: {total_amount}, Esperado: {expected_total}")
         
-        if errors:
-            raise DataValidationError(f"Documento inválido: {'; '.join(errors)}")
+        _raise_if_errors("Documento inválido", errors)
         
         return {
             "id_documento": doc_id,
@@ -152,6 +187,7 @@ class ETLDataValidator:
             "monto_neto": float(net_amount),
             "monto_iva": float(tax_amount),
             "monto_total": float(total_amount),
+            "eliminado_en": _tombstone(document_data),
         }
     
     @staticmethod
@@ -162,22 +198,22 @@ class ETLDataValidator:
         # ID de detalle requerido
         detail_id = detail_data.get("id")
         if not detail_id:
-            errors.append(f"Detalle documento {doc_id}: ID de detalle faltante")
+            errors.append(("SIN_ID", f"Detalle documento {doc_id}: ID de detalle faltante"))
         
         # Producto/variante requerido
         variant_id = (detail_data.get("variant") or {}).get("id")
         if not variant_id:
-            errors.append(f"Detalle documento {doc_id}: producto/variante faltante")
+            errors.append(("SIN_VARIANTE", f"Detalle documento {doc_id}: producto/variante faltante"))
         
         # Cantidad debe ser válida
         quantity = detail_data.get("quantity", 0)
         if quantity <= 0:
-            errors.append(f"Detalle documento {doc_id}, producto {variant_id}: cantidad inválida {quantity}")
+            errors.append(("CANTIDAD_INVALIDA", f"Detalle documento {doc_id}, producto {variant_id}: cantidad inválida {quantity}"))
         
         # Precio unitario debe ser válido
         unit_price = detail_data.get("netUnitValue", 0)
         if unit_price <= 0:
-            errors.append(f"Detalle documento {doc_id}, producto {variant_id}: precio unitario inválido {unit_price}")
+            errors.append(("PRECIO_UNITARIO_INVALIDO", f"Detalle documento {doc_id}, producto {variant_id}: precio unitario inválido {unit_price}"))
         
         # Total de línea debe ser coherente
         line_total = detail_data.get("netTotal", 0)
@@ -185,10 +221,10 @@ class ETLDataValidator:
         
         expected_total = (quantity * unit_price) * (1 - discount / 100)
         if abs(line_total - expected_total) > 0.01:
-            logging.warning(f"Documento {doc_id}, producto {variant_id}: inconsistencia en total de línea")
+            quarantine.warn("detalle_documento", detail_id, "TOTAL_LINEA_INCONSISTENTE",
+                            f"Documento {doc_id}, producto {variant_id}: inconsistencia en total de línea")
         
-        if errors:
-            raise DataValidationError(f"Detalle documento inválido: {'; '.join(errors)}")
+        _raise_if_errors("Detalle documento inválido", errors)
         
         return {
             "id_detalle": detail_id,
@@ -222,67 +258,112 @@ class ETLDataValidator:
         return bool(re.match(r'^[^@]+@[^@]+\.[^@]+$', email))
 
 
-# Removido - Solo usamos BigQuery
-
-
 def _execute_bigquery_query(db, query: str, description: str = "Query"):
-    """Ejecuta una query en BigQuery de forma segura"""
+    """Ejecuta una query en el warehouse de forma segura"""
     try:
-        if hasattr(db, 'execute_query'):
-            result = db.execute_query(query)
-            logging.info(f"✅ {description} ejecutado exitosamente via execute_query")
-            return result
-        elif hasattr(db, 'query'):
-            result = db.query(query)
-            logging.info(f"✅ {description} ejecutado exitosamente via query")
-            return result
-        elif hasattr(db, '_client'):
-            job = db._client.query(query)
-            result = job.result()
-            logging.info(f"✅ {description} ejecutado exitosamente via _client")
-            return result
-        else:
-            logging.warning(f"⚠️ No se puede ejecutar MERGE, usando DELETE+INSERT para {description}")
-            return None
+        result = db.query(query)
+        logging.info(f"✅ {description} ejecutado exitosamente")
+        return result
     except Exception as e:
         logging.error(f"🔴 Error en {description}: {e}")
         raise
 
 
-def _bigquery_upsert_with_merge(db, table_name: str, rows: list, merge_key: str, description: str):
-    """UPSERT genérico usando MERGE para BigQuery - PROCESA EN LOTES"""
+def _dedupe_by_key(rows: list, key: str) -> list:
+    """Deja una fila por clave (la última vista), conservando el orden de primera aparición"""
+    unique = {}
+    for row in rows:
+        unique[row.get(key)] = row
+    return list(unique.values())
+
+
+# Filas por MERGE con STRUCT literales (evita queries demasiado grandes)
+MERGE_BATCH_SIZE = 50
+
+
+def _merge_strategy(db, table_name: str, rows: list, merge_key: str, batches: int) -> str:
+    """'batched' (un MERGE por lote) o 'staged' (tabla temporal + un MERGE) según el presupuesto de bytes.
+
+    Cada MERGE factura un escaneo completo de la tabla destino: se estima uno
+    por tabla y ejecución con dry-run y se proyecta por el número de lotes.
+    """
+    costs = db.costs
+    if not costs.has_estimate(table_name) and settings.BIGQUERY_COST_DRY_RUN:
+        try:
+            costs.set_statement_estimate(table_name, db.estimate_merge_bytes(
+                table_name, rows[:MERGE_BATCH_SIZE], merge_key, MERGE_UPDATE_COLUMNS[table_name]))
+        except Exception as e:
+            logging.warning(f"⚠️ Dry-run de MERGE en {table_name} falló, sin estimación de bytes: {e}")
+            costs.set_statement_estimate(table_name, None)
+    per_statement = costs.statement_estimate(table_name)
+    if per_statement is None:
+        costs.plan(table_name, "batched", 0)
+        return "batched"
+
+    strategy, projected = "batched", per_statement * batches
+    if batches > 1 and costs.would_exceed(projected):
+        strategy, projected = "staged", per_statement
+        logging.warning(f"💰 {batches} MERGE en {table_name} (~{per_statement * batches / 2**30:.2f} GiB) exceden el "
+                        f"presupuesto de la ejecución: se usa tabla temporal y un solo MERGE")
+    costs.plan(table_name, strategy, projected)
+
+    if costs.would_exceed(projected):
+        costs.exceeded = True
+        message = (f"Presupuesto de BigQuery excedido: {table_name} proyecta {projected} bytes, "
+                   f"facturados {costs.billed_bytes} de {costs.budget_bytes}")
+        if settings.BIGQUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logging.error(f"🔴 {message}")
+    return strategy
+
+
+def _bigquery_upsert_with_merge(db, table_name: str, rows: list, merge_key: str, description: str,
+                                staged: bool = False):
+    """UPSERT genérico usando MERGE (db.upsert_rows) - PROCESA EN LOTES
+
+    staged=True fuerza el camino rápido (tabla temporal + un solo MERGE), ej. al apagarse.
+    """
     if not rows:
         logging.info(f"ℹ️ No hay datos válidos para {description}")
         return
+    if table_name not in MERGE_UPDATE_COLUMNS:
+        raise ValueError(f"Tabla no soportada para MERGE: {table_name}")
+
+    # Claves repetidas en la misma ejecución hacen fallar el MERGE ("must match at
+    # most one source row"); deduplicar antes de armar lotes mantiene el camino rápido.
+    unique_rows = _dedupe_by_key(rows, merge_key)
+    if len(unique_rows) != len(rows):
+        logging.info(f"🧹 {len(rows) - len(unique_rows)} filas con {merge_key} repetido descartadas en {table_name}")
+    rows = unique_rows
         
-    logging.info(f"🔄 Ejecutando UPSERT de {len(rows)} registros válidos en {table_name}...")
+    logging.info(f"🔄 Ejecutando UPSERT de {len(rows)} registros válidos en {table_name} ({db.backend})...")
     
     # Procesar en lotes de 50 para evitar queries demasiado grandes
-    BATCH_SIZE = 50
+    total_batches = (len(rows) + MERGE_BATCH_SIZE - 1) // MERGE_BATCH_SIZE
+    if staged or _merge_strategy(db, table_name, rows, merge_key, total_batches) == "staged":
+        try:
+            db.upsert_staged(table_name, rows, merge_key, MERGE_UPDATE_COLUMNS[table_name])
+            logging.info(f"✅ UPSERT completado: {len(rows)} registros procesados en {table_name} (un solo MERGE)")
+            return
+        except Exception as e:
+            logging.warning(f"⚠️ MERGE por tabla temporal falló para {table_name}, usando lotes: {e}")
+
     total_processed = 0
     
-    for i in range(0, len(rows), BATCH_SIZE):
-        batch = rows[i:i+BATCH_SIZE]
-        batch_num = (i // BATCH_SIZE) + 1
-        total_batches = (len(rows) + BATCH_SIZE - 1) // BATCH_SIZE
+    for i in range(0, len(rows), MERGE_BATCH_SIZE):
+        if shutdown.requested() and total_processed:
+            # Apagado en curso: el resto en un solo MERGE para terminar dentro del plazo de gracia
+            db.upsert_staged(table_name, rows[i:], merge_key, MERGE_UPDATE_COLUMNS[table_name])
+            logging.info(f"✅ UPSERT completado por apagado: {len(rows)} registros en {table_name} (resto en un solo MERGE)")
+            return
+        batch = rows[i:i+MERGE_BATCH_SIZE]
+        batch_num = (i // MERGE_BATCH_SIZE) + 1
         
         logging.info(f"📦 Procesando lote {batch_num}/{total_batches} ({len(batch)} registros)...")
         
-        # Construir MERGE query según la tabla
-        if table_name == "cliente":
-            merge_query = _build_cliente_merge(batch)
-        elif table_name == "producto":
-            merge_query = _build_producto_merge(batch)
-        elif table_name == "documento_venta":
-            merge_query = _build_documento_merge(batch)
-        elif table_name == "detalle_documento":
-            merge_query = _build_detalle_merge(batch)
-        else:
-            raise ValueError(f"Tabla no soportada para MERGE: {table_name}")
-        
         # Intentar MERGE, si falla usar DELETE+INSERT
         try:
-            _execute_bigquery_query(db, merge_query, f"MERGE {table_name} lote {batch_num}")
+            db.upsert_rows(table_name, batch, merge_key, MERGE_UPDATE_COLUMNS[table_name])
             total_processed += len(batch)
             logging.info(f"✅ Lote {batch_num} completado ({total_processed}/{len(rows)} total)")
         except Exception as e:
@@ -297,6 +378,12 @@ def _bigquery_delete_and_insert(db, table_name: str, rows: list, key_field: str,
     """Fallback: DELETE + INSERT para BigQuery cuando MERGE no funciona"""
     if not rows:
         return
+    if db.defers_inserts(table_name):
+        # Storage Write: el INSERT recién sería visible al commit y el DELETE es inmediato
+        # (un rollback perdería las filas); se hace MERGE desde tabla temporal
+        logging.warning(f"⚠️ {table_name} usa Storage Write: {description} por tabla temporal + MERGE en vez de DELETE+INSERT")
+        db.upsert_staged(table_name, rows, key_field, MERGE_UPDATE_COLUMNS[table_name])
+        return
         
     # Obtener IDs a eliminar
     ids_to_delete = []
@@ -325,418 +412,575 @@ def _bigquery_delete_and_insert(db, table_name: str, rows: list, key_field: str,
         raise
 
 
-def _build_cliente_merge(rows):
-    """Construye query MERGE para clientes"""
-    values_list = []
-    for row in rows:
-        nombre = str(row.get('nombre', '')).replace('"', '\\"')
-        apellido = str(row.get('apellido', '') or '').replace('"', '\\"')
-        direccion = str(row.get('direccion', '') or '').replace('"', '\\"')
-        
-        fecha_creacion = 'NULL'
-        if row.get('fecha_creacion'):
-            fecha_creacion = f"TIMESTAMP_SECONDS({int(row['fecha_creacion'])})"
-        
-        values_list.append(f"""STRUCT(
-            {row.get('id_cliente')} AS id_cliente,
-            "{nombre}" AS nombre,
-            "{apellido}" AS apellido,
-            "{row.get('rut', '') or ''}" AS rut,
-            "{row.get('email', '') or ''}" AS email,
-            "{row.get('telefono', '') or ''}" AS telefono,
-            "{direccion}" AS direccion,
-            {fecha_creacion} AS fecha_creacion
-        )""")
+def _resolve_net_cost(cost_detail, net_price, label: str, record_id=None):
+    """Aplica la regla de costo: averageCost si hay historial > 0, si no precio × 0.65.
+
+    record_id: id de la variante (id_producto) con que se registra la advertencia de costo estimado.
+    """
+    net_cost = cost_detail.get("averageCost") if cost_detail else None
+    cost_history = cost_detail.get("history", []) if cost_detail else []
+    
+    # Verificar si hay algún costo histórico > 0
+    has_valid_cost_history = any(
+        (hist.get("cost") or 0) > 0 for hist in cost_history
+    )
     
-    return f"""
-    MERGE `{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.cliente` AS target
-    USING (
-        SELECT * FROM UNNEST([
-            {','.join(values_list)}
-        ])
-    ) AS source
-    ON target.id_cliente = source.id_cliente
-    WHEN MATCHED THEN 
-        UPDATE SET 
-            nombre = source.nombre,
-            apellido = source.apellido,
-            rut = source.rut,
-            email = source.email,
-            telefono = source.telefono,
-            direccion = source.direccion
-    WHEN NOT MATCHED THEN
-        INSERT (id_cliente, nombre, apellido, rut, email, telefono, direccion, fecha_creacion)
-        VALUES (source.id_cliente, source.nombre, source.apellido, source.rut, 
-                source.email, source.telefono, source.direccion, source.fecha_creacion)
+    if not has_valid_cost_history:  # Sin historial O todos los costos son 0
+        if net_price and net_price > 0:
+            net_cost = net_price * 0.65
+            quarantine.warn("producto", record_id, "COSTO_ESTIMADO",
+                            f"{label}: Sin costos históricos válidos, calculado desde precio: {net_cost}")
+        else:
+            net_cost = None  # Will fail validation below
+    # Si hay historial con costos > 0, usar averageCost
+    return net_cost
+
+
+def _build_price_index(price_list_id: int = 2) -> Dict[int, float]:
+    """Descarga la lista de precios completa en páginas y la indexa por variante"""
+    details = bsale_client._get_all_pages(f"price_lists/{price_list_id}/details.json")
+    price_index = {}
+    for detail in details:
+        variant_id = (detail.get("variant") or {}).get("id")
+        if variant_id is None:
+            continue
+        price_index[int(variant_id)] = detail.get("variantValue")
+    logging.info(f"💲 Índice de precios lista {price_list_id}: {len(price_index)} variantes")
+    return price_index
+
+
+# Listado paginado de costos de todas las variantes (mismo formato que variants/{id}/costs.json + 'variant')
+COST_LISTING_ENDPOINT = "variants/costs.json"
+
+
+def _build_cost_index() -> Dict[int, Dict]:
+    """Descarga el listado de costos en páginas y lo indexa por variante (vacío si Bsale no lo entrega)"""
+    cost_index = {}
+    for detail in bsale_client._get_all_pages(COST_LISTING_ENDPOINT):
+        variant_id = (detail.get("variant") or {}).get("id")
+        if variant_id is None:
+            continue
+        cost_index[int(variant_id)] = detail
+    logging.info(f"💲 Índice de costos: {len(cost_index)} variantes")
+    return cost_index
+
+
+class _LazyCostIndex:
+    """Índice masivo de costos, descargado recién cuando falta el primer costo expandido"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index: Optional[Dict[int, Dict]] = None
+
+    def get(self, variant_id) -> Optional[Dict]:
+        # Las expansiones concurrentes (ETL_TRANSFORM_WORKERS) comparten una sola descarga
+        with self._lock:
+            if self._index is None:
+                self._index = _build_cost_index()
+        return self._index.get(int(variant_id)) if variant_id else None
+
+
+def _embedded_cost_detail(variant: Dict):
+    """Extrae el costo expandido (expand=[variants.costs]) de la variante, si vino en el payload"""
+    costs = variant.get("costs")
+    if not isinstance(costs, dict):
+        return None
+    if "averageCost" in costs or "history" in costs:
+        return costs
+    items = costs.get("items")
+    if items:
+        return items[0]
+    return None
+
+
+
+
+# --- Registro declarativo de entidades ---------------------------------------
+#
+# Cada entidad declara de dónde se extrae (recurso de Bsale + parámetros), cómo
+# se valida o expande cada registro, en qué tabla se carga y con qué clave y
+# columnas se hace el MERGE. Un único pipeline (run_entity_pipeline) ejecuta
+# extracción paginada adaptativa, validación (opcionalmente concurrente),
+# acumulación en SpillBuffer y carga MERGE por lotes para todas las entidades.
+
+class ChildSpec(NamedTuple):
+    """Tabla hija cuyas filas vienen anidadas en el registro padre (ej. detalles de documento)"""
+    table: str
+    merge_key: str
+    update_columns: Sequence[str]
+    items: Callable[[Dict], List[Dict]]       # registro padre -> registros hijos crudos
+    validator: Callable[[Dict, Any], Dict]    # (hijo, id_padre) -> fila
+
+
+class EntitySpec(NamedTuple):
+    name: str                                 # entidad: lock, cuarentena, etapa y logs
+    resource: str                             # recurso Bsale: '<resource>.json' y '<resource>/<id>.json'
+    table: str
+    merge_key: str
+    update_columns: Sequence[str]
+    validator: Optional[Callable[[Dict], Dict]] = None          # registro -> fila
+    expand: Optional[Callable[[Dict, Dict], List[Dict]]] = None  # (registro, contexto) -> filas; reemplaza validator
+    prepare: Optional[Callable[[bool, Dict], Dict]] = None       # (carga_masiva, opciones) -> contexto
+    params: Optional[Dict] = None             # parámetros fijos de la API (expand)
+    stable: bool = False                      # paginación estable (listados que cambian durante la descarga)
+    concurrent: bool = False                  # validar/expandir registros en paralelo (expand con llamadas HTTP)
+    children: Sequence[ChildSpec] = ()
+    empty_error: Optional[str] = None         # si no queda ninguna fila válida: excepción con este mensaje
+    after_load: Optional[Callable] = None     # (db, buffers) tras cargar, con los SpillBuffer aún abiertos
+
+    @property
+    def schema(self):
+        from app.db.warehouse import TABLE_SCHEMAS
+        return TABLE_SCHEMAS[self.table]
+
+
+def _product_context(bulk: bool, options: Dict) -> Dict:
+    """Modo de variantes y, en carga masiva del modo 'variants', los índices de precios y costos.
+
+    options["variant_ids"] limita la expansión a esas variantes (activas o no).
     """
+    mode = options.get("mode") or settings.PRODUCT_SYNC_MODE
+    bulk_variants = bulk and mode == "variants"
+    variant_ids = options.get("variant_ids")
+    return {"mode": mode, "price_index": _build_price_index() if bulk_variants else None,
+            "cost_index": _LazyCostIndex() if bulk_variants else None,
+            "variant_ids": {int(v) for v in variant_ids} if variant_ids is not None else None}
 
 
-def _build_producto_merge(rows):
-    """Construye query MERGE para productos"""
-    values_list = []
-    for row in rows:
-        nombre = str(row.get('nombre', '')).replace('"', '\\"')
-        descripcion = str(row.get('descripcion', '') or '').replace('"', '\\"')
-        
-        values_list.append(f"""STRUCT(
-            {row.get('id_producto')} AS id_producto,
-            "{nombre}" AS nombre,
-            "{descripcion}" AS descripcion,
-            "{row.get('codigo_sku', '')}" AS codigo_sku,
-            "{row.get('codigo_barras', '') or ''}" AS codigo_barras,
-            {int(row.get('controla_stock', 0))} AS controla_stock,
-            {float(row.get('precio_neto'))} AS precio_neto,
-            {float(row.get('costo_neto'))} AS costo_neto,
-            {int(row.get('estado', 1))} AS estado
-        )""")
-    
-    return f"""
-    MERGE `{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.producto` AS target
-    USING (
-        SELECT * FROM UNNEST([
-            {','.join(values_list)}
-        ])
-    ) AS source
-    ON target.id_producto = source.id_producto
-    WHEN MATCHED THEN 
-        UPDATE SET 
-            nombre = source.nombre,
-            descripcion = source.descripcion,
-            codigo_sku = source.codigo_sku,
-            codigo_barras = source.codigo_barras,
-            controla_stock = source.controla_stock,
-            precio_neto = source.precio_neto,
-            costo_neto = source.costo_neto,
-            estado = source.estado
-    WHEN NOT MATCHED THEN
-        INSERT (id_producto, nombre, descripcion, codigo_sku, codigo_barras, 
-                controla_stock, precio_neto, costo_neto, estado)
-        VALUES (source.id_producto, source.nombre, source.descripcion, source.codigo_sku,
-                source.codigo_barras, source.controla_stock, source.precio_neto,
-                source.costo_neto, source.estado)
+def _expand_product(product: Dict, context: Dict) -> List[Dict]:
+    """Filas de producto: primera variante activa o todas según el modo.
+
+    El precio sale del índice masivo si existe (una petición por página de la
+    lista) o de price_lists/2/details.json por variante; el costo del payload
+    expandido, del listado masivo de costos (modo 'variants') o, si falta, de
+    variants/{id}/costs.json.
     """
+    rejections = quarantine.current()
+    variants = (product.get("variants") or {}).get("items", [])
+    if not variants:
+        rejections.reject("producto", product.get('id'), "Producto sin variantes", product, code="SIN_VARIANTES")
+        return []
+
+    variant_ids = context.get("variant_ids")
+    if variant_ids is not None:
+        # Variantes pedidas por id (webhooks, integridad): aunque no sean la primera ni estén activas
+        active = [variant for variant in variants if variant.get("id") in variant_ids]
+    else:
+        active = [variant for variant in variants if variant.get("state") == 0]
+        if context["mode"] != "variants":
+            # Procesar solo la primera variante activa
+            active = active[:1]
+
+    price_index = context.get("price_index")
+    rows = []
+    for variant in active:
+        variant_id = variant.get("id")
+        try:
+            if price_index is not None:
+                net_price = price_index.get(int(variant_id)) if variant_id else None
+            else:
+                price_detail = bsale_client.fetch("price_lists/2/details.json", params={"variantid": variant_id})
+                price_items = price_detail.get("items", []) if price_detail else []
+                net_price = price_items[0].get("variantValue") if price_items else None
+            if net_price is None:
+                rejections.reject("producto", variant_id, f"Producto {product.get('name')}: SIN PRECIO en lista 2", variant, code="SIN_PRECIO_LISTA")
+                continue
 
+            cost_detail = _embedded_cost_detail(variant)
+            if cost_detail is None and context.get("cost_index") is not None:
+                cost_detail = context["cost_index"].get(variant_id)
+            if cost_detail is None:
+                cost_detail = bsale_client.fetch(f"variants/{variant_id}/costs.json")
+            net_cost = _resolve_net_cost(cost_detail, net_price, f"Producto {product.get('name')} (variante {variant_id})",
+                                         variant_id)
+
+            # VALIDACIÓN ESTRICTA: precio y costo obligatorios
+            rows.append(ETLDataValidator.validate_product(product, variant, net_price, net_cost,
+                                                          allow_inactive=variant_ids is not None))
+        except Exception as e:
+            rejections.reject("producto", variant_id, e, variant)
+    return rows
 
-def _build_documento_merge(rows):
-    """Construye query MERGE para documentos"""
-    values_list = []
-    for row in rows:
-        fecha_emision = 'NULL'
-        if row.get('fecha_emision'):
-            fecha_emision = f"TIMESTAMP_SECONDS({int(row['fecha_emision'])})"
-        
-        # Manejar valores NULL correctamente
-        id_cliente = row.get('id_cliente')
-        id_tipo_documento = row.get('id_tipo_documento')
-        folio = row.get('folio')
-        
-        values_list.append(f"""STRUCT(
-            {row.get('id_documento')} AS id_documento,
-            {id_cliente if id_cliente is not None else 'NULL'} AS id_cliente,
-            {id_tipo_documento if id_tipo_documento is not None else 'NULL'} AS id_tipo_documento,
-            {folio if folio is not None else 'NULL'} AS folio,
-            {fecha_emision} AS fecha_emision,
-            {float(row.get('monto_neto', 0.0))} AS monto_neto,
-            {float(row.get('monto_iva', 0.0))} AS monto_iva,
-            {float(row.get('monto_total', 0.0))} AS monto_total
-        )""")
-    
-    return f"""
-    MERGE `{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.documento_venta` AS target
-    USING (
-        SELECT * FROM UNNEST([
-            {','.join(values_list)}
-        ])
-    ) AS source
-    ON target.id_documento = source.id_documento
-    WHEN MATCHED THEN 
-        UPDATE SET 
-            id_cliente = source.id_cliente,
-            monto_neto = source.monto_neto,
-            monto_iva = source.monto_iva,
-            monto_total = source.monto_total
-    WHEN NOT MATCHED THEN
-        INSERT (id_documento, id_cliente, id_tipo_documento, folio, fecha_emision,
-                monto_neto, monto_iva, monto_total)
-        VALUES (source.id_documento, source.id_cliente, source.id_tipo_documento, 
-                source.folio, source.fecha_emision, source.monto_neto,
-                source.monto_iva, source.monto_total)
-    """
 
+def _after_products_load(db, buffers: Dict[str, Any]):
+    """Versiona en producto_historial los precios y costos que cambiaron"""
+    if not settings.PRICE_HISTORY_ENABLED:
+        return
+    from app.services.price_history import record_price_history
 
-def _build_detalle_merge(rows):
-    """Construye query MERGE para detalles de documentos"""
-    values_list = []
-    for row in rows:
-        values_list.append(f"""STRUCT(
-            {row.get('id_detalle')} AS id_detalle,
-            {row.get('id_documento')} AS id_documento,
-            {row.get('id_producto')} AS id_producto,
-            {float(row.get('cantidad', 0.0))} AS cantidad,
-            {float(row.get('precio_neto_unitario', 0.0))} AS precio_neto_unitario,
-            {float(row.get('descuento_porcentual', 0.0))} AS descuento_porcentual,
-            {float(row.get('monto_total_linea', 0.0))} AS monto_total_linea
-        )""")
-    
-    return f"""
-    MERGE `{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.detalle_documento` AS target
-    USING (
-        SELECT * FROM UNNEST([
-            {','.join(values_list)}
-        ])
-    ) AS source
-    ON target.id_detalle = source.id_detalle
-    WHEN MATCHED THEN 
-        UPDATE SET 
-            id_documento = source.id_documento,
-            id_producto = source.id_producto,
-            cantidad = source.cantidad,
-            precio_neto_unitario = source.precio_neto_unitario,
-            descuento_porcentual = source.descuento_porcentual,
-            monto_total_linea = source.monto_total_linea
-    WHEN NOT MATCHED THEN
-        INSERT (id_detalle, id_documento, id_producto, cantidad, precio_neto_unitario,
-                descuento_porcentual, monto_total_linea)
-        VALUES (source.id_detalle, source.id_documento, source.id_producto, source.cantidad,
-                source.precio_neto_unitario, source.descuento_porcentual,
-                source.monto_total_linea)
-    """
+    try:
+        buffer = buffers["producto"]
+        product_ids = None
+        if len(buffer) <= settings.PRICE_HISTORY_MAX_FILTER_IDS:
+            # Cargas acotadas (webhooks): comparar solo las variantes cargadas
+            product_ids = [row["id_producto"] for batch in buffer.iter_batches(settings.MEMORY_LOAD_CHUNK_ROWS)
+                           for row in batch]
+        db.commit()
+        record_price_history(db, product_ids)
+    except Exception as e:
+        # La próxima carga vuelve a comparar contra las versiones vigentes; no fallar la carga
+        logging.error(f"🔴 Error actualizando el historial de precios: {e}")
 
 
-def sync_clients(db):
-    """Sincronización de clientes con VALIDACIÓN ESTRICTA"""
-    logging.info("👥 Iniciando sincronización de Clientes con validación estricta...")
-    
-    # Ensure tables exist before syncing
-    db.ensure_all_tables()
-    
+def _after_documents_load(db, buffers: Dict[str, Any]):
+    """Agregados incrementales e integridad referencial para las fechas de emisión cargadas"""
+    if not (settings.SALES_AGGREGATES_ENABLED or settings.INTEGRITY_CHECK_ENABLED):
+        return
+    from app.services.sales_aggregates import refresh_sales_aggregates, touched_dates
+
     try:
-        clients_list = bsale_client.get_clients()
-        if not clients_list:
-            logging.info("⚠️ No se encontraron clientes en Bsale.")
-            return
+        dates = set()
+        for batch in buffers["documento_venta"].iter_batches(settings.MEMORY_LOAD_CHUNK_ROWS):
+            dates |= touched_dates(db, batch)
+        # Primero confirmar lo cargado para que sea visible
+        db.commit()
+    except Exception as e:
+        logging.error(f"🔴 Error confirmando documentos antes de agregados e integridad: {e}")
+        return
 
-        logging.info(f"📋 Obtenidos {len(clients_list)} clientes de Bsale. Validando...")
-        
-        # Validar cada cliente
-        valid_clients = []
-        invalid_count = 0
-        
-        for client in clients_list:
+    if settings.SALES_AGGREGATES_ENABLED:
+        try:
+            refresh_sales_aggregates(db, dates)
+        except Exception as e:
+            # Los agregados se recalculan en la próxima ejecución; no fallar la carga
+            logging.error(f"🔴 Error actualizando agregados de ventas: {e}")
+
+    if settings.INTEGRITY_CHECK_ENABLED:
+        from app.services.integrity import check_referential_integrity
+        try:
+            check_referential_integrity(db, dates)
+        except Exception as e:
+            logging.error(f"🔴 Error en chequeo de integridad referencial: {e}")
+
+
+ENTITY_REGISTRY: Dict[str, EntitySpec] = {
+    "clientes": EntitySpec(
+        name="clientes",
+        resource="clients",
+        table="cliente",
+        merge_key="id_cliente",
+        update_columns=["nombre", "apellido", "rut", "email", "telefono", "direccion", "eliminado_en"],
+        validator=ETLDataValidator.validate_client,
+    ),
+    "productos": EntitySpec(
+        name="productos",
+        resource="products",
+        table="producto",
+        merge_key="id_producto",
+        update_columns=["id_producto_padre", "nombre", "descripcion", "codigo_sku", "codigo_barras",
+                        "controla_stock", "precio_neto", "costo_neto", "estado"],
+        expand=_expand_product,
+        prepare=_product_context,
+        params={'expand': '[variants.costs]'},
+        concurrent=True,
+        empty_error="No hay productos válidos - revisar precios y costos en Bsale",
+        after_load=_after_products_load,
+    ),
+    "documentos": EntitySpec(
+        name="documentos",
+        resource="documents",
+        table="documento_venta",
+        merge_key="id_documento",
+        update_columns=["id_cliente", "monto_neto", "monto_iva", "monto_total", "eliminado_en"],
+        validator=ETLDataValidator.validate_document,
+        params={'expand': 'details'},
+        stable=True,
+        children=[
+            ChildSpec(
+                table="detalle_documento",
+                merge_key="id_detalle",
+                update_columns=["id_documento", "id_producto", "cantidad", "precio_neto_unitario",
+                                "descuento_porcentual", "monto_total_linea"],
+                items=lambda doc: doc.get("details", {}).get("items", []),
+                validator=ETLDataValidator.validate_document_detail,
+            ),
+        ],
+        after_load=_after_documents_load,
+    ),
+}
+
+# Columnas que un MERGE actualiza cuando la clave ya existe (el resto solo se inserta)
+MERGE_UPDATE_COLUMNS = {
+    table: list(columns)
+    for spec in ENTITY_REGISTRY.values()
+    for table, columns in [(spec.table, spec.update_columns)] + [(c.table, c.update_columns) for c in spec.children]
+}
+
+
+def _transform_record(spec: EntitySpec, record: Dict, context: Dict) -> Dict[str, List[Dict]]:
+    """Filas válidas por tabla para un registro crudo; los rechazos van a la cuarentena"""
+    rejections = quarantine.current()
+    if spec.expand is not None:
+        return {spec.table: spec.expand(record, context)}
+    try:
+        row = spec.validator(record)
+    except DataValidationError as e:
+        rejections.reject(spec.table, record.get("id"), e, record)
+        return {}
+
+    rows = {spec.table: [row]}
+    # BigQuery: mantener FK tal como viene (NULL si no existe)
+    for child in spec.children:
+        child_rows = rows.setdefault(child.table, [])
+        for item in child.items(record):
             try:
-                validated_client = ETLDataValidator.validate_client(client)
-                valid_clients.append(validated_client)
+                child_rows.append(child.validator(item, record.get("id")))
             except DataValidationError as e:
-                invalid_count += 1
-                logging.warning(f"⚠️ Cliente inválido omitido: {e}")
-        
-        logging.info(f"✅ Validación completada: {len(valid_clients)} válidos, {invalid_count} omitidos")
-        
-        if not valid_clients:
-            logging.warning("⚠️ No hay clientes válidos para cargar.")
-            return []
-
-        # Cargar clientes válidos a BigQuery
-        _bigquery_upsert_with_merge(db, "cliente", valid_clients, "id_cliente", "clientes")
-        logging.info(f"✅ Sincronización de Clientes finalizada (BigQuery). {len(valid_clients)} registros válidos procesados.")
-        
-        return valid_clients
-        
-    except Exception as e:
-        logging.error(f"🔴 ERROR CRÍTICO en sync_clients: {e}")
-        raise
+                rejections.reject(child.table, item.get("id"), e, item)
+    return rows
+
+
+def _transform_page(spec: EntitySpec, page: List[Dict], context: Dict, executor) -> List[Dict[str, List[Dict]]]:
+    if executor is None:
+        return [_transform_record(spec, record, context) for record in page]
+    # Cada tarea corre en una copia del contexto para ver el colector de cuarentena activo
+    futures = [
+        executor.submit(contextvars.copy_context().run, _transform_record, spec, record, context)
+        for record in page
+    ]
+    return [future.result() for future in futures]
+
+
+def _load_buffers(db, spec: EntitySpec, buffers: Dict[str, Any], description: str, staged: bool = False):
+    for table, merge_key in [(spec.table, spec.merge_key)] + [(c.table, c.merge_key) for c in spec.children]:
+        for batch in buffers[table].iter_batches(settings.MEMORY_LOAD_CHUNK_ROWS):
+            _bigquery_upsert_with_merge(db, table, batch, merge_key, description, staged=staged)
+
+
+def _run_records(db, spec: EntitySpec, pages: Iterable[List[Dict]], context: Dict,
+                 description: str) -> Optional[Dict[str, int]]:
+    """Valida páginas de registros, acumula filas en SpillBuffer y las carga por MERGE en lotes"""
+    tables = [spec.table] + [child.table for child in spec.children]
+    buffers = {table: memory_budget.SpillBuffer(table) for table in tables}
+    executor = ThreadPoolExecutor(max_workers=settings.ETL_TRANSFORM_WORKERS) \
+        if spec.concurrent and settings.ETL_TRANSFORM_WORKERS > 1 else None
+    try:
+        fetched = 0
+        interrupted = False
+        pages = iter(pages)
+        while True:
+            try:
+                page = next(pages)
+            except StopIteration:
+                break
+            except requests.exceptions.RequestException as e:
+                # Si la descarga falla no se carga nada parcial; errores de validación o
+                # de buffers se propagan (no son "sin registros")
+                logging.error(f"🔴 Error descargando {spec.name} de Bsale: {e}")
+                fetched = 0
+                break
+            if shutdown.requested():
+                # No pedir más páginas: cargar lo validado y dejar marcador de reanudación
+                interrupted = True
+                break
+            fetched += len(page)
+            for result in _transform_page(spec, page, context, executor):
+                for table, rows in result.items():
+                    for row in rows:
+                        buffers[table].append(row)
+
+        if interrupted:
+            logging.warning(f"🛑 {spec.name}: apagado en curso, cargando {fetched} registros validados en un solo MERGE por tabla")
+            _load_buffers(db, spec, buffers, description, staged=True)
+            sales_reports.invalidate(tables)
+            raise shutdown.ShutdownRequested(f"{spec.name} interrumpido tras {fetched} registros", processed=fetched)
+
+        if not fetched:
+            logging.info(f"⚠️ No se encontraron {spec.name} en Bsale.")
+            return None
 
+        counts = {table: len(buffers[table]) for table in tables}
+        logging.info(f"✅ Validación completada: {fetched} {spec.name} obtenidos de Bsale, filas válidas {counts}")
+
+        if not counts[spec.table]:
+            if spec.empty_error:
+                logging.error(f"🔴 CRÍTICO: No hay {spec.name} válidos para cargar.")
+                raise Exception(spec.empty_error)
+            logging.warning(f"⚠️ No hay {spec.name} válidos para cargar.")
+            return counts
+
+        _load_buffers(db, spec, buffers, description)
+        if spec.after_load is not None:
+            spec.after_load(db, buffers)
+        # Los reportes cacheados que leen estas tablas dejan de ser válidos
+        sales_reports.invalidate(tables)
+        return counts
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        for buffer in buffers.values():
+            buffer.close()
+
+
+def _same_request(saved: Dict, requested: Dict) -> bool:
+    """Mismos parámetros de API, salvo el fin del rango de emisión (se fija en 'ahora' en cada ejecución)"""
+    def normalized(params: Dict) -> Dict:
+        params = dict(params or {})
+        if "emissiondaterange" in params:
+            params["emissiondaterange"] = str(params["emissiondaterange"]).strip("[]").split(",")[0]
+        return {key: str(value) for key, value in params.items()}
+    return normalized(saved) == normalized(requested)
+
+
+def run_entity_pipeline(db, spec: EntitySpec, params: Dict = None, options: Dict = None,
+                        page_workers: int = 1) -> Optional[Dict[str, int]]:
+    """Extracción paginada completa -> validación -> MERGE por lotes para una entidad del registro.
+
+    params: parámetros adicionales de la API (ej. rango de fechas); options: para spec.prepare.
+    page_workers > 1: páginas pedidas en paralelo (sin tamaño adaptativo a la memoria).
+    Devuelve filas cargadas por tabla, o None si Bsale no devolvió registros.
+    """
+    logging.info(f"🔄 Iniciando sincronización de {spec.name} con validación estricta...")
 
-def sync_products(db):
-    """Sincronización de productos con VALIDACIÓN ESTRICTA DE PRECIOS Y COSTOS"""
-    logging.info("📦 Iniciando sincronización de Productos con validación estricta...")
-    
     # Ensure tables exist before syncing
     db.ensure_all_tables()
-    
+
+    context = spec.prepare(True, options or {}) if spec.prepare else dict(options or {})
+    params = {**(spec.params or {}), **(params or {})}
+    start_offset = 0
+    marker = resume.load(db, spec.name)
+    if marker and not _same_request(marker["params"], params):
+        # Otra consulta (ej. carga completa con start_date explícito): el marcador no aplica
+        logging.info(f"🔖 Marcador de reanudación de {spec.name} con otros parámetros ({marker['params']}), se ignora")
+        marker = None
+    if marker:
+        # Continuar la descarga cortada por un apagado, con sus mismos parámetros
+        params, start_offset, page_workers = marker["params"], marker["offset"], 1
+        logging.info(f"🔖 Reanudando {spec.name} desde el registro {start_offset} (interrumpido {marker['created_at']})")
+    if page_workers > 1:
+        pages = bsale_client.iter_pages_parallel(f"{spec.resource}.json", params=params,
+                                                 workers=page_workers, stable=spec.stable)
+    else:
+        pages = bsale_client.iter_pages(f"{spec.resource}.json", params=params, stable=spec.stable, adaptive=True,
+                                        start_offset=start_offset)
     try:
-        products_list = bsale_client._get_all_pages("products.json", params={'expand': '[variants.costs]'})
+        counts = _run_records(db, spec, pages, context, spec.name)
+    except shutdown.ShutdownRequested as e:
+        if page_workers > 1:
+            # Las páginas paralelas llegan sin orden: los registros cargados no son un prefijo de offsets
+            logging.warning(f"🔖 {spec.name}: descarga paralela interrumpida, sin marcador (la próxima ejecución la repite)")
+        else:
+            resume.save(db, spec.name, params, start_offset + e.processed)
+        raise
+    except Exception as e:
+        logging.error(f"🔴 ERROR CRÍTICO en sincronización de {spec.name}: {e}")
+        raise
+    if marker:
+        resume.clear(db, spec.name)
+    if counts:
+        logging.info(f"✅ Sincronización de {spec.name} finalizada. Filas procesadas: {counts}")
+    return counts
+
+
+class ResourceFetchError(Exception):
+    """Recursos que no se pudieron descargar (429/5xx/red): sus ids deben reintentarse"""
+
+    def __init__(self, message: str, ids: List[int], counts: Dict[str, int] = None):
+        super().__init__(message)
+        self.ids = ids
+        self.counts = counts or {}  # filas cargadas de los ids que sí se descargaron
 
-        if not products_list:
-            logging.info("⚠️ No se encontraron productos en Bsale.")
-            return
 
-        logging.info(f"📋 Obtenidos {len(products_list)} productos de Bsale. Validando...")
+def load_entity_by_id(db, name: str, ids: Iterable[int], options: Dict = None) -> Dict[str, int]:
+    """Descarga solo los recursos indicados ('<resource>/<id>.json') y los carga por el mismo pipeline.
 
-        valid_products = []
-        invalid_count = 0
-        processed_variants = set()
+    Los ids inexistentes (404) se omiten; si otros fallan se cargan los demás y se
+    lanza ResourceFetchError con los fallidos.
+    """
+    spec = ENTITY_REGISTRY[name]
+    context = spec.prepare(False, options or {}) if spec.prepare else dict(options or {})
+    failed: List[int] = []
 
-        for product in products_list:
-            variants = product.get("variants", {}).get("items", [])
-            if not variants:
-                invalid_count += 1
-                logging.warning(f"⚠️ Producto {product.get('id')} sin variantes - omitido")
+    def pages():
+        for record_id in ids:
+            try:
+                record = bsale_client.fetch_resource(f"{spec.resource}/{int(record_id)}.json", params=spec.params)
+            except requests.exceptions.RequestException as e:
+                logging.warning(f"⚠️ No se pudo descargar {spec.resource}/{record_id}, se reintentará: {e}")
+                failed.append(int(record_id))
                 continue
+            if record is None:
+                logging.info(f"ℹ️ {spec.resource}/{record_id} no existe en Bsale (404), se omite")
+                continue
+            yield [record]
 
-            # Procesar solo la primera variante activa válida
-            for variant in variants:
-                variant_id = variant.get("id")
-                
-                if variant_id in processed_variants:
-                    continue
-                
-                if variant.get("state") != 0:
-                    continue
-
-                try:
-                    # Obtener precio de lista 2 (OBLIGATORIO)
-                    price_detail = bsale_client.fetch("price_lists/2/details.json", params={"variantid": variant_id})
-                    price_items = price_detail.get("items", []) if price_detail else []
-                    
-                    if not price_items:
-                        invalid_count += 1
-                        logging.error(f"🔴 Producto {product.get('name')} (variante {variant_id}): SIN PRECIO en lista 2 - OMITIDO")
-                        break
-                    
-                    net_price = price_items[0].get("variantValue")
-                    
-                    # Obtener costo usando endpoint específico (OBLIGATORIO)
-                    cost_detail = bsale_client.fetch(f"variants/{variant_id}/costs.json")
-                    net_cost = cost_detail.get("averageCost") if cost_detail else None
-                    cost_history = cost_detail.get("history", []) if cost_detail else []
-                    
-                    # Verificar si hay algún costo histórico > 0
-                    has_valid_cost_history = any(
-                        hist.get("cost", 0) > 0 for hist in cost_history
-                    )
-                    
-                    if not has_valid_cost_history:  # Sin historial O todos los costos son 0
-                        if net_price and net_price > 0:
-                            net_cost = net_price * 0.65
-                            logging.info(f"📊 Producto {product.get('name')} (variante {variant_id}): Sin costos históricos válidos, calculado desde precio: {net_cost}")
-                        else:
-                            net_cost = None  # Will fail validation below
-                    # Si hay historial con costos > 0, usar averageCost
-                    
-                    # VALIDACIÓN ESTRICTA: precio y costo obligatorios
-                    validated_product = ETLDataValidator.validate_product(
-                        product, variant, net_price, net_cost
-                    )
-                    
-                    valid_products.append(validated_product)
-                    processed_variants.add(variant_id)
-                    break  # Solo primera variante válida
-                    
-                except DataValidationError as e:
-                    invalid_count += 1
-                    logging.warning(f"⚠️ Producto inválido omitido: {e}")
-                    break
-                except Exception as e:
-                    invalid_count += 1
-                    logging.error(f"🔴 Error procesando producto {product.get('id')}, variante {variant_id}: {e}")
-                    break
-
-        logging.info(f"✅ Validación completada: {len(valid_products)} productos válidos, {invalid_count} omitidos")
-
-        if not valid_products:
-            logging.error("🔴 CRÍTICO: No hay productos válidos para cargar. Todos los productos tienen problemas de precio/costo.")
-            raise Exception("No hay productos válidos - revisar precios y costos en Bsale")
-
-        # Cargar productos válidos a BigQuery
-        _bigquery_upsert_with_merge(db, "producto", valid_products, "id_producto", "productos")
-        logging.info(f"✅ Sincronización de Productos finalizada (BigQuery). {len(valid_products)} registros válidos procesados.")
-        
-        return valid_products
-        
-    except Exception as e:
-        logging.error(f"🔴 ERROR CRÍTICO en sync_products: {e}")
-        raise
+    counts = _run_records(db, spec._replace(empty_error=None), pages(), context, f"{spec.name} (webhook)") or {}
+    if failed:
+        raise ResourceFetchError(f"{len(failed)} {spec.name} no se pudieron descargar de Bsale", failed, counts)
+    return counts
 
 
-def sync_documents(db, start_date: str = None):
-    """Sincronización de documentos con VALIDACIÓN ESTRICTA"""
-    logging.info(f"📄 Iniciando sincronización de Documentos con validación estricta (desde {start_date or 'el inicio'})...")
-    
-    # Ensure tables exist before syncing
-    db.ensure_all_tables()
-    
-    try:
-        documents_list = bsale_client.get_documents(start_date=start_date)
-        if not documents_list:
-            logging.info("⚠️ No se encontraron documentos de venta.")
-            return
+# --- Sincronización por entidad ---------------------------------------------
 
-        logging.info(f"📋 Obtenidos {len(documents_list)} documentos de Bsale. Validando...")
+@profiling.stage("clientes")
+@memory_budget.track_stage("clientes")
+@with_entity_lock("clientes")
+@quarantine.with_quarantine("clientes")
+def sync_clients(db):
+    """Sincronización de clientes con VALIDACIÓN ESTRICTA"""
+    return run_entity_pipeline(db, ENTITY_REGISTRY["clientes"])
 
-        # BigQuery mode: omitiendo validación FK (las deja NULL si no existen)
-        existing_client_ids = None
-        existing_product_ids = None
-        logging.info("📋 BigQuery mode: omitiendo validación FK.")
 
-        # Validar todos los documentos
-        valid_documents = []
-        valid_details = []
-        invalid_count = 0
+@profiling.stage("productos")
+@memory_budget.track_stage("productos")
+@with_entity_lock("productos")
+@quarantine.with_quarantine("productos")
+def sync_products(db, mode: str = None):
+    """Sincronización de productos con VALIDACIÓN ESTRICTA DE PRECIOS Y COSTOS
 
-        for doc in documents_list:
-            try:
-                # Validar documento
-                validated_doc = ETLDataValidator.validate_document(doc)
-                
-                # BigQuery: mantener FK tal como viene (NULL si no existe)
-                
-                valid_documents.append(validated_doc)
-
-                # Validar detalles del documento
-                details = doc.get("details", {}).get("items", [])
-                for detail in details:
-                    try:
-                        validated_detail = ETLDataValidator.validate_document_detail(detail, doc.get("id"))
-                        
-                        # BigQuery: mantener FK tal como viene
-                        
-                        valid_details.append(validated_detail)
-                        
-                    except DataValidationError as e:
-                        logging.warning(f"⚠️ Detalle documento inválido omitido: {e}")
-                        
-            except DataValidationError as e:
-                invalid_count += 1
-                logging.warning(f"⚠️ Documento inválido omitido: {e}")
+    mode: 'first_variant' (una fila por producto) o 'variants' (una fila por variante activa).
+    Por defecto usa settings.PRODUCT_SYNC_MODE.
+    """
+    return run_entity_pipeline(db, ENTITY_REGISTRY["productos"], options={"mode": mode})
 
-        logging.info(f"✅ Validación completada: {len(valid_documents)} documentos válidos, {len(valid_details)} detalles válidos, {invalid_count} documentos omitidos")
 
-        if not valid_documents:
-            logging.warning("⚠️ No hay documentos válidos para cargar.")
-            return {'documento_venta': [], 'detalle_documento': []}
+@profiling.stage("documentos")
+@memory_budget.track_stage("documentos")
+@with_entity_lock("documentos")
+@quarantine.with_quarantine("documentos")
+def sync_documents(db, start_date: str = None, page_workers: int = 1):
+    """Sincronización de documentos con VALIDACIÓN ESTRICTA (desde start_date si se indica)"""
+    return run_entity_pipeline(db, ENTITY_REGISTRY["documentos"], params=bsale_client._document_params(start_date),
+                               page_workers=page_workers)
 
-        # CARGAR CON UPSERT EN BIGQUERY EN UNA SOLA OPERACIÓN ATÓMICA
-        if valid_documents:
-            _bigquery_upsert_with_merge(db, "documento_venta", valid_documents, "id_documento", "documentos")
-        
-        if valid_details:
-            _bigquery_upsert_with_merge(db, "detalle_documento", valid_details, "id_detalle", "detalles documentos")
 
-        logging.info(f"✅ Sincronización de Documentos finalizada. {len(valid_documents)} documentos y {len(valid_details)} detalles válidos procesados.")
-        
-        return {'documento_venta': valid_documents, 'detalle_documento': valid_details}
-        
-    except Exception as e:
-        logging.error(f"🔴 ERROR CRÍTICO en sync_documents: {e}")
-        raise
+# --- Carga por ID (webhooks): solo los recursos notificados, por el mismo camino MERGE ---
 
+def load_documents_by_id(db, document_ids: Iterable[int]) -> Dict[str, int]:
+    return load_entity_by_id(db, "documentos", document_ids)
 
-def sync_all_to_sheets(data_dict: dict):
-    """
-    Sincroniza todos los datos validados a Google Sheets (si está configurado).
-    data_dict: {'cliente': [...], 'producto': [...], 'documento_venta': [...], 'detalle_documento': [...]}
-    """
-    from app.db.sheets_sync import get_sheets_sync
-    
-    sheets_sync = get_sheets_sync()
-    if not sheets_sync:
-        logging.info("📋 Google Sheets no configurado, omitiendo sincronización.")
-        return
-    
-    try:
-        sheets_sync.sync_all(data_dict)
-    except Exception as e:
-        logging.error(f"🔴 Error sincronizando a Google Sheets: {e}")
-        # No levantamos la excepción para que no falle toda la sincronización
 
+def load_clients_by_id(db, client_ids: Iterable[int]) -> Dict[str, int]:
+    return load_entity_by_id(db, "clientes", client_ids)
+
+
+def load_products_by_id(db, product_ids: Iterable[int], mode: str = None,
+                        variant_ids: Iterable[int] = None) -> Dict[str, int]:
+    return load_entity_by_id(db, "productos", product_ids, options={"mode": mode, "variant_ids": variant_ids})
+
+
+def load_variants_by_id(db, variant_ids: Iterable[int]) -> Dict[str, int]:
+    """Una variante se carga a través de su producto (mismas reglas de precio y costo)"""
+    variants_by_product: Dict[int, List[int]] = {}
+    failed: List[int] = []
+    for variant_id in variant_ids:
+        try:
+            variant = bsale_client.fetch_resource(f"variants/{int(variant_id)}.json")
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"⚠️ No se pudo descargar variants/{variant_id}, se reintentará: {e}")
+            failed.append(int(variant_id))
+            continue
+        product_id = ((variant or {}).get("product") or {}).get("id")
+        if product_id:
+            variants_by_product.setdefault(int(product_id), []).append(int(variant_id))
+    try:
+        # Modo 'variants' filtrado a las pedidas: en first_variant solo se cargaría la primera activa
+        counts = load_products_by_id(db, list(variants_by_product), mode="variants",
+                                     variant_ids=[v for ids in variants_by_product.values() for v in ids])
+    except ResourceFetchError as e:
+        # Reintentar por variante (la cola de webhooks es de variantes, no de productos)
+        counts = e.counts
+        failed += [variant_id for product_id in e.ids for variant_id in variants_by_product[product_id]]
+    if failed:
+        raise ResourceFetchError(f"{len(failed)} variantes no se pudieron descargar de Bsale", failed, counts)
+    return counts
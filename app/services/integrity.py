@@ -0,0 +1,126 @@
+# app/services/integrity.py - INTEGRIDAD REFERENCIAL POST-CARGA
+"""
+La carga mantiene las FK tal como vienen de Bsale (sin validarlas fila a fila).
+Después de cargar documentos, este chequeo busca referencias huérfanas con
+anti-joins set-based, solo sobre los documentos de las fechas de emisión
+tocadas en la ejecución:
+
+- documento_venta.id_cliente -> cliente
+- detalle_documento.id_producto -> producto
+
+Cada relación deja una fila en `etl_integridad` (conteo e ids de muestra).
+Con INTEGRITY_REFETCH_MISSING=True los clientes/productos faltantes se piden
+a Bsale por id y se cargan por el mismo camino MERGE de los webhooks.
+"""
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple
+from datetime import date
+import logging
+import time
+import uuid
+
+from app.core import profiling
+from app.core.config import settings
+from app.db.warehouse import Column
+
+INTEGRITY_TABLE = "etl_integridad"
+
+INTEGRITY_SCHEMA = [
+    Column("id_ejecucion", "STRING", "REQUIRED"),
+    Column("relacion", "STRING"),
+    Column("tabla_destino", "STRING"),
+    Column("fecha_desde", "DATE"),
+    Column("fecha_hasta", "DATE"),
+    Column("huerfanos", "INTEGER"),
+    Column("ids", "STRING"),  # muestra de ids huérfanos separados por coma
+    Column("recuperados", "INTEGER"),
+    Column("revisado_en", "TIMESTAMP"),
+]
+
+
+class Relation(NamedTuple):
+    name: str
+    target: str
+    orphans_sql: str                       # SELECT DISTINCT ... AS id de referencias sin destino
+    refetch: Callable[[Any, List[int]], Dict[str, int]]
+
+
+def _table(table_name: str) -> str:
+    return f"`{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.{table_name}`"
+
+
+def _relations(db, date_filter: str) -> List[Relation]:
+    from app.services import etl_service
+
+    fecha = db.date_expression("d.fecha_emision")
+    return [
+        Relation("documento_venta.id_cliente", "cliente", f"""
+        SELECT DISTINCT d.id_cliente AS id
+        FROM {_table("documento_venta")} AS d
+        LEFT JOIN {_table("cliente")} AS c ON c.id_cliente = d.id_cliente
+        WHERE {fecha} IN ({date_filter}) AND d.id_cliente IS NOT NULL AND c.id_cliente IS NULL
+        """, etl_service.load_clients_by_id),
+        Relation("detalle_documento.id_producto", "producto", f"""
+        SELECT DISTINCT dd.id_producto AS id
+        FROM {_table("detalle_documento")} AS dd
+        JOIN {_table("documento_venta")} AS d ON d.id_documento = dd.id_documento
+        LEFT JOIN {_table("producto")} AS p ON p.id_producto = dd.id_producto
+        WHERE {fecha} IN ({date_filter}) AND dd.id_producto IS NOT NULL AND p.id_producto IS NULL
+        """, etl_service.load_variants_by_id),
+    ]
+
+
+def _find_orphans(db, orphans_sql: str, limit: int):
+    """(total, ids de muestra) en una sola consulta"""
+    rows = list(db.query(f"""
+    SELECT id, COUNT(*) OVER () AS total FROM ({orphans_sql}) AS huerfanos
+    ORDER BY id LIMIT {int(limit)}
+    """))
+    if not rows:
+        return 0, []
+    return int(rows[0]["total"]), [int(row["id"]) for row in rows]
+
+
+@profiling.stage("integridad")
+def check_referential_integrity(db, dates: Iterable[date]) -> Dict[str, Dict[str, Any]]:
+    """Anti-joins de las FK de documentos para las fechas indicadas; registra y devuelve los huérfanos"""
+    dates = sorted(set(dates))
+    if not dates:
+        return {}
+
+    date_filter = ", ".join(db.date_literal(d.isoformat()) for d in dates)
+    run_id = uuid.uuid4().hex
+    report, rows = {}, []
+    for relation in _relations(db, date_filter):
+        total, ids = _find_orphans(db, relation.orphans_sql, settings.INTEGRITY_MAX_IDS)
+        recovered = None
+        if total:
+            logging.warning(f"⚠️ Integridad: {total} {relation.name} sin fila en {relation.target} "
+                            f"({dates[0]} .. {dates[-1]})")
+            if settings.INTEGRITY_REFETCH_MISSING:
+                refetch_ids = ids[:settings.INTEGRITY_REFETCH_MAX_IDS]
+                logging.info(f"🔁 Integridad: pidiendo a Bsale {len(refetch_ids)} ids faltantes de {relation.target}")
+                try:
+                    recovered = relation.refetch(db, refetch_ids).get(relation.target, 0)
+                except Exception as e:
+                    logging.error(f"🔴 Error recuperando {relation.target} faltantes: {e}")
+        report[relation.name] = {"huerfanos": total, "ids": ids, "recuperados": recovered}
+        rows.append({
+            "id_ejecucion": run_id,
+            "relacion": relation.name,
+            "tabla_destino": relation.target,
+            "fecha_desde": dates[0].isoformat(),
+            "fecha_hasta": dates[-1].isoformat(),
+            "huerfanos": total,
+            "ids": ",".join(str(i) for i in ids) or None,
+            "recuperados": recovered,
+            "revisado_en": time.time(),
+        })
+
+    try:
+        db.ensure_table_exists(INTEGRITY_TABLE, INTEGRITY_SCHEMA, partition_field="revisado_en")
+        db.insert_rows(INTEGRITY_TABLE, rows)
+    except Exception as e:
+        logging.error(f"🔴 No se pudo registrar el chequeo de integridad en {INTEGRITY_TABLE}: {e}")
+    if not any(entry["huerfanos"] for entry in report.values()):
+        logging.info(f"✅ Integridad referencial OK para {len(dates)} fechas")
+    return report
@@ -0,0 +1,80 @@
+# app/services/price_history.py - HISTORIAL DE PRECIO Y COSTO DE PRODUCTOS (SCD TIPO 2)
+"""
+El MERGE de `producto` pisa precio_neto y costo_neto, así que el margen de
+fechas pasadas se pierde. `producto_historial` guarda una versión por cada
+cambio, con su rango de validez [valido_desde, valido_hasta):
+
+- Versión vigente: valido_hasta NULL.
+- Tras cada carga de productos, un único MERGE set-based compara `producto`
+  con las versiones vigentes y, solo para las variantes cuyo precio o costo
+  cambió, cierra la versión vigente y abre una nueva. Las variantes sin
+  versión (nuevas o primera ejecución) abren su primera versión.
+
+Precio/costo a una fecha:
+    WHERE id_producto = X AND valido_desde <= t AND (valido_hasta IS NULL OR valido_hasta > t)
+"""
+from typing import Iterable, Optional
+import logging
+
+from app.core import profiling
+from app.core.config import settings
+from app.db.warehouse import Column
+
+HISTORY_TABLE = "producto_historial"
+
+HISTORY_SCHEMA = [
+    Column("id_producto", "INTEGER", "REQUIRED"),
+    Column("valido_desde", "TIMESTAMP", "REQUIRED"),
+    Column("valido_hasta", "TIMESTAMP"),
+    Column("precio_neto", "FLOAT"),
+    Column("costo_neto", "FLOAT"),
+]
+
+HISTORY_KEYS = ["id_producto", "valido_desde"]
+HISTORY_COLUMNS = [column.name for column in HISTORY_SCHEMA]
+
+
+def _table(table_name: str) -> str:
+    return f"`{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.{table_name}`"
+
+
+def _changes_sql(id_filter: str) -> str:
+    """Fuente del MERGE: versiones vigentes a cerrar (coinciden por clave) y versiones nuevas (no coinciden).
+
+    CURRENT_TIMESTAMP es el mismo en toda la sentencia: cierre y apertura quedan contiguos.
+    """
+    return f"""
+    WITH cambios AS (
+        SELECT p.id_producto, p.precio_neto, p.costo_neto,
+               h.valido_desde AS vigente_desde, h.precio_neto AS precio_anterior, h.costo_neto AS costo_anterior
+        FROM {_table("producto")} AS p
+        LEFT JOIN {_table(HISTORY_TABLE)} AS h ON h.id_producto = p.id_producto AND h.valido_hasta IS NULL
+        WHERE {id_filter}(h.id_producto IS NULL
+               OR COALESCE(h.precio_neto, -1) != COALESCE(p.precio_neto, -1)
+               OR COALESCE(h.costo_neto, -1) != COALESCE(p.costo_neto, -1))
+    )
+    SELECT id_producto, vigente_desde AS valido_desde, CURRENT_TIMESTAMP AS valido_hasta,
+           precio_anterior AS precio_neto, costo_anterior AS costo_neto
+    FROM cambios WHERE vigente_desde IS NOT NULL
+    UNION ALL
+    SELECT id_producto, CURRENT_TIMESTAMP AS valido_desde, CAST(NULL AS TIMESTAMP) AS valido_hasta,
+           precio_neto, costo_neto
+    FROM cambios
+    """
+
+
+@profiling.stage("historial_precios")
+def record_price_history(db, product_ids: Optional[Iterable[int]] = None):
+    """Versiona precio/costo de `producto` en producto_historial con un solo MERGE.
+
+    product_ids limita la comparación a esas variantes (cargas por id de webhooks).
+    """
+    db.ensure_table_exists(HISTORY_TABLE, HISTORY_SCHEMA, partition_field="valido_desde")
+    id_filter = ""
+    if product_ids is not None:
+        ids = sorted({int(product_id) for product_id in product_ids})
+        if not ids:
+            return
+        id_filter = f"p.id_producto IN ({', '.join(str(product_id) for product_id in ids)}) AND "
+    db.merge_select(HISTORY_TABLE, _changes_sql(id_filter), HISTORY_KEYS, HISTORY_COLUMNS)
+    logging.info(f"🕰️ Historial de precios y costos actualizado en {HISTORY_TABLE}")
@@ -0,0 +1,164 @@
+# app/services/quarantine.py - CUARENTENA DE REGISTROS RECHAZADOS
+"""
+Acumula en memoria los registros rechazados y advertidos durante una
+ejecución y los carga de una sola vez a la tabla `etl_rechazos` (con código
+de motivo y payload original) con un load job: los payloads pueden sumar más
+que el límite de 10 MB de una petición de streaming. Los logs solo muestran
+conteos por motivo.
+
+Uso:
+    @with_quarantine("clientes")
+    def sync_clients(db):
+        ...
+        quarantine.current().reject("cliente", client.get("id"), error, client)
+
+Los validadores registran advertencias con `warn(...)`, que usa el colector
+activo del contexto actual (o un logging.warning si no hay ninguno); lo
+mismo vale para `current().reject(...)` fuera de una etapa con cuarentena.
+"""
+from typing import Any, Dict, List, Optional
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+import functools
+import json
+import logging
+import threading
+import uuid
+
+from app.db.warehouse import Column
+
+QUARANTINE_TABLE = "etl_rechazos"
+
+QUARANTINE_SCHEMA = [
+    Column("id_ejecucion", "STRING", "REQUIRED"),
+    Column("etapa", "STRING"),
+    Column("entidad", "STRING"),
+    Column("id_registro", "STRING"),
+    Column("severidad", "STRING"),
+    Column("codigo_motivo", "STRING"),  # uno o más códigos separados por coma
+    Column("detalle", "STRING"),
+    Column("payload", "STRING"),
+    Column("registrado_en", "TIMESTAMP"),
+]
+
+# Tope del payload guardado por registro (documentos con detalles pueden ser grandes)
+MAX_PAYLOAD_CHARS = 50000
+
+_current: ContextVar[Optional["RejectionCollector"]] = ContextVar("etl_rejections", default=None)
+
+
+class RejectionCollector:
+    """Rechazos y advertencias de una etapa de la ejecución"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.run_id = uuid.uuid4().hex
+        self.rows: List[Dict[str, Any]] = []
+        self.counts: Counter = Counter()
+        # Las transformaciones concurrentes (ETL_TRANSFORM_WORKERS) registran desde varios hilos
+        self._lock = threading.Lock()
+
+    def _add(self, severity: str, entity: str, record_id: Any, codes: List[str], detail: str, payload: Any):
+        try:
+            raw = json.dumps(payload, default=str, ensure_ascii=False) if payload is not None else None
+        except Exception:
+            raw = str(payload)
+        if raw and len(raw) > MAX_PAYLOAD_CHARS:
+            raw = raw[:MAX_PAYLOAD_CHARS]
+        row = {
+            "id_ejecucion": self.run_id,
+            "etapa": self.stage,
+            "entidad": entity,
+            "id_registro": str(record_id) if record_id is not None else None,
+            "severidad": severity,
+            "codigo_motivo": ",".join(codes),
+            "detalle": detail,
+            "payload": raw,
+            "registrado_en": datetime.now(timezone.utc).isoformat(),
+        }
+        with self._lock:
+            self.rows.append(row)
+            for code in codes:
+                self.counts[(severity, entity, code)] += 1
+
+    def reject(self, entity: str, record_id: Any, error: Exception, payload: Any = None, code: str = None):
+        """Registra un registro omitido. Usa los códigos de DataValidationError si los trae."""
+        codes = [code] if code else (getattr(error, "reasons", None) or ["ERROR_PROCESAMIENTO"])
+        self._add("rechazo", entity, record_id, codes, str(error), payload)
+
+    def warn(self, entity: str, record_id: Any, code: str, detail: str, payload: Any = None):
+        """Registra una advertencia: el registro se carga igual"""
+        self._add("advertencia", entity, record_id, [code], detail, payload)
+
+    def summary(self) -> Dict[str, int]:
+        return {f"{severity}:{entity}:{code}": count for (severity, entity, code), count in sorted(self.counts.items())}
+
+    def flush(self, db):
+        """Carga todos los registros acumulados en una sola operación y loguea conteos por motivo"""
+        if not self.rows:
+            return 0
+        for (severity, entity, code), count in sorted(self.counts.items()):
+            logging.warning(f"⚠️ {self.stage}: {count} {severity}(s) {entity} motivo {code}")
+        rows, self.rows = self.rows, []
+        try:
+            db.ensure_table_exists(QUARANTINE_TABLE, QUARANTINE_SCHEMA, partition_field="registrado_en")
+            db.load_rows(QUARANTINE_TABLE, rows)
+            logging.info(f"🧾 {len(rows)} registros enviados a cuarentena ({QUARANTINE_TABLE}, ejecución {self.run_id})")
+        except Exception as e:
+            logging.error(f"🔴 No se pudo cargar la cuarentena {QUARANTINE_TABLE}: {e}")
+        return len(rows)
+
+
+class _LogCollector(RejectionCollector):
+    """Sin colector activo: cada rechazo o advertencia va al log (no se acumula)"""
+
+    def _add(self, severity: str, entity: str, record_id: Any, codes: List[str], detail: str, payload: Any):
+        logging.warning(f"⚠️ {severity} {entity} {record_id} ({','.join(codes)}): {detail}")
+
+
+def current() -> RejectionCollector:
+    """Colector activo; si no hay, uno que solo escribe al log"""
+    return _current.get() or _LogCollector("sin_etapa")
+
+
+def warn(entity: str, record_id: Any, code: str, detail: str, payload: Any = None):
+    """Advertencia de validación: al colector activo o, si no hay, al log"""
+    collector = _current.get()
+    if collector is None:
+        logging.warning(f"{entity} {record_id}: {detail}")
+        return
+    collector.warn(entity, record_id, code, detail, payload)
+
+
+@contextmanager
+def collect(stage: str):
+    """Activa un colector para la etapa sin volcarlo (vista previa del ETL)"""
+    collector = RejectionCollector(stage)
+    token = _current.set(collector)
+    try:
+        yield collector
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def quarantine_run(db, stage: str):
+    """Activa un colector para la etapa y lo vuelca al warehouse al salir (aunque falle)"""
+    with collect(stage) as collector:
+        try:
+            yield collector
+        finally:
+            collector.flush(db)
+
+
+def with_quarantine(stage: str):
+    """Decorador: ejecuta la función de sincronización (db como primer argumento) dentro de quarantine_run"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(db, *args, **kwargs):
+            with quarantine_run(db, stage):
+                return func(db, *args, **kwargs)
+        return wrapper
+    return decorator
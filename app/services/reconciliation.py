@@ -0,0 +1,190 @@
+# app/services/reconciliation.py - BORRADOS Y ANULACIONES POR DIFERENCIA DE CLAVES
+"""
+El ETL solo hace upsert: un documento o cliente borrado (o anulado/inactivo)
+en Bsale queda en el warehouse. La reconciliación compara conjuntos de
+claves sin descargar los registros completos:
+
+1. Claves vigentes del warehouse (`eliminado_en IS NULL`), leídas ANTES de
+   ir a Bsale: lo que se cargue durante la pasada no entra en la comparación.
+2. Pasada liviana a Bsale pidiendo solo `fields=[id,state]` (sin expand).
+3. Ambos lados como arrays ordenados de enteros de 64 bits (array('q'),
+   8 bytes por id) y un merge lineal: warehouse - activos en Bsale.
+4. Tombstone: UPDATE de eliminado_en con los ids encontrados, en bloques de
+   RECONCILE_IDS_PER_STATEMENT; la próxima carga del registro activo en Bsale
+   lo vuelve a NULL. Delete: un DELETE por tabla (hijas primero) en una sola
+   transacción, con los ids en una tabla temporal.
+
+Documentos: solo la ventana de RECONCILE_DOCUMENT_DAYS días; del lado del
+warehouse se excluye el primer día (margen entre la zona horaria del rango de
+Bsale y la fecha de reporte). Clientes: la tabla completa.
+Si la diferencia supera RECONCILE_MAX_REMOVAL_RATIO de las claves del
+warehouse se aborta sin tocar nada (una respuesta truncada de Bsale no debe
+vaciar la tabla), salvo force=True.
+"""
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Tuple
+from array import array
+from datetime import date, datetime, timedelta
+import logging
+
+from app.core import profiling
+from app.core.config import settings
+from app.db.warehouse import TABLE_SCHEMAS
+from app.services import sales_reports
+from app.services.bsale_client import bsale_client
+from app.services.sync_lock import with_entity_lock
+
+
+class ReconcileSpec(NamedTuple):
+    entity: str                     # nombre del lock (el mismo de la sincronización)
+    resource: str                   # endpoint paginado de Bsale
+    table: str
+    key: str
+    children: Tuple[str, ...] = ()  # tablas hijas con la misma clave (se borran en modo delete)
+    windowed: bool = False          # ventana por fecha de emisión (documentos)
+
+
+RECONCILE_SPECS: Dict[str, ReconcileSpec] = {
+    "documents": ReconcileSpec("documentos", "documents.json", "documento_venta", "id_documento",
+                               children=("detalle_documento",), windowed=True),
+    "clients": ReconcileSpec("clientes", "clients.json", "cliente", "id_cliente"),
+}
+
+
+def _table(table_name: str) -> str:
+    return f"`{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.{table_name}`"
+
+
+def missing_keys(keys: array, present: array) -> array:
+    """Claves de `keys` que no están en `present` (ambos ordenados): merge lineal O(n + m)"""
+    missing = array("q")
+    j, n = 0, len(present)
+    for key in keys:
+        while j < n and present[j] < key:
+            j += 1
+        if j == n or present[j] != key:
+            missing.append(key)
+    return missing
+
+
+def _warehouse_keys(db, spec: ReconcileSpec, since: Optional[date]) -> array:
+    where = "eliminado_en IS NULL"
+    if since is not None:
+        where += f" AND {db.date_expression('fecha_emision')} >= {db.date_literal(since.isoformat())}"
+    rows = db.query(f"SELECT {spec.key} AS id FROM {_table(spec.table)} WHERE {where} ORDER BY id")
+    return array("q", (int(row["id"]) for row in rows))
+
+
+def _bsale_keys(spec: ReconcileSpec, start_date: Optional[str]) -> Tuple[array, array]:
+    """(activos, inactivos) ordenados; solo id y estado, sin detalles"""
+    params = {"fields": "[id,state]"}
+    if spec.windowed:
+        params["emissiondaterange"] = bsale_client._document_params(start_date)["emissiondaterange"]
+    active, inactive = array("q"), array("q")
+    for page in bsale_client.iter_pages(spec.resource, params=params, stable=True):
+        for item in page:
+            if item.get("id") is None:
+                continue
+            (inactive if item.get("state") else active).append(int(item["id"]))
+    return array("q", sorted(active)), array("q", sorted(inactive))
+
+
+def _chunks(keys: array) -> Iterable[str]:
+    size = max(1, settings.RECONCILE_IDS_PER_STATEMENT)
+    for start in range(0, len(keys), size):
+        yield ", ".join(str(key) for key in keys[start:start + size])
+
+
+def _affected_dates(db, spec: ReconcileSpec, keys: array):
+    dates = set()
+    fecha = db.date_expression("fecha_emision")
+    for id_list in _chunks(keys):
+        for row in db.query(f"SELECT DISTINCT {fecha} AS fecha FROM {_table(spec.table)} WHERE {spec.key} IN ({id_list})"):
+            value = row["fecha"]
+            if value is not None:
+                dates.add(value if isinstance(value, date) else date.fromisoformat(str(value)))
+    return dates
+
+
+def _apply(db, spec: ReconcileSpec, keys: array, mode: str):
+    if mode == "delete":
+        # Detalles y documentos se borran juntos o no se borra nada
+        db.delete_keys(spec.children + (spec.table,), spec.key, keys.tolist())
+    else:
+        for id_list in _chunks(keys):
+            db.query(f"UPDATE {_table(spec.table)} SET eliminado_en = CURRENT_TIMESTAMP "
+                     f"WHERE {spec.key} IN ({id_list})")
+    db.commit()
+    sales_reports.invalidate((spec.table,) + spec.children)
+
+
+def _reconcile(db, spec: ReconcileSpec, days: int, mode: str, force: bool) -> Dict[str, Any]:
+    # Agrega la columna eliminado_en a tablas creadas antes de la reconciliación
+    db.ensure_table_exists(spec.table, TABLE_SCHEMAS[spec.table])
+    start_date = since = None
+    if spec.windowed:
+        start = datetime.now() - timedelta(days=days)
+        start_date = start.strftime('%Y-%m-%d')
+        since = start.date() + timedelta(days=1)
+
+    warehouse = _warehouse_keys(db, spec, since)
+    logging.info(f"🔎 Reconciliación {spec.table}: {len(warehouse)} claves vigentes en el warehouse")
+    active, inactive = _bsale_keys(spec, start_date)
+    logging.info(f"🔎 Reconciliación {spec.table}: {len(active)} activos y {len(inactive)} inactivos en Bsale")
+
+    removed = missing_keys(warehouse, active)
+    annulled = len(removed) - len(missing_keys(removed, inactive))
+    result = {
+        "entity": spec.entity,
+        "table": spec.table,
+        "mode": mode,
+        "window_start": start_date,
+        "warehouse_keys": len(warehouse),
+        "bsale_active": len(active),
+        "bsale_inactive": len(inactive),
+        "removed": len(removed),
+        "annulled": annulled,
+        "deleted_in_bsale": len(removed) - annulled,
+        "sample_ids": removed[:20].tolist(),
+        "status": "sin cambios",
+    }
+    if not removed:
+        logging.info(f"✅ Reconciliación {spec.table}: sin borrados ni anulaciones")
+        return result
+
+    ratio = len(removed) / len(warehouse)
+    if ratio > settings.RECONCILE_MAX_REMOVAL_RATIO and not force:
+        logging.error(f"🔴 Reconciliación {spec.table} abortada: {len(removed)} de {len(warehouse)} claves "
+                      f"({ratio:.1%}) superan RECONCILE_MAX_REMOVAL_RATIO; use force=true si es correcto")
+        result["status"] = "abortada"
+        return result
+
+    dates = _affected_dates(db, spec, removed) if spec.windowed else set()
+    _apply(db, spec, removed, mode)
+    logging.info(f"🪦 Reconciliación {spec.table}: {len(removed)} filas {'borradas' if mode == 'delete' else 'marcadas'} "
+                 f"({annulled} anuladas/inactivas, {len(removed) - annulled} borradas en Bsale)")
+    result["status"] = "aplicada"
+
+    if dates and settings.SALES_AGGREGATES_ENABLED:
+        from app.services.sales_aggregates import refresh_sales_aggregates
+        try:
+            result["aggregates_refreshed"] = refresh_sales_aggregates(db, dates)
+        except Exception as e:
+            logging.error(f"🔴 Error actualizando agregados tras la reconciliación: {e}")
+    return result
+
+
+@profiling.stage("reconciliacion")
+def reconcile(db, entity: str, days: int = None, mode: str = None, force: bool = False) -> Dict[str, Any]:
+    """Detecta claves borradas/anuladas en Bsale y las marca o borra en el warehouse.
+
+    entity: 'documents' o 'clients'. Corre con el lock de la entidad para no
+    cruzarse con su sincronización; devuelve LockBusy si otra instancia lo tiene.
+    """
+    spec = RECONCILE_SPECS.get(entity)
+    if spec is None:
+        raise ValueError(f"Entidad '{entity}' no soportada para reconciliación ({', '.join(RECONCILE_SPECS)})")
+    mode = mode or settings.RECONCILE_MODE
+    if mode not in ("tombstone", "delete"):
+        raise ValueError(f"Modo de reconciliación inválido '{mode}' (tombstone o delete)")
+    days = days if days is not None else settings.RECONCILE_DOCUMENT_DAYS
+    return with_entity_lock(spec.entity)(_reconcile)(db, spec, days, mode, force)
@@ -0,0 +1,125 @@
+# app/services/resume.py - MARCADORES DE REANUDACIÓN TRAS UN APAGADO
+"""
+Cuando un apagado corta una sincronización, se guarda en `etl_reanudacion`
+(dataset de la tienda activa) un marcador por clave:
+
+- '<entidad>' (ej. 'documentos'): parámetros de la API y registros ya cargados;
+  la próxima sincronización de la entidad con los mismos parámetros continúa
+  desde ese offset (el tramo posterior lo cubre la siguiente ventana). Las
+  descargas paralelas no dejan marcador: sus páginas llegan sin orden.
+- 'etl_diario': pasos del ETL diario ya completados, que se saltan al reanudar.
+
+Los marcadores vencen tras RESUME_MAX_AGE_HOURS y se borran al completar.
+Se escriben con load job (sin streaming buffer) para poder borrarlos enseguida.
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timezone
+import json
+import logging
+import time
+
+from app.core import shutdown
+from app.core.config import settings
+from app.db.warehouse import Column
+from app.services.sync_lock import is_skipped
+
+RESUME_TABLE = "etl_reanudacion"
+
+RESUME_SCHEMA = [
+    Column("clave", "STRING", "REQUIRED"),
+    Column("parametros", "STRING"),      # JSON
+    Column("registros", "INTEGER"),     # registros ya cargados (offset de reanudación)
+    Column("pasos", "STRING"),           # JSON: pasos completados
+    Column("creado_en", "TIMESTAMP"),
+]
+
+DAILY_KEY = "etl_diario"
+
+
+def _table() -> str:
+    return f"`{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.{RESUME_TABLE}`"
+
+
+def save(db, key: str, params: Dict[str, Any] = None, offset: int = 0, steps: Iterable[str] = ()):
+    db.ensure_table_exists(RESUME_TABLE, RESUME_SCHEMA)
+    db.query(f"DELETE FROM {_table()} WHERE clave = '{key}'")
+    db.load_rows(RESUME_TABLE, [{
+        "clave": key,
+        "parametros": json.dumps(params or {}, sort_keys=True),
+        "registros": int(offset),
+        "pasos": json.dumps(list(steps)),
+        "creado_en": datetime.now(timezone.utc).isoformat(),
+    }])
+    logging.info(f"🔖 Marcador de reanudación guardado: {key} (offset {offset}, pasos {list(steps)})")
+
+
+def load(db, key: str) -> Optional[Dict[str, Any]]:
+    """Marcador vigente de la clave, o None"""
+    if not settings.RESUME_ENABLED:
+        return None
+    try:
+        db.ensure_table_exists(RESUME_TABLE, RESUME_SCHEMA)
+        rows = list(db.query(f"SELECT * FROM {_table()} WHERE clave = '{key}' ORDER BY creado_en DESC LIMIT 1"))
+    except Exception as e:
+        logging.warning(f"⚠️ No se pudo leer el marcador de reanudación de {key}: {e}")
+        return None
+    if not rows:
+        return None
+    row = rows[0]
+    created = row["creado_en"]
+    if not isinstance(created, datetime):
+        created = datetime.fromisoformat(str(created))
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    if time.time() - created.timestamp() > settings.RESUME_MAX_AGE_HOURS * 3600:
+        logging.info(f"ℹ️ Marcador de reanudación de {key} vencido ({created.isoformat()}), se ignora")
+        clear(db, key)
+        return None
+    return {
+        "params": json.loads(row["parametros"] or "{}"),
+        "offset": int(row["registros"] or 0),
+        "steps": json.loads(row["pasos"] or "[]"),
+        "created_at": created.isoformat(),
+    }
+
+
+def clear(db, key: str):
+    try:
+        db.query(f"DELETE FROM {_table()} WHERE clave = '{key}'")
+    except Exception as e:
+        logging.warning(f"⚠️ No se pudo borrar el marcador de reanudación de {key}: {e}")
+
+
+def run_steps(db, steps: List[Tuple[str, Callable[[Any], Any]]], key: str = DAILY_KEY) -> Dict[str, Any]:
+    """Ejecuta pasos (label, func) saltando los completados antes de un apagado.
+
+    Si otro apagado corta la ejecución se guardan los pasos completados y se
+    propaga ShutdownRequested; al terminar todos se borra el marcador.
+    Devuelve {label: LockBusy} de los pasos omitidos porque otra instancia tenía
+    el lease: no cuentan como completados y el marcador los deja pendientes.
+    """
+    marker = load(db, key)
+    done = list(marker["steps"]) if marker else []
+    if done:
+        logging.info(f"🔖 Reanudando {key} interrumpido: se saltan {done}")
+    skipped: Dict[str, Any] = {}
+    for label, func in steps:
+        if label in done:
+            continue
+        try:
+            shutdown.check(label)
+            logging.info(f"🔄 Sincronizando {label}...")
+            result = func(db)
+        except shutdown.ShutdownRequested:
+            save(db, key, steps=done)
+            raise
+        if is_skipped(result):
+            skipped[label] = result
+            continue
+        done.append(label)
+    if skipped:
+        # Un reintento solo repite los pasos omitidos
+        save(db, key, steps=done)
+    elif marker:
+        clear(db, key)
+    return skipped
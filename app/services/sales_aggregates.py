@@ -0,0 +1,139 @@
+# app/services/sales_aggregates.py - TABLAS AGREGADAS DE VENTAS MANTENIDAS INCREMENTALMENTE
+"""
+Tablas pre-agregadas para dashboards, recalculadas solo para las fechas de
+emisión tocadas en la ejecución actual:
+
+- ventas_diarias_producto: fecha, producto (cantidad, neto, costo estimado)
+- ventas_diarias_cliente: fecha, cliente
+- ventas_diarias_tipo_documento: fecha, tipo de documento
+
+Cada fecha tocada se reemplaza completa, recalculada desde las tablas base,
+en una sola sentencia por tabla (db.replace_where), por lo que re-ejecutar es
+idempotente y un fallo no deja fechas vacías. Los documentos marcados como
+eliminados por la reconciliación (eliminado_en) no suman.
+"""
+from typing import Dict, Iterable, List, Set
+from datetime import date, datetime, timezone
+from zoneinfo import ZoneInfo
+import logging
+
+from app.core import profiling
+from app.core.config import settings
+from app.db.warehouse import Column
+
+AGGREGATE_SCHEMAS: Dict[str, List[Column]] = {
+    "ventas_diarias_producto": [
+        Column("fecha", "DATE", "REQUIRED"),
+        Column("id_producto", "INTEGER"),
+        Column("cantidad", "FLOAT"),
+        Column("monto_neto", "FLOAT"),
+        Column("costo_neto_total", "FLOAT"),
+        Column("num_documentos", "INTEGER"),
+        Column("actualizado_en", "TIMESTAMP"),
+    ],
+    "ventas_diarias_cliente": [
+        Column("fecha", "DATE", "REQUIRED"),
+        Column("id_cliente", "INTEGER"),
+        Column("monto_neto", "FLOAT"),
+        Column("monto_iva", "FLOAT"),
+        Column("monto_total", "FLOAT"),
+        Column("num_documentos", "INTEGER"),
+        Column("actualizado_en", "TIMESTAMP"),
+    ],
+    "ventas_diarias_tipo_documento": [
+        Column("fecha", "DATE", "REQUIRED"),
+        Column("id_tipo_documento", "INTEGER"),
+        Column("monto_neto", "FLOAT"),
+        Column("monto_iva", "FLOAT"),
+        Column("monto_total", "FLOAT"),
+        Column("num_documentos", "INTEGER"),
+        Column("actualizado_en", "TIMESTAMP"),
+    ],
+}
+
+
+def _table(table_name: str) -> str:
+    return f"`{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.{table_name}`"
+
+
+def touched_dates(db, documents: Iterable[Dict]) -> Set[date]:
+    """Fechas de emisión (en la zona horaria del warehouse) de los documentos cargados"""
+    tz = ZoneInfo(db.report_timezone)
+    dates = set()
+    for doc in documents:
+        emission = doc.get("fecha_emision")
+        if emission is None:
+            continue
+        if isinstance(emission, (int, float)):
+            dates.add(datetime.fromtimestamp(emission, tz=timezone.utc).astimezone(tz).date())
+        else:
+            dates.add(datetime.fromisoformat(str(emission)).astimezone(tz).date())
+    return dates
+
+
+def _select_statements(db, date_filter: str) -> Dict[str, str]:
+    fecha = db.date_expression("d.fecha_emision")
+    return {
+        "ventas_diarias_producto": f"""
+        SELECT {fecha} AS fecha, dd.id_producto,
+               SUM(dd.cantidad) AS cantidad,
+               SUM(dd.monto_total_linea) AS monto_neto,
+               SUM(dd.cantidad * p.costo_neto) AS costo_neto_total,
+               COUNT(DISTINCT dd.id_documento) AS num_documentos,
+               CURRENT_TIMESTAMP AS actualizado_en
+        FROM {_table("detalle_documento")} AS dd
+        JOIN {_table("documento_venta")} AS d ON d.id_documento = dd.id_documento
+        LEFT JOIN {_table("producto")} AS p ON p.id_producto = dd.id_producto
+        WHERE {fecha} IN ({date_filter}) AND d.eliminado_en IS NULL
+        GROUP BY 1, 2
+        """,
+        "ventas_diarias_cliente": f"""
+        SELECT {fecha} AS fecha, d.id_cliente,
+               SUM(d.monto_neto) AS monto_neto,
+               SUM(d.monto_iva) AS monto_iva,
+               SUM(d.monto_total) AS monto_total,
+               COUNT(*) AS num_documentos,
+               CURRENT_TIMESTAMP AS actualizado_en
+        FROM {_table("documento_venta")} AS d
+        WHERE {fecha} IN ({date_filter}) AND d.eliminado_en IS NULL
+        GROUP BY 1, 2
+        """,
+        "ventas_diarias_tipo_documento": f"""
+        SELECT {fecha} AS fecha, d.id_tipo_documento,
+               SUM(d.monto_neto) AS monto_neto,
+               SUM(d.monto_iva) AS monto_iva,
+               SUM(d.monto_total) AS monto_total,
+               COUNT(*) AS num_documentos,
+               CURRENT_TIMESTAMP AS actualizado_en
+        FROM {_table("documento_venta")} AS d
+        WHERE {fecha} IN ({date_filter}) AND d.eliminado_en IS NULL
+        GROUP BY 1, 2
+        """,
+    }
+
+
+def ensure_aggregate_tables(db):
+    for table_name, schema in AGGREGATE_SCHEMAS.items():
+        db.ensure_table_exists(table_name, schema, partition_field="fecha")
+
+
+@profiling.stage("agregados")
+def refresh_sales_aggregates(db, dates: Iterable[date]) -> List[str]:
+    """Recalcula las tablas agregadas solo para las fechas indicadas. Devuelve las tablas actualizadas."""
+    dates = sorted(set(dates))
+    if not dates:
+        logging.info("ℹ️ Sin fechas tocadas, agregados de ventas sin cambios")
+        return []
+
+    ensure_aggregate_tables(db)
+    date_filter = ", ".join(db.date_literal(d.isoformat()) for d in dates)
+    logging.info(f"📊 Recalculando agregados de ventas para {len(dates)} fechas ({dates[0]} .. {dates[-1]})...")
+
+    refreshed = []
+    for table_name, select_sql in _select_statements(db, date_filter).items():
+        # Borrado e inserción en una sola sentencia: si falla, las fechas conservan sus filas anteriores
+        db.replace_where(table_name, f"target.fecha IN ({date_filter})", select_sql,
+                         [column.name for column in AGGREGATE_SCHEMAS[table_name]])
+        refreshed.append(table_name)
+        logging.info(f"✅ Agregado {table_name} actualizado")
+    return refreshed
@@ -0,0 +1,152 @@
+# app/services/sales_reports.py - REPORTES DE VENTAS CON CACHÉ EN PROCESO
+"""
+Resúmenes de ventas que las herramientas internas piden muchas veces al día:
+
+- ventas por día
+- productos más vendidos
+- totales por cliente
+
+Con SALES_AGGREGATES_ENABLED se leen de las tablas ventas_diarias_* (pocas
+filas por día); si no, de las tablas base. Los resultados quedan en un LRU con
+TTL (REPORT_CACHE_TTL_SECONDS) por dataset, y la carga de documentos o la
+reconciliación los invalidan (`invalidate`) apenas confirman datos nuevos.
+"""
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional
+from datetime import date
+import logging
+import threading
+import time
+
+from app.core.config import settings
+from app.core.result_cache import ResultCache
+
+# Tablas cuyos cambios invalidan los reportes (las agregadas se recalculan desde ellas)
+SOURCE_TABLES = ("documento_venta", "detalle_documento")
+
+_report_cache: Optional[ResultCache] = None
+_report_cache_lock = threading.Lock()
+
+
+def get_report_cache() -> ResultCache:
+    """Caché del proceso, creada al primer uso (importar el módulo no lee la configuración)"""
+    global _report_cache
+    with _report_cache_lock:
+        if _report_cache is None:
+            _report_cache = ResultCache(settings.REPORT_CACHE_MAX_ENTRIES)
+        return _report_cache
+
+
+class Report(NamedTuple):
+    name: str
+    aggregated_sql: Callable[[Any, str, str, int], str]   # (db, desde, hasta, limit) -> SELECT
+    base_sql: Callable[[Any, str, str, int], str]
+
+
+def _table(table_name: str) -> str:
+    return f"`{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.{table_name}`"
+
+
+def _scope() -> str:
+    return f"{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}"
+
+
+def _documents_between(db, start: str, end: str) -> str:
+    fecha = db.date_expression("d.fecha_emision")
+    return f"{fecha} BETWEEN {start} AND {end} AND d.eliminado_en IS NULL"
+
+
+REPORTS: Dict[str, Report] = {
+    "daily": Report(
+        "daily",
+        lambda db, start, end, limit: f"""
+        SELECT fecha, SUM(monto_neto) AS monto_neto, SUM(monto_iva) AS monto_iva,
+               SUM(monto_total) AS monto_total, SUM(num_documentos) AS num_documentos
+        FROM {_table("ventas_diarias_tipo_documento")}
+        WHERE fecha BETWEEN {start} AND {end}
+        GROUP BY fecha ORDER BY fecha
+        """,
+        lambda db, start, end, limit: f"""
+        SELECT {db.date_expression("d.fecha_emision")} AS fecha, SUM(d.monto_neto) AS monto_neto,
+               SUM(d.monto_iva) AS monto_iva, SUM(d.monto_total) AS monto_total, COUNT(*) AS num_documentos
+        FROM {_table("documento_venta")} AS d
+        WHERE {_documents_between(db, start, end)}
+        GROUP BY 1 ORDER BY 1
+        """,
+    ),
+    "top_products": Report(
+        "top_products",
+        lambda db, start, end, limit: f"""
+        SELECT v.id_producto, p.nombre, p.codigo_sku, SUM(v.cantidad) AS cantidad,
+               SUM(v.monto_neto) AS monto_neto, SUM(v.costo_neto_total) AS costo_neto_total
+        FROM {_table("ventas_diarias_producto")} AS v
+        LEFT JOIN {_table("producto")} AS p ON p.id_producto = v.id_producto
+        WHERE v.fecha BETWEEN {start} AND {end}
+        GROUP BY 1, 2, 3 ORDER BY monto_neto DESC LIMIT {limit}
+        """,
+        lambda db, start, end, limit: f"""
+        SELECT dd.id_producto, p.nombre, p.codigo_sku, SUM(dd.cantidad) AS cantidad,
+               SUM(dd.monto_total_linea) AS monto_neto, SUM(dd.cantidad * p.costo_neto) AS costo_neto_total
+        FROM {_table("detalle_documento")} AS dd
+        JOIN {_table("documento_venta")} AS d ON d.id_documento = dd.id_documento
+        LEFT JOIN {_table("producto")} AS p ON p.id_producto = dd.id_producto
+        WHERE {_documents_between(db, start, end)}
+        GROUP BY 1, 2, 3 ORDER BY monto_neto DESC LIMIT {limit}
+        """,
+    ),
+    "clients": Report(
+        "clients",
+        lambda db, start, end, limit: f"""
+        SELECT v.id_cliente, c.nombre, c.apellido, c.rut, SUM(v.monto_neto) AS monto_neto,
+               SUM(v.monto_total) AS monto_total, SUM(v.num_documentos) AS num_documentos
+        FROM {_table("ventas_diarias_cliente")} AS v
+        LEFT JOIN {_table("cliente")} AS c ON c.id_cliente = v.id_cliente
+        WHERE v.fecha BETWEEN {start} AND {end}
+        GROUP BY 1, 2, 3, 4 ORDER BY monto_total DESC LIMIT {limit}
+        """,
+        lambda db, start, end, limit: f"""
+        SELECT d.id_cliente, c.nombre, c.apellido, c.rut, SUM(d.monto_neto) AS monto_neto,
+               SUM(d.monto_total) AS monto_total, COUNT(*) AS num_documentos
+        FROM {_table("documento_venta")} AS d
+        LEFT JOIN {_table("cliente")} AS c ON c.id_cliente = d.id_cliente
+        WHERE {_documents_between(db, start, end)}
+        GROUP BY 1, 2, 3, 4 ORDER BY monto_total DESC LIMIT {limit}
+        """,
+    ),
+}
+
+
+def run_report(db, name: str, start: date, end: date, limit: int = 50) -> Dict[str, Any]:
+    """Filas del reporte desde la caché o, si no están, desde el warehouse"""
+    report = REPORTS[name]
+    started = time.perf_counter()
+    aggregated = settings.SALES_AGGREGATES_ENABLED
+    key = (name, start.isoformat(), end.isoformat(), int(limit), aggregated)
+    cached, rows = get_report_cache().get(_scope(), key)
+    if not cached:
+        if aggregated:
+            from app.services.sales_aggregates import ensure_aggregate_tables
+            ensure_aggregate_tables(db)
+        build_sql = report.aggregated_sql if aggregated else report.base_sql
+        sql = build_sql(db, db.date_literal(start.isoformat()), db.date_literal(end.isoformat()), int(limit))
+        rows = [dict(row) for row in db.query(sql)]
+        get_report_cache().put(_scope(), key, rows, SOURCE_TABLES, settings.REPORT_CACHE_TTL_SECONDS)
+    return {
+        "report": name,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "source": "agregados" if aggregated else "tablas base",
+        "cached": cached,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        "rows": rows,
+    }
+
+
+def invalidate(tables: Iterable[str]) -> int:
+    """Descarta los reportes del dataset activo si alguna tabla fuente cambió"""
+    tables = set(tables) & set(SOURCE_TABLES)
+    if not tables:
+        return 0
+    dropped = get_report_cache().invalidate(_scope(), tables)
+    if dropped:
+        logging.info(f"🧾 Caché de reportes: {dropped} resultados invalidados por cambios en {', '.join(sorted(tables))}")
+    return dropped
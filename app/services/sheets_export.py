@@ -0,0 +1,85 @@
+# app/services/sheets_export.py - EXPORTACIÓN DEL WAREHOUSE A GOOGLE SHEETS
+"""
+Etapa de exportación independiente de la sincronización: lee cada tabla desde
+el warehouse en páginas (una consulta ORDER BY id leída por páginas) y las escribe en
+Google Sheets a medida que llegan. En memoria solo hay una página por hoja,
+así que la sincronización ya no necesita retener lo cargado para el espejo.
+"""
+from typing import Dict, Iterator, List, Optional
+import logging
+
+from app.core import profiling
+from app.core.config import settings
+from app.db.warehouse import TABLE_SCHEMAS
+
+# Tablas que se exportan tras sincronizar cada entidad de /etl/sync/{entity}
+ENTITY_TABLES: Dict[str, List[str]] = {
+    "clients": ["cliente"],
+    "products": ["producto"],
+    "variants": ["producto"],
+    "documents": ["documento_venta", "detalle_documento"],
+    "all": list(TABLE_SCHEMAS),
+}
+
+
+def _table(table_name: str) -> str:
+    return f"`{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.{table_name}`"
+
+
+def _count_rows(db, table_name: str) -> int:
+    rows = list(db.query(f"SELECT COUNT(*) AS total FROM {_table(table_name)}"))
+    return int(rows[0]["total"]) if rows else 0
+
+
+def iter_table_pages(db, table_name: str, page_size: int) -> Iterator[List[Dict]]:
+    """Páginas de la tabla ordenadas por su clave (primera columna del schema).
+
+    Una sola consulta (un job en BigQuery) leída página a página, no un SELECT ... LIMIT por página.
+    """
+    columns = [column.name for column in TABLE_SCHEMAS[table_name]]
+    sql = f"SELECT {', '.join(columns)} FROM {_table(table_name)} ORDER BY {columns[0]}"
+    for page in db.query_pages(sql, int(page_size)):
+        yield [{column: row[column] for column in columns} for row in page]
+
+
+@profiling.stage("sheets")
+def export_to_sheets(db, tables: Optional[List[str]] = None) -> Dict:
+    """
+    Exporta las tablas indicadas (por defecto todas) del warehouse a Google Sheets.
+    Devuelve {tabla: filas escritas | error}, o {} si Sheets no está configurado.
+    """
+    from app.db.sheets_sync import get_sheets_sync
+
+    tables = tables or list(TABLE_SCHEMAS)
+    unknown = [table for table in tables if table not in TABLE_SCHEMAS]
+    if unknown:
+        raise ValueError(f"Tablas desconocidas para exportar: {', '.join(unknown)}")
+
+    sheets_sync = get_sheets_sync()
+    if not sheets_sync:
+        logging.info("📋 Google Sheets no configurado, omitiendo sincronización.")
+        return {}
+
+    page_size = settings.SHEETS_CHUNK_ROWS
+    sources = {}
+    for table_name in dict.fromkeys(tables):
+        # El conteo fija el tamaño de la hoja; filas que lleguen después quedan para la próxima exportación
+        total_rows = _count_rows(db, table_name)
+        headers = [column.name for column in TABLE_SCHEMAS[table_name]]
+        sources[table_name] = (total_rows, headers, iter_table_pages(db, table_name, page_size))
+        logging.info(f"📤 Exportando {total_rows} filas de {table_name} a Google Sheets en páginas de {page_size}")
+    return sheets_sync.export_streams(sources)
+
+
+def export_after_sync(db, entity: str) -> Dict:
+    """Exportación posterior a /etl/sync/{entity}; los errores se loguean sin fallar la sincronización"""
+    if not settings.SHEETS_EXPORT_AFTER_SYNC:
+        return {}
+    tables = ENTITY_TABLES.get(entity)
+    if not tables:
+        return {}
+    try:
+        return export_to_sheets(db, tables)
+    except Exception as e:
+        logging.error(f"🔴 Error sincronizando a Google Sheets: {e}")
+        return {"error": str(e)}
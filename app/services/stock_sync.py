@@ -0,0 +1,190 @@
+# app/services/stock_sync.py - SNAPSHOT DIARIO DE STOCK POR VARIANTE Y SUCURSAL
+"""
+Entidad de inventario de alto volumen:
+
+- stock_diario: una foto completa por día (particionada por fecha_snapshot),
+  cargada con UN load job WRITE_TRUNCATE a la partición del día: re-ejecutar
+  el mismo día la reemplaza de forma atómica.
+- stock_actual: último stock por (variante, sucursal), mantenido con un único
+  MERGE set-based desde la partición del día (una fila por clave).
+
+La descarga de /stocks.json es concurrente (STOCK_EXTRACT_WORKERS hilos) y las
+filas se acumulan en un SpillBuffer, no en una lista sin límite.
+"""
+from typing import Dict, Iterable, List
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+import itertools
+import logging
+
+from app.core import memory_budget, profiling
+from app.core.config import settings
+from app.db.warehouse import Column
+from app.services import quarantine
+from app.services.bsale_client import bsale_client
+from app.services.sync_lock import with_entity_lock
+
+STOCK_SNAPSHOT_TABLE = "stock_diario"
+STOCK_LATEST_TABLE = "stock_actual"
+
+STOCK_SCHEMAS: Dict[str, List[Column]] = {
+    STOCK_SNAPSHOT_TABLE: [
+        Column("fecha_snapshot", "DATE", "REQUIRED"),
+        Column("id_variante", "INTEGER", "REQUIRED"),
+        Column("id_sucursal", "INTEGER"),
+        Column("cantidad", "FLOAT"),
+        Column("cantidad_reservada", "FLOAT"),
+        Column("cantidad_disponible", "FLOAT"),
+        Column("capturado_en", "TIMESTAMP"),
+    ],
+    STOCK_LATEST_TABLE: [
+        Column("id_variante", "INTEGER", "REQUIRED"),
+        Column("id_sucursal", "INTEGER"),
+        Column("cantidad", "FLOAT"),
+        Column("cantidad_reservada", "FLOAT"),
+        Column("cantidad_disponible", "FLOAT"),
+        Column("fecha_snapshot", "DATE"),
+        Column("actualizado_en", "TIMESTAMP"),
+    ],
+}
+
+STOCK_KEYS = ["id_variante", "id_sucursal"]
+LATEST_COLUMNS = [column.name for column in STOCK_SCHEMAS[STOCK_LATEST_TABLE]]
+
+
+def _table(table_name: str) -> str:
+    return f"`{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.{table_name}`"
+
+
+def ensure_stock_tables(db):
+    db.ensure_table_exists(STOCK_SNAPSHOT_TABLE, STOCK_SCHEMAS[STOCK_SNAPSHOT_TABLE], partition_field="fecha_snapshot")
+    db.ensure_table_exists(STOCK_LATEST_TABLE, STOCK_SCHEMAS[STOCK_LATEST_TABLE])
+
+
+def validate_stock(item: Dict) -> Dict:
+    """Fila de stock normalizada; lanza DataValidationError si falta la variante o la sucursal"""
+    from app.services.etl_service import DataValidationError, _raise_if_errors
+
+    errors = []
+    variant_id = (item.get("variant") or {}).get("id")
+    office_id = (item.get("office") or {}).get("id")
+    if not variant_id:
+        errors.append(("SIN_VARIANTE", f"Stock {item.get('id')}: variante faltante"))
+    if not office_id:
+        errors.append(("SIN_SUCURSAL", f"Stock {item.get('id')}: sucursal faltante"))
+    _raise_if_errors("Stock inválido", errors)
+
+    quantity = item.get("quantity")
+    if quantity is not None and quantity < 0:
+        quarantine.warn("stock", item.get("id"), "STOCK_NEGATIVO",
+                        f"variante {variant_id} sucursal {office_id}: stock negativo {quantity}")
+    return {
+        "id_variante": int(variant_id),
+        "id_sucursal": int(office_id),
+        "cantidad": float(quantity) if quantity is not None else None,
+        "cantidad_reservada": float(item["quantityReserved"]) if item.get("quantityReserved") is not None else None,
+        "cantidad_disponible": float(item["quantityAvailable"]) if item.get("quantityAvailable") is not None else None,
+    }
+
+
+def _snapshot_date(db) -> str:
+    return datetime.now(ZoneInfo(db.report_timezone)).date().isoformat()
+
+
+@profiling.stage("stock")
+@memory_budget.track_stage("stock")
+@with_entity_lock("stock")
+@quarantine.with_quarantine("stock")
+def sync_stock(db) -> Dict[str, int]:
+    """Snapshot diario completo del stock: un load job a stock_diario y un MERGE a stock_actual"""
+    from app.services.etl_service import DataValidationError
+
+    logging.info("📦 Iniciando snapshot de Stock...")
+    ensure_stock_tables(db)
+
+    snapshot_date = _snapshot_date(db)
+    captured_at = datetime.now(timezone.utc).isoformat()
+    rejections = quarantine.current()
+    rows = memory_budget.SpillBuffer(STOCK_SNAPSHOT_TABLE)
+    fetched = duplicates = 0
+    try:
+        for page in bsale_client.iter_stocks(workers=settings.STOCK_EXTRACT_WORKERS):
+            fetched += len(page)
+            # Repetidos dentro de la página; entre páginas los resuelve el MERGE a stock_actual
+            seen = set()
+            for item in page:
+                try:
+                    row = validate_stock(item)
+                except DataValidationError as e:
+                    rejections.reject("stock", item.get("id"), e, item)
+                    continue
+                key = (row["id_variante"], row["id_sucursal"])
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                row.update({"fecha_snapshot": snapshot_date, "capturado_en": captured_at})
+                rows.append(row)
+
+        logging.info(f"📋 Obtenidos {fetched} registros de stock de Bsale: {len(rows)} válidos, {duplicates} repetidos")
+        if not len(rows):
+            logging.warning("⚠️ No hay stock válido para cargar.")
+            return {STOCK_SNAPSHOT_TABLE: 0, STOCK_LATEST_TABLE: 0}
+
+        # La partición del día se reemplaza completa y atómica: re-ejecutar es idempotente
+        loaded = db.replace_partition(
+            STOCK_SNAPSHOT_TABLE, "fecha_snapshot", snapshot_date,
+            itertools.chain.from_iterable(rows.iter_batches(settings.MEMORY_LOAD_CHUNK_ROWS)),
+        )
+        logging.info(f"✅ {loaded} filas cargadas a {STOCK_SNAPSHOT_TABLE} ({snapshot_date}) en un load job")
+
+        # Una fila por (variante, sucursal): el MERGE falla si la fuente repite una clave
+        db.merge_select(STOCK_LATEST_TABLE, f"""
+        SELECT id_variante, id_sucursal, cantidad, cantidad_reservada, cantidad_disponible,
+               fecha_snapshot, CURRENT_TIMESTAMP AS actualizado_en
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY id_variante, id_sucursal ORDER BY capturado_en DESC) AS fila
+            FROM {_table(STOCK_SNAPSHOT_TABLE)}
+            WHERE fecha_snapshot = {db.date_literal(snapshot_date)}
+        ) AS foto
+        WHERE fila = 1
+        """, STOCK_KEYS, LATEST_COLUMNS)
+        logging.info(f"✅ {STOCK_LATEST_TABLE} actualizado con un MERGE desde la foto del {snapshot_date}")
+        return {STOCK_SNAPSHOT_TABLE: loaded, STOCK_LATEST_TABLE: len(rows)}
+    finally:
+        rows.close()
+
+
+def _literal(value) -> str:
+    if value is None:
+        return "NULL"
+    return repr(value)
+
+
+def load_stock_by_variant(db, variant_ids: Iterable[int]) -> Dict[str, int]:
+    """Webhooks de stock: actualiza stock_actual de las variantes notificadas (sin tocar la foto diaria)"""
+    from app.services.etl_service import DataValidationError
+
+    ensure_stock_tables(db)
+    rejections = quarantine.current()
+    date_literal = db.date_literal(_snapshot_date(db))
+    selects = {}
+    for variant_id in variant_ids:
+        for page in bsale_client.iter_pages("stocks.json", params={"variantid": int(variant_id)}):
+            for item in page:
+                try:
+                    row = validate_stock(item)
+                except DataValidationError as e:
+                    rejections.reject("stock", item.get("id"), e, item)
+                    continue
+                values = ", ".join(
+                    f"{_literal(row[name])} AS {name}"
+                    for name in ("id_variante", "id_sucursal", "cantidad", "cantidad_reservada", "cantidad_disponible")
+                )
+                selects[(row["id_variante"], row["id_sucursal"])] = (
+                    f"SELECT {values}, {date_literal} AS fecha_snapshot, CURRENT_TIMESTAMP AS actualizado_en"
+                )
+    if not selects:
+        return {STOCK_LATEST_TABLE: 0}
+    db.merge_select(STOCK_LATEST_TABLE, "\n        UNION ALL ".join(selects.values()), STOCK_KEYS, LATEST_COLUMNS)
+    return {STOCK_LATEST_TABLE: len(selects)}
@@ -0,0 +1,341 @@
+# app/services/sync_lock.py - LOCK POR ENTIDAD PARA EVITAR SINCRONIZACIONES SOLAPADAS
+"""
+Lease con TTL por entidad (clientes, productos, documentos).
+
+- Dentro de una misma instancia, una llamada idéntica (misma función y
+  argumentos) a otra en curso se une a la ejecución en vuelo y recibe su mismo
+  resultado; una llamada con otros argumentos (ej. otra ventana de documentos
+  o una reconciliación) espera a que termine y luego toma el lease.
+- Entre instancias, el lease vive en un backend compartido: la tabla
+  `etl_lock` de BigQuery o, para desarrollo local, archivos en SYNC_LOCK_DIR.
+  Si otra instancia tiene el lease vigente, la llamada se omite y devuelve
+  LockBusy (status 'omitida').
+
+Mientras la sincronización corre, un hilo renueva el lease cada TTL/3.
+"""
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+import functools
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+
+from app.core import tenancy
+from app.core.config import get_settings, settings
+
+
+class LocalFileLeaseStore:
+    """Leases en archivos JSON locales (un archivo por entidad), protegidos con flock"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, entity: str) -> str:
+        return os.path.join(self.directory, f"{entity}.lock")
+
+    def _update(self, entity: str, func: Callable[[Optional[Dict]], Optional[Dict]]) -> Optional[Dict]:
+        import fcntl
+
+        with open(self._path(entity), "a+") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                handle.seek(0)
+                raw = handle.read()
+                current = json.loads(raw) if raw.strip() else None
+                new = func(current)
+                if new is not current:
+                    handle.seek(0)
+                    handle.truncate()
+                    if new is not None:
+                        handle.write(json.dumps(new))
+                    handle.flush()
+                return new
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def acquire(self, entity: str, owner: str, ttl_seconds: int) -> bool:
+        now = datetime.now(timezone.utc)
+
+        def take(current):
+            if current and current["owner"] != owner and datetime.fromisoformat(current["expires_at"]) > now:
+                return current
+            return {"owner": owner, "acquired_at": now.isoformat(),
+                    "expires_at": (now + timedelta(seconds=ttl_seconds)).isoformat()}
+
+        return (self._update(entity, take) or {}).get("owner") == owner
+
+    def renew(self, entity: str, owner: str, ttl_seconds: int):
+        self.acquire(entity, owner, ttl_seconds)
+
+    def release(self, entity: str, owner: str):
+        self._update(entity, lambda current: None if current and current["owner"] == owner else current)
+
+    def holder(self, entity: str) -> Optional[Dict]:
+        current = self._update(entity, lambda current: current)
+        if current and datetime.fromisoformat(current["expires_at"]) > datetime.now(timezone.utc):
+            return current
+        return None
+
+
+class BigQueryLeaseStore:
+    """Leases en la tabla `etl_lock` de BigQuery (una fila por entidad).
+
+    La fila se siembra (libre) fuera de la carrera y el lease se toma con un
+    UPDATE condicional: gana quien afecta filas. Los UPDATE sobre la tabla se
+    serializan en BigQuery; uno concurrente falla o no encuentra la fila libre.
+    """
+
+    TABLE = "etl_lock"
+
+    def __init__(self):
+        self._writer = None
+        self._seeded = set()
+
+    def _db(self):
+        if self._writer is None:
+            from app.db.bigquery_client import BigQueryWriter
+            from app.db.warehouse import Column
+
+            # La tabla de leases vive en el dataset base, compartida por todas las tiendas
+            base = get_settings()
+            self._writer = BigQueryWriter(base.BIGQUERY_PROJECT, base.BIGQUERY_DATASET)
+            self._writer.ensure_table_exists(self.TABLE, [
+                Column("entidad", "STRING", "REQUIRED"),
+                Column("propietario", "STRING"),
+                Column("adquirido_en", "TIMESTAMP"),
+                Column("expira_en", "TIMESTAMP"),
+            ])
+        return self._writer
+
+    def _table(self) -> str:
+        return f"`{self._db()._table_ref(self.TABLE)}`"
+
+    def _dml(self, sql: str) -> int:
+        """Ejecuta un DML y devuelve las filas afectadas"""
+        db = self._db()
+        job = db.client.query(sql)
+        job.result()
+        db.costs.record(sql, job.total_bytes_billed)
+        return job.num_dml_affected_rows or 0
+
+    def _seed(self, entity: str):
+        """Fila libre (ya vencida) de la entidad si no existe; filas duplicadas por una siembra concurrente
+        no cambian el resultado: el UPDATE de acquire las toma todas o ninguna"""
+        if entity in self._seeded:
+            return
+        self._dml(f"""
+        INSERT INTO {self._table()} (entidad, propietario, adquirido_en, expira_en)
+        SELECT "{entity}", NULL, TIMESTAMP_SECONDS(0), TIMESTAMP_SECONDS(0)
+        FROM UNNEST([1])
+        WHERE NOT EXISTS (SELECT 1 FROM {self._table()} WHERE entidad = "{entity}")
+        """)
+        self._seeded.add(entity)
+
+    def acquire(self, entity: str, owner: str, ttl_seconds: int) -> bool:
+        try:
+            self._seed(entity)
+            taken = self._dml(f"""
+            UPDATE {self._table()}
+            SET propietario = "{owner}",
+                adquirido_en = CURRENT_TIMESTAMP(),
+                expira_en = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL {int(ttl_seconds)} SECOND)
+            WHERE entidad = "{entity}"
+              AND NOT EXISTS (
+                SELECT 1 FROM {self._table()}
+                WHERE entidad = "{entity}" AND expira_en >= CURRENT_TIMESTAMP() AND propietario != "{owner}")
+            """)
+        except Exception as e:
+            # Un UPDATE concurrente sobre la misma tabla falla por serialización: otro ganó
+            logging.warning(f"⚠️ No se pudo tomar lease de {entity}: {e}")
+            return False
+        return taken > 0
+
+    def renew(self, entity: str, owner: str, ttl_seconds: int):
+        self._db().query(f"""
+        UPDATE {self._table()}
+        SET expira_en = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL {int(ttl_seconds)} SECOND)
+        WHERE entidad = "{entity}" AND propietario = "{owner}"
+        """)
+
+    def release(self, entity: str, owner: str):
+        self._db().query(f"""
+        UPDATE {self._table()}
+        SET expira_en = CURRENT_TIMESTAMP()
+        WHERE entidad = "{entity}" AND propietario = "{owner}"
+        """)
+
+    def holder(self, entity: str) -> Optional[Dict]:
+        rows = list(self._db().query(f"""
+        SELECT propietario, adquirido_en, expira_en FROM {self._table()}
+        WHERE entidad = "{entity}" AND expira_en > CURRENT_TIMESTAMP()
+        ORDER BY adquirido_en DESC
+        LIMIT 1
+        """))
+        if not rows:
+            return None
+        row = rows[0]
+        return {"owner": row["propietario"], "acquired_at": row["adquirido_en"].isoformat(),
+                "expires_at": row["expira_en"].isoformat()}
+
+
+class LockBusy(NamedTuple):
+    """Resultado de una llamada omitida: otra instancia tiene el lease de la entidad"""
+    entity: str
+    holder: Optional[Dict]
+    status: str = "omitida"
+
+
+def is_skipped(result: Any) -> bool:
+    return isinstance(result, LockBusy)
+
+
+def _freeze(value: Any) -> Hashable:
+    """Valor comparable de un argumento; los writers equivalen si apuntan al mismo backend"""
+    from app.db.warehouse import WarehouseWriter
+
+    if isinstance(value, WarehouseWriter):
+        return ("writer", value.backend)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        frozen = tuple(_freeze(item) for item in value)
+        return tuple(sorted(frozen, key=repr)) if isinstance(value, (set, frozenset)) else frozen
+    hash(value)
+    return value
+
+
+def _call_key(entity: str, func: Callable, args: Tuple, kwargs: Dict) -> Optional[Hashable]:
+    """Clave de una llamada para unirla a otra idéntica en vuelo (None si los argumentos no son comparables)"""
+    try:
+        return (entity, func, _freeze(args), _freeze(kwargs))
+    except TypeError:
+        return None
+
+
+class EntityLockManager:
+    """Coordina leases por entidad y une llamadas solapadas a la ejecución en vuelo"""
+
+    def __init__(self, store=None, ttl_seconds: int = None):
+        self._store = store
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Future] = {}
+        # Una ejecución por entidad y proceso; las llamadas con otros argumentos esperan aquí
+        self._entity_locks: Dict[str, threading.Lock] = {}
+        self.owner_prefix = f"{socket.gethostname()}-{os.getpid()}"
+
+    @property
+    def ttl_seconds(self) -> int:
+        return self._ttl_seconds or settings.SYNC_LOCK_TTL_SECONDS
+
+    @property
+    def store(self):
+        if self._store is None:
+            backend = settings.SYNC_LOCK_BACKEND
+            if backend == "bigquery":
+                self._store = BigQueryLeaseStore()
+            elif backend == "local":
+                self._store = LocalFileLeaseStore(settings.SYNC_LOCK_DIR)
+        return self._store
+
+    def _heartbeat(self, entity: str, owner: str, stop: threading.Event):
+        while not stop.wait(self.ttl_seconds / 3):
+            try:
+                self.store.renew(entity, owner, self.ttl_seconds)
+            except Exception as e:
+                logging.warning(f"⚠️ No se pudo renovar lease de {entity}: {e}")
+
+    def run(self, entity: str, func: Callable, args: Tuple = (), kwargs: Dict = None, coalesce: bool = True) -> Any:
+        """Ejecuta func con el lease de la entidad o se une a una llamada idéntica en curso.
+
+        coalesce=False: nunca se une; siempre espera su turno (ej. micro-lotes de webhooks).
+        Devuelve LockBusy si otra instancia tiene el lease.
+        """
+        kwargs = kwargs or {}
+        key = _call_key(entity, func, args, kwargs) if coalesce else None
+        future = None
+        with self._lock:
+            in_flight = self._in_flight.get(key) if key is not None else None
+            if in_flight is None and key is not None:
+                future = Future()
+                self._in_flight[key] = future
+            entity_lock = self._entity_locks.setdefault(entity, threading.Lock())
+
+        if in_flight is not None:
+            logging.info(f"🔗 Sincronización de {entity} idéntica ya en curso en esta instancia - esperando su resultado")
+            return in_flight.result()
+
+        try:
+            if not entity_lock.acquire(blocking=False):
+                logging.info(f"⏳ Otra ejecución de {entity} en curso en esta instancia - esperando el lease")
+                entity_lock.acquire()
+            try:
+                result = self._run_with_lease(entity, func, args, kwargs)
+            finally:
+                entity_lock.release()
+            if future is not None:
+                future.set_result(result)
+            return result
+        except BaseException as e:
+            if future is not None:
+                future.set_exception(e)
+            raise
+        finally:
+            if future is not None:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+
+    def _run_with_lease(self, entity: str, func: Callable, args: Tuple, kwargs: Dict) -> Any:
+        owner = f"{self.owner_prefix}-{uuid.uuid4().hex[:8]}"
+        stop = threading.Event()
+        acquired = False
+        try:
+            if self.store is not None:
+                acquired = self.store.acquire(entity, owner, self.ttl_seconds)
+                if not acquired:
+                    holder = self.store.holder(entity)
+                    logging.info(f"⏭️ Sincronización de {entity} en curso en otra instancia ({holder}) - omitida")
+                    return LockBusy(entity, holder)
+                threading.Thread(target=self._heartbeat, args=(entity, owner, stop), daemon=True).start()
+            return func(*args, **kwargs)
+        finally:
+            stop.set()
+            if acquired:
+                try:
+                    self.store.release(entity, owner)
+                except Exception as e:
+                    logging.warning(f"⚠️ No se pudo liberar lease de {entity} (expirará por TTL): {e}")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            local = sorted(entity for entity, lock in self._entity_locks.items() if lock.locked())
+        holders = {}
+        if self.store is not None:
+            for entity in ("clientes", "productos", "documentos", "stock"):
+                try:
+                    holders[entity] = self.store.holder(entity)
+                except Exception as e:
+                    holders[entity] = {"error": str(e)}
+        return {"backend": settings.SYNC_LOCK_BACKEND, "in_flight_local": local, "leases": holders}
+
+
+lock_manager = EntityLockManager()
+
+
+def with_entity_lock(entity: str, coalesce: bool = True):
+    """Decorador: serializa las ejecuciones de una función de sincronización por entidad.
+
+    coalesce=False: las llamadas no se unen a una idéntica en curso (cada una carga sus propios datos).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Cada tienda (BSALE_TENANTS) tiene su propio lease por entidad
+            return lock_manager.run(tenancy.scoped(entity), func, args, kwargs, coalesce=coalesce)
+        return wrapper
+    return decorator
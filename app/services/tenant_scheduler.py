@@ -0,0 +1,163 @@
+# app/services/tenant_scheduler.py - ETL DIARIO DE VARIAS TIENDAS CON TURNOS JUSTOS
+"""
+Ejecuta el ETL diario de todas las tiendas de BSALE_TENANTS en una instancia.
+
+- Como máximo TENANT_MAX_CONCURRENCY pasos corren a la vez (tope global).
+- Cada tienda tiene a lo sumo un paso en vuelo y sus pasos son secuenciales
+  (clientes -> productos -> documentos -> stock -> commit).
+- Turnos round-robin por paso: al terminar un paso, la tienda vuelve al final
+  de la cola, así una tienda grande ocupa un solo hilo y no retrasa a las demás.
+- Las peticiones a Bsale respetan el límite por segundo de cada tienda.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+import contextvars
+import functools
+import logging
+import time
+
+from app.core import shutdown, tenancy
+from app.core.config import settings
+from app.services import resume
+from app.services.sync_lock import is_skipped
+
+Step = Tuple[str, Callable[[Any], Any]]
+
+
+def daily_steps() -> List[Step]:
+    """Pasos del ETL diario completo (los mismos para una tienda o para la instancia sin tiendas)"""
+    from app.services import etl_service, stock_sync, window_planner
+
+    if settings.ADAPTIVE_WINDOW_ENABLED:
+        # Ventana según los cambios y atrasos observados en ejecuciones anteriores
+        sync_documents = window_planner.sync_documents_adaptive
+    else:
+        # Documentos de los últimos 7 días para no sobrecargar
+        start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+        sync_documents = functools.partial(etl_service.sync_documents, start_date=start_date)
+    steps: List[Step] = [
+        ("clientes", etl_service.sync_clients),
+        ("productos", etl_service.sync_products),
+        ("documentos", sync_documents),
+    ]
+    if settings.STOCK_SYNC_ENABLED:
+        steps.append(("stock", stock_sync.sync_stock))
+    return steps
+
+
+class _TenantRun:
+    """Estado de una tienda: su contexto, su writer y la cola de tareas pendientes"""
+
+    def __init__(self, tenant: tenancy.Tenant):
+        self.tenant = tenant
+        self.context = contextvars.copy_context()
+        self.db = None
+        # El writer y los pasos se crean en el primer turno, con la tienda activa
+        self.tasks = deque([("setup", self.setup)])
+        self.timings: Dict[str, float] = {}
+        self.done: List[str] = []
+        # Pasos omitidos porque otra instancia tenía el lease: label -> holder
+        self.skipped: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+        self.started_at = datetime.now()
+
+    def run(self, func: Callable) -> Any:
+        """Ejecuta func con la tienda activa, en el contexto propio de esta tienda"""
+        return self.context.run(self._with_tenant, func)
+
+    def _with_tenant(self, func: Callable) -> Any:
+        with tenancy.tenant_context(self.tenant):
+            return func()
+
+    def setup(self):
+        from app.db.warehouse import get_writer
+
+        self.db = get_writer()
+        # Tras un apagado se saltan los pasos que la tienda ya había completado
+        marker = resume.load(self.db, resume.DAILY_KEY)
+        self.done = list(marker["steps"]) if marker else []
+        for label, func in daily_steps():
+            if label not in self.done:
+                self.tasks.append((label, functools.partial(self.step, label, func)))
+        self.tasks.append(("commit", functools.partial(self.step, "commit", lambda db: db.commit())))
+        self.tasks.append(("reanudacion", functools.partial(self.finish, marker is not None)))
+
+    def finish(self, had_marker: bool):
+        """Deja pendientes los pasos omitidos por lease para el próximo intento, o borra el marcador"""
+        if self.skipped:
+            resume.save(self.db, resume.DAILY_KEY, steps=[done for done in self.done if done != "commit"])
+        elif had_marker:
+            resume.clear(self.db, resume.DAILY_KEY)
+
+    def step(self, label: str, func: Callable) -> Any:
+        started = time.monotonic()
+        logging.info(f"🏪 [{self.tenant.name}] paso {label}...")
+        try:
+            shutdown.check(label)
+            result = func(self.db)
+            if is_skipped(result):
+                logging.warning(f"⏭️ [{self.tenant.name}] paso {label} omitido: en curso en otra instancia")
+                self.skipped[label] = result.holder
+            else:
+                self.done.append(label)
+            return result
+        except shutdown.ShutdownRequested:
+            self.db.commit()
+            resume.save(self.db, resume.DAILY_KEY, steps=[done for done in self.done if done != "commit"])
+            raise
+        finally:
+            self.timings[label] = round(time.monotonic() - started, 2)
+
+    def result(self) -> Dict[str, Any]:
+        result = {
+            "status": "error" if self.error else "omitida" if self.skipped else "success",
+            "started_at": self.started_at.isoformat(),
+            "steps_seconds": self.timings,
+        }
+        if self.error:
+            result["error"] = self.error
+        if self.skipped:
+            result["skipped_steps"] = self.skipped
+        if self.db is not None:
+            result["bigquery_costs"] = self.db.costs.report()
+        return result
+
+
+def run_tenants_daily(tenants: List[tenancy.Tenant] = None) -> Dict[str, Dict[str, Any]]:
+    """ETL diario de cada tienda con tope global de concurrencia y turnos por paso"""
+    tenants = tenants if tenants is not None else tenancy.configured_tenants()
+    runs = [_TenantRun(tenant) for tenant in tenants]
+    ready = deque(runs)
+    cap = max(1, settings.TENANT_MAX_CONCURRENCY)
+    logging.info(f"🏪 ETL multi-tienda: {len(runs)} tiendas, hasta {cap} pasos en paralelo")
+
+    with ThreadPoolExecutor(max_workers=cap, thread_name_prefix="tenant") as executor:
+        in_flight = {}
+        while ready or in_flight:
+            while ready and len(in_flight) < cap:
+                run = ready.popleft()
+                label, func = run.tasks.popleft()
+                in_flight[executor.submit(run.run, func)] = (run, label)
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                run, label = in_flight.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error(f"🔴 [{run.tenant.name}] error en {label}: {e}")
+                    run.error = f"{label}: {e}"
+                    if run.db is not None:
+                        try:
+                            run.run(run.db.rollback)
+                        except Exception:
+                            pass
+                    continue
+                if run.tasks:
+                    # Siguiente turno de la tienda: al final de la cola
+                    ready.append(run)
+                else:
+                    logging.info(f"✅ [{run.tenant.name}] ETL diario completado")
+
+    return {run.tenant.name: run.result() for run in runs}
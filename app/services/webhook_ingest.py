@@ -0,0 +1,235 @@
+# app/services/webhook_ingest.py - INGESTA DE WEBHOOKS DE BSALE EN MICRO-LOTES
+"""
+Las notificaciones de Bsale solo traen el tópico y el id del recurso
+(`{"topic": "document", "resourceId": "123", "action": "post", ...}`).
+El receptor encola los ids por entidad y un hilo los vacía en micro-lotes:
+al juntar WEBHOOK_BATCH_MAX_IDS ids o cada WEBHOOK_FLUSH_SECONDS segundos.
+Cada lote descarga solo esos recursos y los carga por el camino MERGE de
+etl_service (load_*_by_id).
+
+Con BSALE_TENANTS cada tienda registra su propia URL
+(/webhooks/bsale/tenants/{tienda}): los ids se encolan con su tienda y cada
+tienda se vacía con su contexto (token de Bsale, dataset y leases propios).
+
+Cada entidad se carga con el lease de su sincronización (sync_lock), así los
+MERGE no se cruzan con la ejecución programada. Si un lote falla, o Bsale no
+entrega un recurso por un error distinto de 404, esos ids vuelven a la cola
+para el siguiente intento.
+En Cloud Run el vaciado por tiempo necesita "CPU siempre asignada"; sin eso
+ocurre en la siguiente petición (o con POST /webhooks/bsale/flush).
+"""
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+from datetime import datetime
+import logging
+import threading
+
+from app.core import tenancy
+from app.core.config import settings
+
+# Tópico de Bsale -> entidad de la cola
+TOPIC_ENTITIES = {
+    "document": "documentos",
+    "client": "clientes",
+    "product": "productos",
+    "variant": "variantes",
+    "stock": "stock",
+}
+
+
+# Entidad de la cola -> lease de sincronización que comparte (sync_lock)
+LOCK_ENTITIES = {
+    "documentos": "documentos",
+    "clientes": "clientes",
+    "productos": "productos",
+    "variantes": "productos",
+    "stock": "stock",
+}
+
+
+def _loaders() -> Dict[str, Any]:
+    from app.services import etl_service, stock_sync
+
+    return {
+        "documentos": etl_service.load_documents_by_id,
+        "clientes": etl_service.load_clients_by_id,
+        "productos": etl_service.load_products_by_id,
+        "variantes": etl_service.load_variants_by_id,
+        "stock": stock_sync.load_stock_by_variant,
+    }
+
+
+class WebhookBatcher:
+    """Cola de ids por (tienda, entidad) con vaciado por tamaño o por tiempo"""
+
+    def __init__(self, db_factory=None):
+        self._db_factory = db_factory
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (tienda o None sin BSALE_TENANTS, entidad) -> ids
+        self._pending: Dict[Tuple[Optional[str], str], Set[int]] = {}
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats: Dict[str, Any] = {"received": 0, "ignored": 0, "flushes": 0, "failed_flushes": 0,
+                                      "last_flush": None, "last_result": None}
+
+    def _db(self):
+        if self._db_factory is None:
+            from app.db.warehouse import get_writer
+            return get_writer()
+        return self._db_factory()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(len(ids) for ids in self._pending.values())
+
+    def _requeue(self, tenant: Optional[str], entity: str, ids: Iterable[int]):
+        with self._lock:
+            self._pending.setdefault((tenant, entity), set()).update(ids)
+
+    def enqueue(self, entity: str, ids: Iterable[int], tenant: Optional[str] = None):
+        """Encola ids de la tienda indicada (por defecto la activa en el contexto)"""
+        ids = {int(i) for i in ids}
+        if not ids:
+            return
+        if tenant is None and tenancy.current() is not None:
+            tenant = tenancy.current().name
+        with self._lock:
+            self._pending.setdefault((tenant, entity), set()).update(ids)
+            self.stats["received"] += len(ids)
+            full = sum(len(pending) for pending in self._pending.values()) >= settings.WEBHOOK_BATCH_MAX_IDS
+        self._ensure_worker()
+        if full:
+            self._wake.set()
+
+    def handle_notification(self, payload: Dict[str, Any]) -> Optional[str]:
+        """Encola una notificación de Bsale. Devuelve la entidad encolada o None si se ignora."""
+        topic = str(payload.get("topic") or "").lower()
+        entity = TOPIC_ENTITIES.get(topic)
+        resource_id = payload.get("resourceId")
+        action = str(payload.get("action") or "").lower()
+        if entity is None or not str(resource_id or "").isdigit() or action == "delete":
+            # Los borrados se reconcilian en la sincronización completa
+            with self._lock:
+                self.stats["ignored"] += 1
+            logging.info(f"⏭️ Webhook ignorado: topic={topic} action={action} resourceId={resource_id}")
+            return None
+        self.enqueue(entity, [resource_id])
+        return entity
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="webhook-flusher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(settings.WEBHOOK_FLUSH_SECONDS)
+            self._wake.clear()
+            if self.pending_count():
+                try:
+                    self.flush()
+                except Exception as e:
+                    logging.error(f"🔴 Error vaciando cola de webhooks: {e}")
+
+    def flush(self) -> Dict[str, Any]:
+        """Carga todo lo encolado, cada tienda con su contexto; los ids de una entidad que falla vuelven a la cola.
+
+        Las claves del resultado son las entidades, con '@tienda' si la cola es de una tienda.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return {}
+
+            by_tenant: Dict[Optional[str], Dict[str, Set[int]]] = {}
+            for (tenant_name, entity), ids in batch.items():
+                by_tenant.setdefault(tenant_name, {})[entity] = ids
+
+            results: Dict[str, Any] = {}
+            errors = []
+            for tenant_name, entities in by_tenant.items():
+                try:
+                    if tenant_name is None:
+                        results.update(self._flush_entities(None, entities))
+                        continue
+                    tenant = tenancy.find_tenant(tenant_name)
+                    if tenant is None:
+                        logging.warning(f"⚠️ Webhooks de la tienda {tenant_name} (ya no está en BSALE_TENANTS): "
+                                        f"{sum(len(ids) for ids in entities.values())} ids descartados")
+                        results[f"@{tenant_name}"] = "tienda_desconocida"
+                        continue
+                    with tenancy.tenant_context(tenant):
+                        results.update(self._flush_entities(tenant_name, entities))
+                except Exception as e:
+                    # Sin commit nada quedó visible: el lote de la tienda ya volvió a la cola
+                    logging.error(f"🔴 Error confirmando webhooks{f' de {tenant_name}' if tenant_name else ''}: {e}")
+                    errors.append(e)
+
+            self.stats["last_result"] = results
+            if errors:
+                raise errors[0]
+            self.stats["flushes"] += 1
+            self.stats["last_flush"] = datetime.now().isoformat()
+            return results
+
+    def _flush_entities(self, tenant_name: Optional[str], batch: Dict[str, Set[int]]) -> Dict[str, Any]:
+        """Carga las entidades de una tienda (con su contexto ya activo) y confirma"""
+        from app.services import quarantine
+        from app.services.etl_service import ResourceFetchError
+        from app.services.sync_lock import is_skipped, lock_manager
+
+        loaders = _loaders()
+        results: Dict[str, Any] = {}
+        db = self._db()
+        with quarantine.quarantine_run(db, "webhooks"):
+            for entity, ids in batch.items():
+                # 'documentos' o 'documentos@tienda': misma convención que los leases
+                label = tenancy.scoped(entity)
+                loader = loaders.get(entity)
+                if loader is None:
+                    logging.info(f"ℹ️ Webhooks de {label} sin carga asociada: {len(ids)} ids descartados")
+                    results[label] = "sin_carga"
+                    continue
+                try:
+                    logging.info(f"📨 Webhooks: cargando {len(ids)} {label}...")
+                    # Con el lease de la entidad, sin unirse a otra llamada: no cruzar MERGE con la sincronización
+                    result = lock_manager.run(tenancy.scoped(LOCK_ENTITIES[entity]), loader, (db, sorted(ids)),
+                                              coalesce=False)
+                    if is_skipped(result):
+                        logging.info(f"⏭️ Webhooks de {label}: lease tomado por otra instancia, se reintentará")
+                        results[label] = result.status
+                        self._requeue(tenant_name, entity, ids)
+                        continue
+                    results[label] = result
+                except ResourceFetchError as e:
+                    # Solo los ids que Bsale no entregó (429/5xx/red) vuelven a la cola
+                    logging.warning(f"⚠️ Webhooks de {label}: {e}, se reintentarán")
+                    results[label] = {**e.counts, "reintentos": len(e.ids)}
+                    self._requeue(tenant_name, entity, e.ids)
+                except Exception as e:
+                    logging.error(f"🔴 Error cargando {label} desde webhooks, se reintentará: {e}")
+                    results[label] = f"error: {e}"
+                    self.stats["failed_flushes"] += 1
+                    self._requeue(tenant_name, entity, ids)
+            try:
+                db.commit()
+            except Exception:
+                # Sin commit nada quedó visible: todo el lote de la tienda vuelve a la cola
+                for entity, ids in batch.items():
+                    self._requeue(tenant_name, entity, ids)
+                self.stats["failed_flushes"] += 1
+                raise
+        return results
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = {f"{entity}@{tenant}" if tenant else entity: len(ids)
+                       for (tenant, entity), ids in self._pending.items()}
+        return {"pending": pending, **self.stats,
+                "batch_max_ids": settings.WEBHOOK_BATCH_MAX_IDS,
+                "flush_seconds": settings.WEBHOOK_FLUSH_SECONDS}
+
+
+webhook_batcher = WebhookBatcher()
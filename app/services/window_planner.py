@@ -0,0 +1,201 @@
+# app/services/window_planner.py - VENTANA INCREMENTAL ADAPTATIVA DE DOCUMENTOS
+"""
+Elige cuántos días hacia atrás re-sincronizar documentos y con cuántos hilos
+pedir las páginas, a partir de las ejecuciones anteriores (tabla `etl_ventana`):
+
+- Atraso: en cada ejecución se comparan huellas (cliente y montos) de los
+  documentos de la ventana antes y después de cargar; los nuevos o
+  modificados son los cambios y su atraso es hoy - fecha de emisión.
+- Ventana: el mayor atraso del historial + ADAPTIVE_WINDOW_MARGIN_DAYS. Si un
+  cambio cayó en el borde de la ventana usada el atraso real puede ser mayor
+  y la ventana se duplica. Cada ADAPTIVE_WINDOW_PROBE_EVERY ejecuciones se
+  sondea con la ventana máxima para detectar ediciones más antiguas.
+- Hilos: documentos esperados (documentos por día del historial × días) /
+  PAGE_LIMIT / ADAPTIVE_PAGES_PER_WORKER, entre 1 y ADAPTIVE_MAX_PAGE_WORKERS.
+
+Sin historial se usa ADAPTIVE_WINDOW_DEFAULT_DAYS. Cada decisión se registra
+en el log y en la fila de la ejecución.
+"""
+from typing import Any, Dict, List, NamedTuple, Optional
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+import logging
+import math
+import time
+import uuid
+
+from app.core.config import settings
+from app.db.warehouse import Column
+from app.services.bsale_client import BsaleClient
+from app.services.sync_lock import is_skipped
+
+WINDOW_TABLE = "etl_ventana"
+
+WINDOW_SCHEMA = [
+    Column("id_ejecucion", "STRING", "REQUIRED"),
+    Column("ejecutado_en", "TIMESTAMP"),
+    Column("ventana_dias", "INTEGER"),
+    Column("hilos", "INTEGER"),
+    Column("sondeo", "BOOLEAN"),
+    Column("motivo", "STRING"),
+    Column("documentos_ventana", "INTEGER"),
+    Column("documentos_cambiados", "INTEGER"),
+    Column("atraso_max_dias", "INTEGER"),
+    Column("atraso_p95_dias", "INTEGER"),
+    Column("segundos", "FLOAT"),
+]
+
+
+class WindowPlan(NamedTuple):
+    days: int
+    start_date: str
+    page_workers: int
+    probe: bool
+    expected_documents: Optional[int]
+    reason: str
+
+
+def _table(table_name: str) -> str:
+    return f"`{settings.BIGQUERY_PROJECT}.{settings.BIGQUERY_DATASET}.{table_name}`"
+
+
+def _history(db) -> List[Dict[str, Any]]:
+    """Últimas ejecuciones, de la más reciente a la más antigua"""
+    db.ensure_table_exists(WINDOW_TABLE, WINDOW_SCHEMA, partition_field="ejecutado_en")
+    rows = db.query(f"""
+    SELECT ventana_dias, sondeo, documentos_ventana, documentos_cambiados, atraso_max_dias
+    FROM {_table(WINDOW_TABLE)}
+    ORDER BY ejecutado_en DESC
+    LIMIT {int(settings.ADAPTIVE_WINDOW_HISTORY_RUNS)}
+    """)
+    return [dict(row) for row in rows]
+
+
+def _clamp(value: int, low: int, high: int) -> int:
+    return max(low, min(high, value))
+
+
+def plan_window(db, days: int = None) -> WindowPlan:
+    """Ventana y concurrencia para la próxima sincronización de documentos (days fija la ventana)"""
+    min_days, max_days = settings.ADAPTIVE_WINDOW_MIN_DAYS, settings.ADAPTIVE_WINDOW_MAX_DAYS
+    try:
+        history = _history(db)
+    except Exception as e:
+        logging.warning(f"⚠️ Sin historial de ventanas ({WINDOW_TABLE}): {e}")
+        history = []
+
+    probe = False
+    if days:
+        reason = "fija por parámetro"
+    elif not history:
+        days, reason = settings.ADAPTIVE_WINDOW_DEFAULT_DAYS, "sin historial"
+    else:
+        since_probe = next((i for i, run in enumerate(history) if run["sondeo"]), len(history))
+        lags = [run["atraso_max_dias"] for run in history if run["atraso_max_dias"] is not None]
+        max_lag = max(lags, default=0)
+        days = max_lag + settings.ADAPTIVE_WINDOW_MARGIN_DAYS
+        reason = f"atraso máximo {max_lag} días en {len(history)} ejecuciones"
+        last = history[0]
+        if last["atraso_max_dias"] is not None and last["atraso_max_dias"] >= (last["ventana_dias"] or 0):
+            # El cambio más atrasado quedó en el borde: la ventana anterior pudo cortar cambios
+            days = max(days, 2 * (last["ventana_dias"] or 1))
+            reason = f"cambios en el borde de la ventana anterior ({last['ventana_dias']} días)"
+        if since_probe >= settings.ADAPTIVE_WINDOW_PROBE_EVERY:
+            days, probe = max_days, True
+            reason = f"sondeo con la ventana máxima ({since_probe} ejecuciones desde el anterior)"
+    days = _clamp(int(days), min_days, max_days)
+
+    # Documentos por día observados -> páginas esperadas -> hilos
+    window_days = sum(run["ventana_dias"] or 0 for run in history)
+    documents = sum(run["documentos_ventana"] or 0 for run in history)
+    expected = round(documents / window_days * days) if window_days else None
+    workers = 1
+    if expected:
+        pages = math.ceil(expected / BsaleClient.PAGE_LIMIT)
+        workers = _clamp(math.ceil(pages / max(1, settings.ADAPTIVE_PAGES_PER_WORKER)), 1,
+                         settings.ADAPTIVE_MAX_PAGE_WORKERS)
+
+    start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    plan = WindowPlan(days, start_date, workers, probe, expected, reason)
+    logging.info(f"🪟 Ventana incremental: {days} días desde {start_date}, {workers} hilos "
+                 f"(~{expected if expected is not None else '?'} documentos) - {reason}")
+    return plan
+
+
+def _fingerprints(db, since: date) -> Dict[int, tuple]:
+    """id_documento -> (fecha, huella de cliente y montos) de los documentos vigentes desde `since`"""
+    fecha = db.date_expression("fecha_emision")
+    rows = db.query(f"""
+    SELECT id_documento AS id, {fecha} AS fecha, id_cliente, monto_neto, monto_iva, monto_total
+    FROM {_table("documento_venta")}
+    WHERE {fecha} >= {db.date_literal(since.isoformat())} AND eliminado_en IS NULL
+    """)
+    prints = {}
+    for row in rows:
+        value = row["fecha"]
+        emission = value if isinstance(value, date) or value is None else date.fromisoformat(str(value))
+        prints[int(row["id"])] = (emission, hash((row["id_cliente"], row["monto_neto"], row["monto_iva"], row["monto_total"])))
+    return prints
+
+
+def _percentile(values: List[int], fraction: float) -> Optional[int]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+def sync_documents_adaptive(db, days: int = None) -> Dict[str, Any]:
+    """Sincroniza documentos con la ventana planificada y registra cambios y atrasos observados.
+
+    Devuelve el LockBusy de sync_documents si otra instancia tiene el lease.
+    """
+    from app.services import etl_service
+
+    plan = plan_window(db, days)
+    since = datetime.strptime(plan.start_date, '%Y-%m-%d').date()
+    db.ensure_all_tables()
+    try:
+        before = _fingerprints(db, since)
+    except Exception as e:
+        logging.warning(f"⚠️ No se pudieron leer huellas de documentos (sin estadísticas de ventana): {e}")
+        before = None
+
+    started = time.monotonic()
+    counts = etl_service.sync_documents(db, start_date=plan.start_date, page_workers=plan.page_workers)
+    seconds = round(time.monotonic() - started, 2)
+
+    if is_skipped(counts):
+        # Otra instancia tiene el lease: esta ejecución no observó cambios
+        return counts
+    result = {"window": plan._asdict(), "counts": counts}
+    if not before:
+        # Sin huellas previas (error o carga inicial) todo parecería cambiado: no se registra atraso
+        return result
+    try:
+        after = _fingerprints(db, since)
+        today = datetime.now(ZoneInfo(db.report_timezone)).date()
+        lags = [max(0, (today - emission).days) for doc_id, (emission, fingerprint) in after.items()
+                if emission is not None and before.get(doc_id, (None, None))[1] != fingerprint]
+        stats = {
+            "documentos_ventana": len(after),
+            "documentos_cambiados": len(lags),
+            "atraso_max_dias": max(lags, default=None),
+            "atraso_p95_dias": _percentile(lags, 0.95),
+        }
+        db.insert_rows(WINDOW_TABLE, [{
+            "id_ejecucion": uuid.uuid4().hex,
+            "ejecutado_en": time.time(),
+            "ventana_dias": plan.days,
+            "hilos": plan.page_workers,
+            "sondeo": plan.probe,
+            "motivo": plan.reason,
+            "segundos": seconds,
+            **stats,
+        }])
+        logging.info(f"🪟 Ventana {plan.days} días: {stats['documentos_cambiados']} de {stats['documentos_ventana']} "
+                     f"documentos cambiaron (atraso máximo {stats['atraso_max_dias']} días) en {seconds}s")
+        result["stats"] = stats
+    except Exception as e:
+        logging.error(f"🔴 No se pudieron registrar las estadísticas de ventana en {WINDOW_TABLE}: {e}")
+    return result
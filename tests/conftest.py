@@ -0,0 +1,26 @@
+# tests/conftest.py - entorno mínimo para importar la app sin GCP ni Bsale
+import os
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix="etl_tests_")
+
+os.environ.setdefault("BSALE_API_TOKEN", "test-token")
+os.environ.setdefault("BIGQUERY_PROJECT", "test-project")
+os.environ.setdefault("BIGQUERY_DATASET", "test_dataset")
+os.environ["WAREHOUSE_BACKEND"] = "sqlite"
+os.environ["LOCAL_WAREHOUSE_PATH"] = os.path.join(_TMP, "etl_test.db")
+os.environ["SYNC_LOCK_BACKEND"] = "local"
+os.environ["SYNC_LOCK_DIR"] = os.path.join(_TMP, "locks")
+
+import pytest  # noqa: E402
+
+from app.db.local_warehouse import SQLiteWriter  # noqa: E402
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    """Warehouse SQLite vacío con todas las tablas creadas"""
+    db = SQLiteWriter(str(tmp_path / "warehouse.db"))
+    db.ensure_all_tables()
+    yield db
+    db.connection.close()
@@ -0,0 +1,15 @@
+# tests/test_etl_preview.py - vista previa del ETL sin escribir
+from app.services import etl_preview
+
+
+def test_table_plan_reports_duplicate_keys_of_the_raw_rows(sqlite_db):
+    rows = [{"id_cliente": 1, "nombre": "A"}, {"id_cliente": 2, "nombre": "B"},
+            {"id_cliente": 1, "nombre": "A2"}, {"id_cliente": 1, "nombre": "A3"}]
+
+    plan = etl_preview._table_plan(sqlite_db, "cliente", "id_cliente", rows, sampled=4, total=8,
+                                   estimate_bytes=False)
+
+    assert plan["rows"] == 4
+    assert plan["duplicates_dropped"] == 2
+    assert plan["duplicate_keys"] == 1 and plan["duplicate_key_sample"] == [1]
+    assert plan["merge_statements"] == 1
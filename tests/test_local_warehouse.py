@@ -0,0 +1,46 @@
+# tests/test_local_warehouse.py - backend SQLite del warehouse (mismo contrato que BigQuery MERGE)
+import pytest
+
+
+def _clients(db):
+    return [tuple(row) for row in db.query("SELECT id_cliente, nombre, rut FROM cliente ORDER BY id_cliente")]
+
+
+def test_upsert_updates_only_update_columns_and_inserts_new_keys(sqlite_db):
+    sqlite_db.upsert_rows("cliente", [{"id_cliente": 1, "nombre": "Ana", "rut": "1-9"}], "id_cliente",
+                          ["nombre", "rut"])
+    sqlite_db.upsert_rows("cliente", [{"id_cliente": 1, "nombre": "Ana María", "rut": "2-7"},
+                                      {"id_cliente": 2, "nombre": "Beto", "rut": "3-5"}], "id_cliente", ["nombre"])
+
+    assert _clients(sqlite_db) == [(1, "Ana María", "1-9"), (2, "Beto", "3-5")]
+
+
+def test_upsert_with_repeated_keys_fails_like_merge(sqlite_db):
+    with pytest.raises(ValueError, match="at most one source row"):
+        sqlite_db.upsert_rows("cliente", [{"id_cliente": 1, "nombre": "A"}, {"id_cliente": 1, "nombre": "B"}],
+                              "id_cliente", ["nombre"])
+    assert _clients(sqlite_db) == []
+
+
+def test_merge_select_and_qualified_names(sqlite_db):
+    sqlite_db.insert_rows("cliente", [{"id_cliente": 1, "nombre": "Ana"}])
+
+    sqlite_db.merge_select("cliente", """
+    SELECT id_cliente, nombre || ' (copia)' AS nombre, rut FROM `proyecto.dataset.cliente`
+    UNION ALL SELECT 2, 'Beto', NULL
+    """, ["id_cliente"], ["id_cliente", "nombre", "rut"])
+
+    assert _clients(sqlite_db) == [(1, "Ana (copia)", None), (2, "Beto", None)]
+
+
+def test_replace_where_keeps_the_old_rows_if_the_select_fails(sqlite_db):
+    sqlite_db.insert_rows("cliente", [{"id_cliente": 1, "nombre": "Ana"}, {"id_cliente": 2, "nombre": "Beto"}])
+
+    with pytest.raises(Exception):
+        sqlite_db.replace_where("cliente", "target.id_cliente = 1", "SELECT * FROM tabla_inexistente",
+                                ["id_cliente", "nombre"])
+    assert len(_clients(sqlite_db)) == 2
+
+    sqlite_db.replace_where("cliente", "target.id_cliente = 1", "SELECT 1 AS id_cliente, 'Ana 2' AS nombre",
+                            ["id_cliente", "nombre"])
+    assert _clients(sqlite_db) == [(1, "Ana 2", None), (2, "Beto", None)]
@@ -0,0 +1,93 @@
+# tests/test_products.py - expansión de productos a filas por variante
+import pytest
+
+from app.services import etl_service, quarantine
+from app.services.bsale_client import bsale_client
+
+
+def _variant(variant_id, state=0):
+    return {"id": variant_id, "code": f"SKU-{variant_id}", "state": state,
+            "costs": {"averageCost": 100, "history": [{"cost": 100}]}}
+
+
+PRODUCT = {"id": 10, "name": "Polera", "variants": {"items": [_variant(1), _variant(2), _variant(3, state=1)]}}
+
+
+@pytest.fixture
+def bsale_prices(monkeypatch):
+    """Precio 1000 para toda variante; registra los endpoints pedidos"""
+    calls = []
+
+    def fake_fetch(endpoint, params=None):
+        calls.append(endpoint)
+        return {"items": [{"variantValue": 1000}]}
+
+    monkeypatch.setattr(bsale_client, "fetch", fake_fetch)
+    return calls
+
+
+def _expand(options):
+    with quarantine.collect("test") as rejections:
+        rows = etl_service._expand_product(PRODUCT, etl_service._product_context(False, options))
+    return rows, rejections
+
+
+def test_first_variant_mode_loads_only_the_first_active_variant(bsale_prices):
+    rows, rejections = _expand({"mode": "first_variant"})
+    assert [row["id_producto"] for row in rows] == [1]
+    assert bsale_prices == ["price_lists/2/details.json"]
+
+
+def test_variants_mode_loads_every_active_variant(bsale_prices):
+    rows, rejections = _expand({"mode": "variants"})
+    assert [(row["id_producto"], row["id_producto_padre"], row["precio_neto"]) for row in rows] == \
+        [(1, 10, 1000.0), (2, 10, 1000.0)]
+    assert not rejections.rows
+
+
+def test_bulk_variants_mode_uses_the_price_and_cost_listings(monkeypatch):
+    listings = {
+        "price_lists/2/details.json": [{"variant": {"id": 1}, "variantValue": 900},
+                                       {"variant": {"id": 2}, "variantValue": 800}],
+        etl_service.COST_LISTING_ENDPOINT: [{"variant": {"id": 2}, "averageCost": 300, "history": [{"cost": 300}]}],
+    }
+    pages = []
+    monkeypatch.setattr(bsale_client, "_get_all_pages",
+                        lambda endpoint, params=None, stable=False: pages.append(endpoint) or listings[endpoint])
+    monkeypatch.setattr(bsale_client, "fetch",
+                        lambda endpoint, params=None: pytest.fail(f"petición por variante: {endpoint}"))
+    product = {"id": 10, "name": "Polera", "variants": {"items": [_variant(1), {**_variant(2), "costs": None}]}}
+
+    with quarantine.collect("test"):
+        context = etl_service._product_context(True, {"mode": "variants"})
+        rows = etl_service._expand_product(product, context)
+
+    assert [(row["id_producto"], row["precio_neto"], row["costo_neto"]) for row in rows] == \
+        [(1, 900.0, 100.0), (2, 800.0, 300.0)]
+    assert pages == ["price_lists/2/details.json", etl_service.COST_LISTING_ENDPOINT]
+
+
+def test_requested_variants_load_even_if_not_first_or_inactive(bsale_prices):
+    rows, rejections = _expand({"mode": "variants", "variant_ids": [2, 3]})
+    assert [(row["id_producto"], row["estado"]) for row in rows] == [(2, 1), (3, 0)]
+    assert not rejections.rows
+
+
+def test_load_variants_by_id_loads_orphan_second_variant(sqlite_db, bsale_prices, monkeypatch):
+    resources = {"variants/2.json": {"id": 2, "product": {"id": 10}}, "products/10.json": PRODUCT}
+    monkeypatch.setattr(bsale_client, "fetch_resource", lambda endpoint, params=None: resources[endpoint])
+
+    counts = etl_service.load_variants_by_id(sqlite_db, [2])
+
+    assert counts["producto"] == 1
+    assert [row["id_producto"] for row in sqlite_db.query("SELECT id_producto FROM producto")] == [2]
+
+
+def test_estimated_cost_warning_records_the_variant_id(bsale_prices):
+    product = {"id": 11, "name": "Collar", "variants": {"items": [{"id": 7, "code": "SKU-7", "state": 0,
+                                                                    "costs": {"averageCost": 0, "history": []}}]}}
+    with quarantine.collect("test") as rejections:
+        rows = etl_service._expand_product(product, etl_service._product_context(False, {"mode": "variants"}))
+
+    assert rows[0]["costo_neto"] == 650
+    assert [(row["id_registro"], row["codigo_motivo"]) for row in rejections.rows] == [("7", "COSTO_ESTIMADO")]
@@ -0,0 +1,38 @@
+# tests/test_profiling.py - profiler por muestreo
+import threading
+import time
+
+from app.core import profiling
+
+
+def _busy_worker(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def _idle_preexisting(stop):
+    stop.wait(5)
+
+
+def _sampled_functions(profiler, stage_name=None):
+    return {label.split(" ")[0] for (name, labels) in profiler.stacks
+            if stage_name in (None, name) for label in labels}
+
+
+def test_threads_started_during_the_run_are_sampled_under_its_stage():
+    idle_stop, stop = threading.Event(), threading.Event()
+    idle = threading.Thread(target=_idle_preexisting, args=(idle_stop,), daemon=True)
+    idle.start()
+    profiler = profiling.SamplingProfiler(interval_ms=1)
+    profiler.start()
+    with profiling.stage("productos"):
+        worker = threading.Thread(target=_busy_worker, args=(stop,))
+        worker.start()
+        time.sleep(0.2)
+        stop.set()
+        worker.join()
+    profiler.stop()
+    idle_stop.set()
+
+    assert "_busy_worker" in _sampled_functions(profiler, "productos")
+    assert "_idle_preexisting" not in _sampled_functions(profiler)
@@ -0,0 +1,55 @@
+# tests/test_reconciliation.py - borrados y anulaciones por diferencia de claves
+import time
+
+import pytest
+
+from app.services import etl_service, reconciliation
+from app.services.bsale_client import bsale_client
+
+
+def _load_documents(db, ids):
+    now = int(time.time())
+    db.insert_rows("documento_venta", [{"id_documento": i, "fecha_emision": now, "monto_total": 10.0} for i in ids])
+    db.insert_rows("detalle_documento", [{"id_detalle": i * 10, "id_documento": i} for i in ids])
+
+
+def _bsale(monkeypatch, active, inactive=()):
+    items = [{"id": i, "state": 0} for i in active] + [{"id": i, "state": 1} for i in inactive]
+    monkeypatch.setattr(bsale_client, "iter_pages", lambda resource, params=None, stable=False: iter([items]))
+
+
+def _ids(db, table, key):
+    return sorted(row[0] for row in db.query(f"SELECT {key} FROM {table}"))
+
+
+def test_delete_mode_removes_documents_and_details(sqlite_db, monkeypatch):
+    _load_documents(sqlite_db, [1, 2, 3])
+    _bsale(monkeypatch, active=[1], inactive=[3])
+
+    result = reconciliation.reconcile(sqlite_db, "documents", mode="delete", force=True)
+
+    assert result["status"] == "aplicada" and result["removed"] == 2
+    assert _ids(sqlite_db, "documento_venta", "id_documento") == [1]
+    assert _ids(sqlite_db, "detalle_documento", "id_documento") == [1]
+
+
+def test_delete_keys_is_all_or_nothing(sqlite_db):
+    _load_documents(sqlite_db, [1, 2])
+
+    with pytest.raises(Exception):
+        sqlite_db.delete_keys(["detalle_documento", "tabla_inexistente"], "id_documento", [1])
+
+    assert _ids(sqlite_db, "detalle_documento", "id_documento") == [1, 2]
+
+
+def test_upsert_of_an_active_record_clears_the_tombstone(sqlite_db, monkeypatch):
+    client = {"id": 5, "firstName": "Ana", "state": 0}
+    columns = etl_service.MERGE_UPDATE_COLUMNS["cliente"]
+    sqlite_db.upsert_rows("cliente", [etl_service.ETLDataValidator.validate_client(client)], "id_cliente", columns)
+    _bsale(monkeypatch, active=[])
+
+    reconciliation.reconcile(sqlite_db, "clients", force=True)
+    assert list(sqlite_db.query("SELECT eliminado_en FROM cliente"))[0][0] is not None
+
+    sqlite_db.upsert_rows("cliente", [etl_service.ETLDataValidator.validate_client(client)], "id_cliente", columns)
+    assert list(sqlite_db.query("SELECT eliminado_en FROM cliente"))[0][0] is None
@@ -0,0 +1,64 @@
+# tests/test_resume.py - pasos del ETL diario: reanudación tras apagado y leases ocupados
+import pytest
+
+from app.core import shutdown
+from app.services import resume
+from app.services.sync_lock import LockBusy
+
+
+@pytest.fixture
+def no_shutdown():
+    yield
+    shutdown._event.clear()
+
+
+def _step(label, calls, result=None, raises=None):
+    def func(db):
+        calls.append(label)
+        if raises is not None:
+            raises()
+        return result
+    return label, func
+
+
+def test_lock_busy_step_is_not_marked_done(sqlite_db):
+    calls = []
+    busy = LockBusy("productos", {"owner": "otra"})
+    steps = [_step("clientes", calls), _step("productos", calls, result=busy), _step("documentos", calls)]
+
+    skipped = resume.run_steps(sqlite_db, steps)
+
+    assert skipped == {"productos": busy}
+    assert calls == ["clientes", "productos", "documentos"]
+    assert resume.load(sqlite_db, resume.DAILY_KEY)["steps"] == ["clientes", "documentos"]
+
+    # El reintento solo repite el paso omitido y borra el marcador
+    calls.clear()
+    steps[1] = _step("productos", calls)
+    assert resume.run_steps(sqlite_db, steps) == {}
+    assert calls == ["productos"]
+    assert resume.load(sqlite_db, resume.DAILY_KEY) is None
+
+
+def _sigterm():
+    shutdown.request("test")
+    shutdown.check("productos")
+
+
+def test_shutdown_saves_completed_steps_and_resumes(sqlite_db, no_shutdown):
+    calls = []
+    steps = [_step("clientes", calls),
+             _step("productos", calls, raises=_sigterm),
+             _step("documentos", calls)]
+
+    with pytest.raises(shutdown.ShutdownRequested):
+        resume.run_steps(sqlite_db, steps)
+    assert calls == ["clientes", "productos"]
+    assert resume.load(sqlite_db, resume.DAILY_KEY)["steps"] == ["clientes"]
+
+    shutdown._event.clear()
+    calls.clear()
+    steps[1] = _step("productos", calls)
+    assert resume.run_steps(sqlite_db, steps) == {}
+    assert calls == ["productos", "documentos"]
+    assert resume.load(sqlite_db, resume.DAILY_KEY) is None
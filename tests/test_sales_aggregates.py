@@ -0,0 +1,63 @@
+# tests/test_sales_aggregates.py - agregados diarios recalculados solo para las fechas tocadas
+from datetime import date
+
+from app.services import sales_aggregates
+
+# 2024-03-01 12:00 y 2024-03-02 12:00 UTC
+DAY_1, DAY_2 = 1709294400, 1709380800
+
+
+def _load(db):
+    db.insert_rows("producto", [{"id_producto": 10, "costo_neto": 2.0}])
+    db.insert_rows("documento_venta", [
+        {"id_documento": 1, "id_cliente": 7, "id_tipo_documento": 3, "fecha_emision": DAY_1,
+         "monto_neto": 100.0, "monto_iva": 19.0, "monto_total": 119.0},
+        {"id_documento": 2, "id_cliente": 7, "id_tipo_documento": 3, "fecha_emision": DAY_1,
+         "monto_neto": 50.0, "monto_iva": 9.5, "monto_total": 59.5},
+        {"id_documento": 3, "id_cliente": 8, "id_tipo_documento": 3, "fecha_emision": DAY_2,
+         "monto_neto": 10.0, "monto_iva": 1.9, "monto_total": 11.9},
+    ])
+    db.insert_rows("detalle_documento", [
+        {"id_detalle": 1, "id_documento": 1, "id_producto": 10, "cantidad": 4, "monto_total_linea": 100.0},
+        {"id_detalle": 2, "id_documento": 2, "id_producto": 10, "cantidad": 1, "monto_total_linea": 50.0},
+        {"id_detalle": 3, "id_documento": 3, "id_producto": 10, "cantidad": 1, "monto_total_linea": 10.0},
+    ])
+
+
+def _by_client(db):
+    return [tuple(row) for row in db.query(
+        "SELECT fecha, id_cliente, monto_total, num_documentos FROM ventas_diarias_cliente ORDER BY fecha")]
+
+
+def test_touched_dates_uses_the_warehouse_timezone(sqlite_db):
+    documents = [{"fecha_emision": DAY_1}, {"fecha_emision": "2024-03-02T23:30:00+00:00"}, {}]
+    assert sales_aggregates.touched_dates(sqlite_db, documents) == {date(2024, 3, 1), date(2024, 3, 2)}
+
+
+def test_refresh_recomputes_only_the_requested_dates(sqlite_db):
+    _load(sqlite_db)
+
+    refreshed = sales_aggregates.refresh_sales_aggregates(sqlite_db, [date(2024, 3, 1)])
+
+    assert refreshed == list(sales_aggregates.AGGREGATE_SCHEMAS)
+    assert _by_client(sqlite_db) == [("2024-03-01", 7, 178.5, 2)]
+    product = [tuple(row) for row in sqlite_db.query(
+        "SELECT fecha, id_producto, cantidad, monto_neto, costo_neto_total FROM ventas_diarias_producto")]
+    assert product == [("2024-03-01", 10, 5.0, 150.0, 10.0)]
+
+
+def test_refresh_is_idempotent_and_skips_tombstoned_documents(sqlite_db):
+    _load(sqlite_db)
+    sales_aggregates.refresh_sales_aggregates(sqlite_db, [date(2024, 3, 1), date(2024, 3, 2)])
+    sales_aggregates.refresh_sales_aggregates(sqlite_db, [date(2024, 3, 1), date(2024, 3, 2)])
+    assert _by_client(sqlite_db) == [("2024-03-01", 7, 178.5, 2), ("2024-03-02", 8, 11.9, 1)]
+
+    sqlite_db.upsert_rows("documento_venta", [{"id_documento": 2, "eliminado_en": DAY_2}], "id_documento",
+                          ["eliminado_en"])
+    sales_aggregates.refresh_sales_aggregates(sqlite_db, [date(2024, 3, 1)])
+
+    assert _by_client(sqlite_db) == [("2024-03-01", 7, 119.0, 1), ("2024-03-02", 8, 11.9, 1)]
+
+
+def test_refresh_without_dates_does_nothing(sqlite_db):
+    assert sales_aggregates.refresh_sales_aggregates(sqlite_db, []) == []
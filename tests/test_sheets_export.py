@@ -0,0 +1,16 @@
+# tests/test_sheets_export.py - lectura paginada de tablas para Google Sheets
+from app.services.sheets_export import iter_table_pages
+
+
+def test_iter_table_pages_reads_one_query_in_pages(sqlite_db, monkeypatch):
+    sqlite_db.insert_rows("cliente", [{"id_cliente": i, "nombre": f"Cliente {i}"} for i in (5, 1, 4, 2, 3, 7, 6)])
+    statements = []
+    original = sqlite_db.query_pages
+    monkeypatch.setattr(sqlite_db, "query_pages",
+                        lambda sql, page_size: statements.append(sql) or original(sql, page_size))
+
+    pages = list(iter_table_pages(sqlite_db, "cliente", 3))
+
+    assert [[row["id_cliente"] for row in page] for page in pages] == [[1, 2, 3], [4, 5, 6], [7]]
+    assert pages[0][0]["nombre"] == "Cliente 1"
+    assert len(statements) == 1
@@ -0,0 +1,24 @@
+# tests/test_stock_sync.py - foto diaria de stock
+from app.services import stock_sync
+from app.services.bsale_client import bsale_client
+
+
+def _stock(variant_id, office_id, quantity):
+    return {"id": variant_id * 100 + office_id, "variant": {"id": variant_id}, "office": {"id": office_id},
+            "quantity": quantity, "quantityReserved": 0, "quantityAvailable": quantity}
+
+
+def test_rerun_replaces_the_day_partition(sqlite_db, monkeypatch):
+    pages = [[_stock(1, 1, 5), _stock(1, 1, 5), _stock(2, 1, 3)], [_stock(2, 1, 3)]]
+    monkeypatch.setattr(bsale_client, "iter_stocks", lambda workers=4: iter(pages))
+
+    stock_sync.sync_stock(sqlite_db)
+    pages = [[_stock(1, 1, 7)]]
+    result = stock_sync.sync_stock(sqlite_db)
+
+    assert result["stock_diario"] == 1
+    snapshot = [tuple(row) for row in sqlite_db.query("SELECT id_variante, cantidad FROM stock_diario")]
+    assert snapshot == [(1, 7.0)]
+    latest = [tuple(row) for row in sqlite_db.query(
+        "SELECT id_variante, cantidad FROM stock_actual ORDER BY id_variante")]
+    assert latest == [(1, 7.0), (2, 3.0)]
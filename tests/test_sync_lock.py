@@ -0,0 +1,104 @@
+# tests/test_sync_lock.py - leases por entidad y unión de llamadas en vuelo
+import threading
+import time
+
+from app.db.query_cost import QueryCostLedger
+from app.services.sync_lock import (BigQueryLeaseStore, EntityLockManager, LocalFileLeaseStore, LockBusy,
+                                    is_skipped)
+
+
+def test_local_lease_is_exclusive_until_released(tmp_path):
+    store = LocalFileLeaseStore(str(tmp_path))
+
+    assert store.acquire("clientes", "a", 60)
+    assert not store.acquire("clientes", "b", 60)
+    assert store.holder("clientes")["owner"] == "a"
+    store.release("clientes", "a")
+    assert store.holder("clientes") is None
+    assert store.acquire("clientes", "b", 60)
+
+
+def test_expired_local_lease_can_be_taken(tmp_path):
+    store = LocalFileLeaseStore(str(tmp_path))
+
+    assert store.acquire("clientes", "a", -1)
+    assert store.acquire("clientes", "b", 60)
+
+
+def test_run_returns_lock_busy_when_another_instance_holds_the_lease(tmp_path):
+    store = LocalFileLeaseStore(str(tmp_path))
+    store.acquire("productos", "otra-instancia", 60)
+    manager = EntityLockManager(store, ttl_seconds=60)
+
+    result = manager.run("productos", lambda: "cargado")
+
+    assert is_skipped(result)
+    assert isinstance(result, LockBusy) and result.holder["owner"] == "otra-instancia"
+
+
+def test_identical_calls_coalesce_and_different_ones_wait(tmp_path):
+    manager = EntityLockManager(LocalFileLeaseStore(str(tmp_path)), ttl_seconds=60)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def sync(start_date):
+        calls.append(start_date)
+        started.set()
+        release.wait(5)
+        return {"documento_venta": len(calls)}
+
+    threads = [threading.Thread(target=lambda d=d: results.append(manager.run("documentos", sync, (d,))))
+               for d in ("2024-01-01", "2024-01-01", "2024-02-01")]
+    results = []
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # La llamada idéntica se une a la primera; la otra espera el lock de la entidad
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert sorted(calls) == ["2024-01-01", "2024-02-01"]
+    assert len(results) == 3 and not any(is_skipped(result) for result in results)
+
+
+class _FakeJob:
+    def __init__(self, affected):
+        self.num_dml_affected_rows = affected
+        self.total_bytes_billed = 0
+
+    def result(self):
+        return []
+
+
+class _FakeBigQuery:
+    """Cliente con una fila de lease en memoria; UPDATE solo afecta si está libre"""
+
+    def __init__(self):
+        self.client = self
+        self.costs = QueryCostLedger()
+        self.rows = []
+        self.owner = None
+
+    def query(self, sql):
+        if sql.lstrip().startswith("INSERT"):
+            added = 0 if self.rows else 1
+            self.rows += [None] * added
+            return _FakeJob(added)
+        owner = sql.split('propietario = "')[1].split('"')[0]
+        taken = self.owner in (None, owner)
+        if taken:
+            self.owner = owner
+        return _FakeJob(len(self.rows) if taken else 0)
+
+
+def test_bigquery_lease_uses_affected_rows_of_the_conditional_update():
+    store = BigQueryLeaseStore()
+    store._writer = fake = _FakeBigQuery()
+    store._table = lambda: "`p.d.etl_lock`"
+
+    assert store.acquire("clientes", "a", 60)
+    assert not store.acquire("clientes", "b", 60)
+    assert len(fake.rows) == 1
@@ -0,0 +1,23 @@
+# tests/test_webhook_endpoints.py - token compartido de los webhooks
+import pytest
+from fastapi import HTTPException
+
+from app.api.webhook_endpoints import _check_token
+from app.core.config import override_settings
+
+
+@pytest.mark.parametrize("configured, token, status", [
+    (None, None, 503),
+    (None, "cualquiera", 503),
+    ("secreto", None, 403),
+    ("secreto", "otro", 403),
+])
+def test_rejected_tokens(configured, token, status):
+    with override_settings({"WEBHOOK_TOKEN": configured}), pytest.raises(HTTPException) as error:
+        _check_token(token)
+    assert error.value.status_code == status
+
+
+def test_matching_token_is_accepted():
+    with override_settings({"WEBHOOK_TOKEN": "secreto"}):
+        _check_token("secreto")
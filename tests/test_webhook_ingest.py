@@ -0,0 +1,35 @@
+# tests/test_webhook_ingest.py - cola de webhooks por tienda
+from app.core import tenancy
+from app.core.config import settings
+from app.services import webhook_ingest
+from app.services.webhook_ingest import WebhookBatcher
+
+TENANTS = {name: tenancy.Tenant(name, f"token-{name}", f"bsale_{name}") for name in ("centro", "norte")}
+
+
+def test_each_tenant_flushes_under_its_own_context(sqlite_db, monkeypatch):
+    loaded = []
+
+    def load_documents(db, ids):
+        loaded.append((settings.BIGQUERY_DATASET, settings.BSALE_API_TOKEN, ids))
+        return {"documento_venta": len(ids)}
+
+    monkeypatch.setattr(webhook_ingest, "_loaders", lambda: {"documentos": load_documents})
+    monkeypatch.setattr(tenancy, "find_tenant", TENANTS.get)
+    batcher = WebhookBatcher(db_factory=lambda: sqlite_db)
+    monkeypatch.setattr(batcher, "_ensure_worker", lambda: None)
+
+    batcher.enqueue("documentos", [1, 2])
+    with tenancy.tenant_context(TENANTS["centro"]):
+        batcher.handle_notification({"topic": "document", "resourceId": "3", "action": "post"})
+    batcher.enqueue("documentos", [4], tenant="norte")
+    assert batcher.status()["pending"] == {"documentos": 2, "documentos@centro": 1, "documentos@norte": 1}
+
+    results = batcher.flush()
+
+    assert sorted(loaded) == sorted([(settings.BIGQUERY_DATASET, settings.BSALE_API_TOKEN, [1, 2]),
+                                     ("bsale_centro", "token-centro", [3]),
+                                     ("bsale_norte", "token-norte", [4])])
+    assert results == {"documentos": {"documento_venta": 2}, "documentos@centro": {"documento_venta": 1},
+                       "documentos@norte": {"documento_venta": 1}}
+    assert batcher.pending_count() == 0
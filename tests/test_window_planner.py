@@ -0,0 +1,48 @@
+# tests/test_window_planner.py - ventana incremental elegida a partir del historial de ejecuciones
+from app.services import window_planner
+from app.services.window_planner import WINDOW_SCHEMA, WINDOW_TABLE
+
+
+def _history(db, *runs):
+    """runs de la más antigua a la más reciente: (ventana_dias, atraso_max_dias, documentos_ventana, sondeo)"""
+    db.ensure_table_exists(WINDOW_TABLE, WINDOW_SCHEMA, partition_field="ejecutado_en")
+    db.insert_rows(WINDOW_TABLE, [
+        {"id_ejecucion": f"r{i}", "ejecutado_en": 1700000000 + i * 86400, "ventana_dias": days,
+         "atraso_max_dias": lag, "documentos_ventana": documents, "sondeo": probe}
+        for i, (days, lag, documents, probe) in enumerate(runs)
+    ])
+
+
+def test_without_history_uses_the_default_window(sqlite_db):
+    plan = window_planner.plan_window(sqlite_db)
+
+    assert (plan.days, plan.page_workers, plan.probe, plan.expected_documents) == (7, 1, False, None)
+    assert plan.reason == "sin historial"
+
+
+def test_window_follows_the_largest_lag_plus_margin(sqlite_db):
+    _history(sqlite_db, (10, 4, 1000, True), (10, 2, 1000, False))
+
+    plan = window_planner.plan_window(sqlite_db)
+
+    assert plan.days == 5
+    assert plan.expected_documents == 500
+
+
+def test_window_doubles_when_the_last_change_hit_the_edge(sqlite_db):
+    _history(sqlite_db, (3, 1, 30, True), (3, 3, 30, False))
+
+    assert window_planner.plan_window(sqlite_db).days == 6
+
+
+def test_probe_with_the_maximum_window_and_more_workers(sqlite_db):
+    _history(sqlite_db, *[(10, 1, 50000, False)] * 7)
+
+    plan = window_planner.plan_window(sqlite_db)
+
+    # 5000 documentos/día × 30 días = 1500 páginas de 100 -> 75 hilos, acotado a ADAPTIVE_MAX_PAGE_WORKERS
+    assert (plan.days, plan.probe, plan.page_workers) == (30, True, 4)
+
+
+def test_fixed_days_are_clamped(sqlite_db):
+    assert window_planner.plan_window(sqlite_db, days=90).days == 30